@@ -0,0 +1,95 @@
+"""
+Compare local CPU inference backends on real evaluation prompts.
+
+Loads the same small instruct model as a plain HFClient (float32, no prefix reuse)
+and as HFClientCPU with each requested quantization, evaluates synthetic transcripts
+with every CEFR dimension one prompt at a time, and reports load time, per-prompt
+latency, decode throughput and how many responses parsed as valid JSON.
+
+Usage:
+    HF_TOKEN=... python benchmarks/cpu_inference.py --model_path Qwen/Qwen2.5-0.5B-Instruct \
+        --backends hf,cpu_fp32,cpu_int8,cpu_int4 --transcripts 5 --threads 8
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from evaluator.evaluators import GrammarEvaluator, CoherenceEvaluator, RangeEvaluator, InteractionEvaluator, FluencyEvaluator
+from utils.instrumentation import Instrumentation, set_instrumentation
+from utils.local_llm import HFClient, HFClientCPU
+
+EVALUATORS = [GrammarEvaluator, CoherenceEvaluator, RangeEvaluator, InteractionEvaluator, FluencyEvaluator]
+
+BACKENDS = {
+    "hf": lambda args: HFClient(model_path=args.model_path, batch_size=1),
+    "cpu_fp32": lambda args: HFClientCPU(model_path=args.model_path, quantization=None, num_threads=args.threads),
+    "cpu_int8": lambda args: HFClientCPU(model_path=args.model_path, quantization="int8", num_threads=args.threads),
+    "cpu_int4": lambda args: HFClientCPU(model_path=args.model_path, quantization="int4", num_threads=args.threads),
+}
+
+
+def make_transcript(index: int, turns: int) -> str:
+    lines = []
+    for turn in range(turns):
+        lines.append(f"Assistant: What did you do last weekend, part {turn}?")
+        lines.append(f"User: Last weekend I goes to the park with my friend {index} and we was playing football.")
+    return "\n".join(lines)
+
+
+def run_backend(name: str, args: argparse.Namespace) -> dict:
+    instrumentation = Instrumentation()
+    set_instrumentation(instrumentation)
+
+    start = time.perf_counter()
+    llm = BACKENDS[name](args)
+    load_seconds = time.perf_counter() - start
+
+    latencies, parsed = [], 0
+    evaluators = [evaluator_class(llm=llm) for evaluator_class in EVALUATORS]
+    # Transcript-major order, as in text_evaluation.py: consecutive prompts have different rubrics
+    for i in range(args.transcripts):
+        for evaluator in evaluators:
+            prompt = evaluator.pre_process(make_transcript(i, args.turns))
+            start = time.perf_counter()
+            response = llm.generate(prompt, max_new_tokens=args.max_new_tokens)
+            latencies.append(time.perf_counter() - start)
+            result = evaluator.post_process(response)
+            parsed += result.get("reasoning") != "Error processing response"
+    llm.close()
+
+    records = instrumentation.records
+    completion_tokens = sum(record.completion_tokens or 0 for record in records)
+    return {
+        "load_seconds": load_seconds,
+        "p50": statistics.median(latencies),
+        "p95": sorted(latencies)[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        "tokens_per_second": completion_tokens / sum(latencies),
+        "parsed": parsed,
+        "prompts": len(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark CPU inference backends on evaluation prompts')
+    parser.add_argument('--model_path', type=str, default='Qwen/Qwen2.5-0.5B-Instruct', help='Small instruct model to load')
+    parser.add_argument('--backends', type=str, default='hf,cpu_int8', help=f'Comma-separated subset of {",".join(BACKENDS)}')
+    parser.add_argument('--transcripts', type=int, default=3, help='Synthetic transcripts per dimension')
+    parser.add_argument('--turns', type=int, default=6, help='Question/answer pairs per transcript')
+    parser.add_argument('--max_new_tokens', type=int, default=256, help='Generation budget per prompt')
+    parser.add_argument('--threads', type=int, default=None, help='torch intra-op threads for HFClientCPU')
+    args = parser.parse_args()
+
+    print(f"{'backend':<10} {'load s':>8} {'p50 s':>8} {'p95 s':>8} {'tok/s':>8} {'parsed':>8}")
+    for name in args.backends.split(','):
+        row = run_backend(name, args)
+        print(f"{name:<10} {row['load_seconds']:>8.1f} {row['p50']:>8.2f} {row['p95']:>8.2f} "
+              f"{row['tokens_per_second']:>8.1f} {row['parsed']:>4}/{row['prompts']:<3}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Measure the cost of importing the evaluators in a fresh interpreter.
+
+Compares the default import, which leaves the local-model backends unloaded,
+with importing utils.local_llm as well, which is what every
+`import evaluator.evaluators` paid when utils.llm loaded torch, transformers
+and vLLM eagerly. HTTP libraries are listed separately: the openai package
+may import aiohttp itself, so it can appear in both scenarios.
+
+Usage:
+    python benchmarks/import_time.py --repeats 5
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LOCAL_MODEL_MODULES = ["torch", "transformers", "huggingface_hub", "vllm", "datasets"]
+HTTP_MODULES = ["aiohttp", "requests"]
+
+SCENARIOS = {
+    "lazy (evaluator.evaluators)": "import evaluator.evaluators",
+    "eager (+ utils.local_llm)": "import evaluator.evaluators\nimport utils.local_llm",
+}
+
+PROBE = """
+import sys, time, json, resource
+start = time.perf_counter()
+error = None
+try:
+{code}
+except ImportError as e:
+    error = str(e)
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "seconds": elapsed,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "loaded": [name for name in {modules!r} if name in sys.modules],
+    "error": error,
+}}))
+"""
+
+
+def run_once(code: str) -> dict:
+    """Time one import in a new interpreter so nothing is already in sys.modules"""
+    probe = PROBE.format(code="\n".join("    " + line for line in code.splitlines()), modules=LOCAL_MODEL_MODULES + HTTP_MODULES)
+    output = subprocess.run(
+        [sys.executable, "-c", probe],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+        env={**os.environ, "PYTHONPATH": ROOT},
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark import time of the evaluator package')
+    parser.add_argument('--repeats', type=int, default=5, help='Fresh interpreters per scenario')
+    args = parser.parse_args()
+
+    for name, code in SCENARIOS.items():
+        runs = [run_once(code) for _ in range(args.repeats)]
+        seconds = [run["seconds"] for run in runs]
+        print(f"{name}:")
+        print(f"  import time: median {statistics.median(seconds):.3f}s, min {min(seconds):.3f}s")
+        print(f"  max RSS: {max(run['max_rss_mb'] for run in runs):.0f} MB")
+        loaded = runs[-1]["loaded"]
+        print(f"  local-model modules loaded: {', '.join(m for m in loaded if m in LOCAL_MODEL_MODULES) or 'none'}")
+        # Not attributed to the lazy path: openai's own HTTP transport may import aiohttp
+        print(f"  HTTP modules loaded: {', '.join(m for m in loaded if m in HTTP_MODULES) or 'none'}")
+        if runs[-1]["error"]:
+            print(f"  import failed part-way: {runs[-1]['error']}")
+
+
+if __name__ == "__main__":
+    main()
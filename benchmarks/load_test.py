@@ -0,0 +1,107 @@
+"""
+Offline load test of evaluation/text_evaluation.py against utils.fake_server.
+
+Generates synthetic transcripts, starts a fake OpenAI-compatible server and runs the
+pipeline in each requested mode, reporting wall time, throughput and what the server
+saw (requests, 429s, peak concurrency). No API credits are used.
+
+Usage:
+    python benchmarks/load_test.py --transcripts 50 --modes sync,async,async_combined,batch \
+        --latency lognormal:-1.5,0.5 --rate_limit_rate 0.05
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+from typing import Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from utils.fake_server import FakeLLMServer
+
+MODES = {
+    "sync": [],
+    "async": ["--async_mode"],
+    "async_combined": ["--async_mode", "--combined"],
+    "async_structured": ["--async_mode", "--structured_output"],
+    "async_level_only": ["--async_mode", "--level_only"],
+    "async_stream": ["--async_mode", "--stream_json"],
+    "async_stop": ["--async_mode", "--stop_sequences"],
+    "batch": ["--batch_mode"],
+}
+
+
+def write_transcripts(directory: str, count: int, turns: int):
+    """Write `count` distinct synthetic *_transcript.txt files"""
+    for i in range(count):
+        lines = []
+        for turn in range(turns):
+            lines.append(f"Assistant: Question {turn} for speaker {i}?")
+            lines.append(f"User: This is answer {turn} of speaker {i}, it have some errors in it.")
+        with open(os.path.join(directory, f"S{i:04d}_transcript.txt"), "w", encoding="utf-8") as f:
+            f.write("\n".join(lines))
+
+
+def run_mode(mode: str, server: FakeLLMServer, transcript_dir: str, concurrency: int) -> Tuple[float, int]:
+    """Run text_evaluation.py once in a fresh results directory; returns (wall time, result files saved)"""
+    results_dir = tempfile.mkdtemp(prefix=f"results_{mode}_")
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": "fake",
+        "BASE_URL": server.base_url,
+        "MODEL_ID": server.model,
+    }
+    command = [
+        sys.executable, os.path.join(ROOT, "evaluation", "text_evaluation.py"),
+        "--transcript_dir", transcript_dir,
+        "--results_dir", results_dir,
+        "--concurrency", str(concurrency),
+        *MODES[mode],
+    ]
+    start = time.perf_counter()
+    subprocess.run(command, cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    elapsed = time.perf_counter() - start
+    saved = len([name for name in os.listdir(results_dir) if name.endswith("_result.json")])
+    return elapsed, saved
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test text_evaluation.py against a local fake LLM server')
+    parser.add_argument('--transcripts', type=int, default=20, help='Number of synthetic transcripts')
+    parser.add_argument('--turns', type=int, default=10, help='Question/answer pairs per transcript')
+    parser.add_argument('--modes', type=str, default='sync,async,async_combined,batch', help=f'Comma-separated subset of {",".join(MODES)}')
+    parser.add_argument('--concurrency', type=int, default=16, help='--concurrency passed to text_evaluation.py')
+    parser.add_argument('--latency', type=str, default='lognormal:-1.5,0.5', help='Server latency distribution')
+    parser.add_argument('--token_latency', type=float, default=0.0, help='Server seconds per completion token')
+    parser.add_argument('--error_rate', type=float, default=0.0, help='Fraction of 500 responses')
+    parser.add_argument('--rate_limit_rate', type=float, default=0.0, help='Fraction of 429 responses')
+    parser.add_argument('--trailing_words', type=int, default=0, help='Server commentary words after each JSON answer')
+    parser.add_argument('--max_concurrency', type=int, default=0, help='Server capacity before answering 429')
+    parser.add_argument('--seed', type=int, default=0, help='Server RNG seed')
+    args = parser.parse_args()
+
+    transcript_dir = tempfile.mkdtemp(prefix="transcripts_")
+    write_transcripts(transcript_dir, args.transcripts, args.turns)
+
+    print(f"{'mode':<18} {'wall s':>8} {'saved':>6} {'transcripts/s':>14} {'requests':>9} {'429':>5} {'500':>5} {'peak':>5}")
+    for mode in args.modes.split(','):
+        with FakeLLMServer(
+            latency=args.latency,
+            token_latency=args.token_latency,
+            error_rate=args.error_rate,
+            rate_limit_rate=args.rate_limit_rate,
+            max_concurrency=args.max_concurrency,
+            trailing_words=args.trailing_words,
+            seed=args.seed
+        ) as server:
+            elapsed, saved = run_mode(mode, server, transcript_dir, args.concurrency)
+            stats = server.stats()
+        print(f"{mode:<18} {elapsed:>8.2f} {saved:>6} {saved / elapsed:>14.2f} {stats.get('requests', 0):>9} "
+              f"{stats.get('status_429', 0):>5} {stats.get('status_500', 0):>5} {stats['max_in_flight']:>5}")
+
+
+if __name__ == "__main__":
+    main()
@@ -21,7 +21,8 @@ from pathlib import Path
 from typing import Dict, Any, Tuple, List
 
 from evaluator.evaluators import FluencyEvaluator
-from utils.llm import OpenAIClientLLM
+from utils.llm import OpenAIClientLLM, get_client
+from utils.cache import LLMCache, CachedLLM, CoalescingLLM
 
 
 # Set up logging
@@ -162,9 +163,14 @@ class FluencyAnalyzer:
     Analyzes fluency based on speech metrics and transcripts.
     """
     
-    def __init__(self, recordings_dir: str):
+    def __init__(self, recordings_dir: str, cache: LLMCache = None):
         self.recordings_dir = recordings_dir
-        self.evaluator = FluencyEvaluator(llm_class=OpenAIClientLLM)
+        # As in text_evaluation.py, identical in-flight requests share one upstream call;
+        # with a cache file shared between the two tools, across processes as well
+        llm = get_client(OpenAIClientLLM)
+        if cache is not None:
+            llm = CachedLLM(llm, cache)
+        self.evaluator = FluencyEvaluator(llm=CoalescingLLM(llm))
     
     def get_transcript(self, wav_file: str) -> str:
         base_name = wav_file.replace("_USER.wav", "")
@@ -295,6 +301,7 @@ def main():
     parser.add_argument('--output_dir', type=str, required=True, help='Directory to save results')
     parser.add_argument('--sample_rate', type=int, default=22050, help='Sample rate for audio processing')
     parser.add_argument('--name_filter', type=str, default='', help='String to filter filenames')
+    parser.add_argument('--cache_path', type=str, default='', help='SQLite file for caching LLM responses (disabled if empty)')
     
     args = parser.parse_args()
     
@@ -318,8 +325,11 @@ def main():
         
         # Step 2: Evaluate fluency
         logger.info("Step 2: Evaluating fluency...")
-        fluency_analyzer = FluencyAnalyzer(recordings_dir=args.input_dir)
+        cache = LLMCache(path=args.cache_path) if args.cache_path else None
+        fluency_analyzer = FluencyAnalyzer(recordings_dir=args.input_dir, cache=cache)
         evaluation_results = fluency_analyzer.analyze_metrics(metrics)
+        if cache is not None:
+            logger.info(f"LLM cache stats: {cache.stats()}")
         
         # Save evaluation results
         with open(evaluation_file, 'w') as f:
@@ -2,19 +2,32 @@ import os
 import sys
 import json
 import glob
+import asyncio
+import argparse
+from functools import partial
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple
 
 # Add parent directory to Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from evaluator.base_evaluator import failed_result
+from evaluator.dag import EvaluatorDAG
 from evaluator.evaluators import (
     GrammarEvaluator,
     CoherenceEvaluator,
     RangeEvaluator,
     InteractionEvaluator,
-    FluencyEvaluator
+    FluencyEvaluator,
+    CEFROverallEvaluator,
+    CombinedEvaluator
 )
+from utils.cache import LLMCache, CachedLLM, CoalescingLLM
+from utils.batch_jobs import BatchJob
+from utils.instrumentation import Instrumentation, set_instrumentation, evaluator_scope
+from utils.llm import LLMClient, OpenAIClientLLM
+from utils.load_balancer import LoadBalancedLLM
+from utils.rate_limit import get_default_scheduler
 
 def read_transcript(file_path: str) -> str:
     """Read the transcript file and return its contents."""
@@ -26,52 +39,170 @@ def save_results(results: Dict[str, Any], output_path: str):
     with open(output_path, 'w', encoding='utf-8') as f:
         json.dump(results, f, indent=2, ensure_ascii=False)
 
-def evaluate_transcript(transcript_path: str) -> Dict[str, Any]:
+def build_evaluators(
+    llm: LLMClient = None,
+    structured_output: bool = False,
+    overall_policy: str = None,
+    chunk_tokens: int = None
+) -> Dict[str, Any]:
+    """
+    Create one evaluator per CEFR dimension, sharing `llm` when one is given. With an
+    `overall_policy` (see CEFROverallEvaluator.POLICIES) the holistic CEFROverallEvaluator
+    is added as 'overall', fed by the five dimensions. With `chunk_tokens`, transcripts
+    longer than that are evaluated window by window and reduced per dimension.
+    """
+    evaluator_classes = {
+        'grammar': GrammarEvaluator,
+        'coherence': CoherenceEvaluator,
+        'range': RangeEvaluator,
+        'interaction': InteractionEvaluator,
+        'fluency': FluencyEvaluator
+    }
+    if overall_policy:
+        evaluator_classes['overall'] = partial(CEFROverallEvaluator, policy=overall_policy)
+    if llm is None:
+        return {
+            name: cls(structured_output=structured_output, chunk_tokens=chunk_tokens)
+            for name, cls in evaluator_classes.items()
+        }
+    return {
+        name: cls(llm=llm, structured_output=structured_output, chunk_tokens=chunk_tokens)
+        for name, cls in evaluator_classes.items()
+    }
+
+def build_combined_evaluator(
+    llm: LLMClient = None,
+    structured_output: bool = False,
+    chunk_tokens: int = None
+) -> CombinedEvaluator:
+    """Create the single-call evaluator covering all five dimensions."""
+    if llm is None:
+        return CombinedEvaluator(structured_output=structured_output, chunk_tokens=chunk_tokens)
+    return CombinedEvaluator(llm=llm, structured_output=structured_output, chunk_tokens=chunk_tokens)
+
+def api_client_kwargs(args: argparse.Namespace) -> Dict[str, Any]:
+    """Completion parameters for API clients"""
+    kwargs = {"stream_json": args.stream_json, "use_stop_sequences": args.stop_sequences}
+    # Combined responses need more room than the single-dimension default
+    if args.combined:
+        kwargs["max_tokens"] = 6000
+    return kwargs
+
+def build_llm(args: argparse.Namespace, cache: LLMCache = None) -> LLMClient:
+    """
+    Build the client shared by all evaluators. Identical requests in flight at the
+    same time (e.g. duplicated transcripts) are coalesced into one upstream call.
+    """
+    if args.vllm_model_path:
+        # Deferred so API-only runs never import torch or vLLM
+        from utils.local_llm import HFClientVLLM
+        llm = HFClientVLLM(model_path=args.vllm_model_path, async_engine=args.vllm_async_engine)
+    else:
+        client_kwargs = api_client_kwargs(args)
+        if args.endpoints:
+            llm = LoadBalancedLLM.from_endpoints(
+                args.endpoints.split(','), health_check_interval=args.health_check_interval, **client_kwargs
+            )
+        else:
+            llm = OpenAIClientLLM(**client_kwargs)
+    if cache is not None:
+        llm = CachedLLM(llm, cache)
+    return CoalescingLLM(llm)
+
+def build_instrumentation(args: argparse.Namespace) -> Instrumentation:
+    """Install the per-run collector of LLM call metrics"""
+    prices = {}
+    if args.prices_json:
+        with open(args.prices_json, 'r', encoding='utf-8') as f:
+            prices = {model: tuple(price) for model, price in json.load(f).items()}
+    instrumentation = Instrumentation(jsonl_path=args.metrics_jsonl or None, prices=prices)
+    set_instrumentation(instrumentation)
+    return instrumentation
+
+def build_cache(args: argparse.Namespace) -> LLMCache:
+    """Open the response cache requested on the command line, if any."""
+    if not args.cache_path:
+        return None
+    return LLMCache(
+        path=args.cache_path,
+        max_bytes=int(args.cache_max_mb * 1024 * 1024) if args.cache_max_mb else None,
+        max_age=args.cache_max_age_days * 86400 if args.cache_max_age_days else None
+    )
+
+def evaluate_transcript(
+    transcript_path: str,
+    llm: LLMClient = None,
+    combined: bool = False,
+    level_only: bool = False,
+    min_confidence: float = None,
+    structured_output: bool = False,
+    overall_policy: str = None,
+    chunk_tokens: int = None
+) -> Dict[str, Any]:
     """Run all evaluators on a transcript and return combined results."""
     # Read transcript
     transcript = read_transcript(transcript_path)
+
+    if combined:
+        try:
+            return build_combined_evaluator(llm, structured_output, chunk_tokens).evaluate(transcript), False
+        except Exception as e:
+            print(f"Error in combined evaluation: {str(e)}")
+            return {name: failed_result(e) for name in CombinedEvaluator.DIMENSIONS}, True
     
-    # Initialize evaluators
-    evaluators = {
-        'grammar': GrammarEvaluator(),
-        'coherence': CoherenceEvaluator(),
-        'range': RangeEvaluator(),
-        'interaction': InteractionEvaluator(),
-        'fluency': FluencyEvaluator()
-    }
+    # Initialize evaluators; the overall evaluator, if any, runs after the dimensions it reads
+    dag = EvaluatorDAG(build_evaluators(llm, structured_output, overall_policy, chunk_tokens))
     
     # Run evaluations
-    results = {}
-    all_failed = True  # Track if all evaluations failed
-    
-    for eval_name, evaluator in evaluators.items():
-        try:
-            # Run evaluation
-            eval_results = evaluator.evaluate(transcript)
-            results[eval_name] = eval_results
-            all_failed = False  # At least one evaluation succeeded
-            
-        except Exception as e:
-            print(f"Error in {eval_name} evaluation: {str(e)}")
-            results[eval_name] = {
-                "error": str(e),
-                "cefr_level": "A1",
-                "reasoning": "Evaluation failed"
-            }
+    results = dag.run(transcript, level_only=level_only, min_confidence=min_confidence)
+    for eval_name, eval_results in results.items():
+        if "error" in eval_results:
+            print(f"Error in {eval_name} evaluation: {eval_results['error']}")
+    # Track if all evaluations failed
+    all_failed = all("error" in results[name] for name in CombinedEvaluator.DIMENSIONS)
     
     return results, all_failed
 
-def main():
-    # Get all transcript files
-    transcript_dir = Path("data/recordings_wav_processed")
-    transcript_files = glob.glob(str(transcript_dir / "*_transcript.txt"))
-    
-    # Create results directory if it doesn't exist
-    results_dir = Path("evaluation/results")
-    results_dir.mkdir(parents=True, exist_ok=True)
-    
-    # Process each transcript
-    for transcript_path in transcript_files:
+async def a_evaluate_transcript(
+    transcript_path: str,
+    dag: EvaluatorDAG,
+    semaphore: asyncio.Semaphore,
+    level_only: bool = False,
+    min_confidence: float = None
+) -> Tuple[Dict[str, Any], bool]:
+    """
+    Run all evaluators on a transcript concurrently, bounded by the shared semaphore.
+    Dimensions start together and the overall evaluator, if present, starts as soon
+    as the last of them finishes.
+    """
+    transcript = read_transcript(transcript_path)
+
+    results = {}
+    async for eval_name, outcome in dag.a_stream(transcript, semaphore, level_only, min_confidence):
+        if "error" in outcome:
+            print(f"Error in {eval_name} evaluation: {outcome['error']}")
+        results[eval_name] = outcome
+
+    all_failed = all("error" in results[name] for name in CombinedEvaluator.DIMENSIONS)
+    return {name: results[name] for name in dag.evaluators}, all_failed
+
+async def a_evaluate_transcript_combined(
+    transcript_path: str,
+    evaluator: CombinedEvaluator,
+    semaphore: asyncio.Semaphore
+) -> Tuple[Dict[str, Any], bool]:
+    """Evaluate all dimensions of a transcript with one request, bounded by the shared semaphore."""
+    transcript = read_transcript(transcript_path)
+    try:
+        return await evaluator.a_evaluate(transcript, semaphore=semaphore), False
+    except Exception as e:
+        print(f"Error in combined evaluation: {str(e)}")
+        return {name: failed_result(e) for name in CombinedEvaluator.DIMENSIONS}, True
+
+def pending_transcripts(transcript_dir: Path, results_dir: Path) -> List[Tuple[str, Path]]:
+    """List (transcript_path, json_output_path) pairs that have no results yet."""
+    pending = []
+    for transcript_path in glob.glob(str(transcript_dir / "*_transcript.txt")):
         # Get base filename without extension
         base_name = Path(transcript_path).stem.replace("_transcript", "")
         
@@ -82,18 +213,274 @@ def main():
         if txt_output_path.exists() or json_output_path.exists():
             print(f"Skipping {transcript_path} - already processed")
             continue
-            
+
+        pending.append((transcript_path, json_output_path))
+    return pending
+
+def store_results(transcript_path: str, json_output_path: Path, results: Dict[str, Any], all_failed: bool):
+    """Save results unless every dimension failed."""
+    if not all_failed:
+        save_results(results, json_output_path)  # Save as JSON by default
+        print(f"Results saved to {json_output_path}")
+    else:
+        print(f"Skipping saving results for {transcript_path} - all evaluations failed")
+
+async def a_evaluate_directory(
+    pending: List[Tuple[str, Path]],
+    concurrency: int,
+    llm: LLMClient = None,
+    combined: bool = False,
+    level_only: bool = False,
+    min_confidence: float = None,
+    structured_output: bool = False,
+    overall_policy: str = None,
+    chunk_tokens: int = None
+):
+    """
+    Evaluate every pending transcript concurrently.
+
+    All transcripts x dimensions share one semaphore, so at most `concurrency`
+    LLM requests are in flight at any time across the whole batch.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    # Evaluators are stateless between calls, so one set serves every transcript
+    if combined:
+        combined_evaluator = build_combined_evaluator(llm, structured_output, chunk_tokens)
+    else:
+        evaluators = build_evaluators(llm, structured_output, overall_policy, chunk_tokens)
+        dag = EvaluatorDAG(evaluators)
+
+    async def run_transcript(transcript_path, json_output_path):
         print(f"Processing {transcript_path}...")
-        
-        # Run evaluation
-        results, all_failed = evaluate_transcript(transcript_path)
-        
-        # Only save results if not all evaluations failed
-        if not all_failed:
-            save_results(results, json_output_path)  # Save as JSON by default
-            print(f"Results saved to {json_output_path}")
+        if combined:
+            results, all_failed = await a_evaluate_transcript_combined(transcript_path, combined_evaluator, semaphore)
+        else:
+            results, all_failed = await a_evaluate_transcript(
+                transcript_path, dag, semaphore, level_only, min_confidence
+            )
+        store_results(transcript_path, json_output_path, results, all_failed)
+
+    await asyncio.gather(*(run_transcript(*item) for item in pending))
+
+    # Release pooled connections held by clients such as HTTPLLM while the loop is alive
+    clients = [combined_evaluator.llm] if combined else [evaluator.llm for evaluator in evaluators.values()]
+    for client in {id(client): client for client in clients}.values():
+        aclose = getattr(client, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+def evaluate_directory_batch(
+    pending: List[Tuple[str, Path]],
+    llm: LLMClient,
+    combined: bool = False,
+    structured_output: bool = False
+):
+    """
+    Evaluate every pending transcript with a single `generate_batch` call.
+
+    Prompts for all transcripts x dimensions are submitted together, so backends
+    with native batching (HFClientVLLM) keep the inference engine saturated.
+    """
+    if combined:
+        evaluators = {'combined': build_combined_evaluator(llm, structured_output)}
+    else:
+        evaluators = build_evaluators(llm, structured_output)
+
+    jobs = []
+    for transcript_path, json_output_path in pending:
+        transcript = read_transcript(transcript_path)
+        for eval_name, evaluator in evaluators.items():
+            jobs.append((transcript_path, eval_name, evaluator.pre_process(transcript)))
+
+    print(f"Submitting {len(jobs)} prompts for {len(pending)} transcripts as one batch...")
+    try:
+        if any(evaluator.generation_kwargs for evaluator in evaluators.values()):
+            # Each dimension has its own response schema, so submit one batch per dimension
+            responses_by_job = {}
+            for eval_name, evaluator in evaluators.items():
+                indices = [i for i, (_, name, _) in enumerate(jobs) if name == eval_name]
+                with evaluator_scope(type(evaluator).__name__):
+                    batch = llm.generate_batch([jobs[i][2] for i in indices], **evaluator.generation_kwargs)
+                responses_by_job.update(zip(indices, batch))
+            llm_responses = [responses_by_job[i] for i in range(len(jobs))]
+        else:
+            # Every dimension shares one batch, so calls cannot be attributed to a single evaluator
+            with evaluator_scope("batch"):
+                llm_responses = llm.generate_batch([prompt for _, _, prompt in jobs])
+    except Exception as e:
+        print(f"Error in batch evaluation: {str(e)}")
+        for transcript_path, json_output_path in pending:
+            store_results(transcript_path, json_output_path, {}, True)
+        return
+
+    results = {transcript_path: {} for transcript_path, _ in pending}
+    for (transcript_path, eval_name, _), llm_response in zip(jobs, llm_responses):
+        evaluation = evaluators[eval_name].post_process(llm_response)
+        if combined:
+            results[transcript_path].update(evaluation)
+        else:
+            results[transcript_path][eval_name] = evaluation
+
+    for transcript_path, json_output_path in pending:
+        store_results(transcript_path, json_output_path, results[transcript_path], False)
+
+def evaluate_directory_batch_job(
+    pending: List[Tuple[str, Path]],
+    results_dir: Path,
+    llm: OpenAIClientLLM,
+    combined: bool = False,
+    structured_output: bool = False,
+    poll_interval: float = 30.0
+):
+    """
+    Evaluate pending transcripts through the provider's Batch API.
+
+    All prompts are written to one JSONL request file, submitted and polled until the
+    batch finishes, then parsed by each evaluator's post_process into the usual
+    *_result.json files. The submitted batch is recorded in results_dir, so rerunning
+    after an interruption resumes polling it instead of submitting a new one.
+    """
+    if combined:
+        evaluators = {'combined': build_combined_evaluator(llm, structured_output)}
+    else:
+        evaluators = build_evaluators(llm, structured_output)
+    job = BatchJob(llm, state_path=str(results_dir / ".batch_job_state.json"), poll_interval=poll_interval)
+
+    state = job.load_state()
+    if state is not None:
+        print(f"Resuming batch {state['batch_id']}...")
+    else:
+        if not pending:
+            return
+        requests, outputs, custom_ids = [], {}, {}
+        for transcript_path, json_output_path in pending:
+            transcript = read_transcript(transcript_path)
+            outputs[transcript_path] = str(json_output_path)
+            for eval_name, evaluator in evaluators.items():
+                custom_id = f"{Path(json_output_path).stem}::{eval_name}"
+                custom_ids[custom_id] = [transcript_path, eval_name]
+                requests.append(job.request_line(
+                    custom_id, evaluator.pre_process(transcript), **evaluator.generation_kwargs
+                ))
+        print(f"Submitting batch job with {len(requests)} requests for {len(pending)} transcripts...")
+        state = job.submit(requests, metadata={"outputs": outputs, "custom_ids": custom_ids})
+
+    batch = job.wait(state["batch_id"])
+    if batch.status != "completed":
+        print(f"Batch {batch.id} ended with status {batch.status}, saving whatever results it produced")
+    responses = job.results(batch)
+
+    results = {transcript_path: {} for transcript_path in state["metadata"]["outputs"]}
+    succeeded = {transcript_path: False for transcript_path in results}
+    for custom_id, (transcript_path, eval_name) in state["metadata"]["custom_ids"].items():
+        content, error = responses.get(custom_id, (None, "missing from batch output"))
+        if content is not None:
+            evaluation = evaluators[eval_name].post_process(content)
+            succeeded[transcript_path] = True
+        else:
+            print(f"Error in {eval_name} evaluation of {transcript_path}: {error}")
+            failure = failed_result(Exception(error))
+            evaluation = {name: failure for name in CombinedEvaluator.DIMENSIONS} if combined else failure
+        if combined:
+            results[transcript_path].update(evaluation)
         else:
-            print(f"Skipping saving results for {transcript_path} - all evaluations failed")
+            results[transcript_path][eval_name] = evaluation
+
+    for transcript_path, json_output_path in state["metadata"]["outputs"].items():
+        store_results(transcript_path, Path(json_output_path), results[transcript_path], not succeeded[transcript_path])
+    job.clear_state()
+
+def main():
+    parser = argparse.ArgumentParser(description='Run CEFR text evaluations on transcripts')
+    parser.add_argument('--transcript_dir', type=str, default='data/recordings_wav_processed', help='Directory containing *_transcript.txt files')
+    parser.add_argument('--results_dir', type=str, default='evaluation/results', help='Directory to save results')
+    parser.add_argument('--async_mode', action='store_true', help='Evaluate all transcripts and dimensions concurrently')
+    parser.add_argument('--concurrency', type=int, default=16, help='Maximum number of in-flight LLM requests in async mode, capped by LLM_MAX_CONCURRENCY')
+    parser.add_argument('--batch_mode', action='store_true', help='Submit all transcripts x dimensions as one generate_batch call')
+    parser.add_argument('--batch_job', action='store_true', help='Submit all prompts as one OpenAI Batch API job and poll until it finishes (resumable)')
+    parser.add_argument('--poll_interval', type=float, default=30, help='Seconds between batch job status checks')
+    parser.add_argument('--vllm_model_path', type=str, default='', help='Evaluate with a local vLLM model instead of the OpenAI-compatible API')
+    parser.add_argument('--vllm_async_engine', action='store_true', help="Serve --async_mode requests with vLLM's AsyncLLMEngine")
+    parser.add_argument('--endpoints', type=str, default='', help='Comma-separated OpenAI-compatible base URLs to load-balance requests across')
+    parser.add_argument('--health_check_interval', type=float, default=10, help='Seconds between health probes of --endpoints (0 disables)')
+    parser.add_argument('--combined', action='store_true', help='Score all five dimensions with a single LLM call per transcript')
+    parser.add_argument('--overall', action='store_true', help='Add a holistic CEFR level from the five dimension results, run as soon as they finish')
+    parser.add_argument('--overall_policy', type=str, default='auto', choices=CEFROverallEvaluator.POLICIES,
+                        help='With --overall: always ask the LLM, always use the weighted level, or use it when the dimensions agree within one level')
+    parser.add_argument('--chunk_tokens', type=int, default=0, help='Split longer transcripts into windows of whole speaker turns with at most this many tokens, evaluate them concurrently and combine the results (0 disables)')
+    parser.add_argument('--level_only', action='store_true', help='Ask only for the CEFR level of each dimension, scored from logprobs where available')
+    parser.add_argument('--min_confidence', type=float, default=None, help='In level-only mode, rerun the full evaluation when the level probability is below this')
+    parser.add_argument('--structured_output', action='store_true', help="Constrain responses to each evaluation type's JSON schema on backends that support it")
+    parser.add_argument('--stream_json', action='store_true', help='Stream responses and stop reading as soon as the JSON answer is complete')
+    parser.add_argument('--stop_sequences', action='store_true', help="Send stop sequences matching each evaluator's output format (answers must open with ```json)")
+    parser.add_argument('--cache_path', type=str, default='', help='SQLite file for caching LLM responses (disabled if empty)')
+    parser.add_argument('--cache_max_mb', type=float, default=0, help='Evict least recently used responses beyond this size')
+    parser.add_argument('--cache_max_age_days', type=float, default=0, help='Expire cached responses older than this')
+    parser.add_argument('--metrics_jsonl', type=str, default='', help='Append one JSON line per LLM call (latency, tokens, retries, evaluator)')
+    parser.add_argument('--metrics_prom', type=str, default='', help='Write aggregated LLM call metrics in Prometheus text format')
+    parser.add_argument('--prices_json', type=str, default='', help='JSON file mapping model id to [prompt, completion] USD per million tokens')
+
+    args = parser.parse_args()
+    if args.level_only and (args.combined or args.batch_mode):
+        parser.error('--level_only cannot be combined with --combined or --batch_mode')
+    if args.batch_job and (args.level_only or args.vllm_model_path or args.endpoints):
+        parser.error('--batch_job cannot be combined with --level_only, --vllm_model_path or --endpoints')
+    if args.overall and (args.combined or args.batch_mode or args.batch_job):
+        parser.error('--overall cannot be combined with --combined, --batch_mode or --batch_job')
+    if args.chunk_tokens and (args.level_only or args.batch_mode or args.batch_job):
+        parser.error('--chunk_tokens cannot be combined with --level_only, --batch_mode or --batch_job')
+
+    # Get all transcript files
+    transcript_dir = Path(args.transcript_dir)
+    
+    # Create results directory if it doesn't exist
+    results_dir = Path(args.results_dir)
+    results_dir.mkdir(parents=True, exist_ok=True)
+
+    pending = pending_transcripts(transcript_dir, results_dir)
+    instrumentation = build_instrumentation(args)
+    cache = build_cache(args)
+    # Batch jobs submit through their own Batch API client, so no request client is built
+    llm = None if args.batch_job else build_llm(args, cache)
+
+    if args.batch_job:
+        evaluate_directory_batch_job(
+            pending, results_dir, OpenAIClientLLM(**api_client_kwargs(args)), args.combined,
+            args.structured_output, args.poll_interval
+        )
+    elif args.batch_mode:
+        evaluate_directory_batch(pending, llm, args.combined, args.structured_output)
+    elif args.async_mode:
+        # Otherwise the shared scheduler starts at 8 slots and --concurrency 16 only takes effect after ramping up
+        get_default_scheduler(initial_concurrency=args.concurrency)
+        asyncio.run(a_evaluate_directory(
+            pending, args.concurrency, llm, args.combined, args.level_only, args.min_confidence,
+            args.structured_output, args.overall_policy if args.overall else None,
+            args.chunk_tokens or None
+        ))
+    else:
+        # Process each transcript
+        for transcript_path, json_output_path in pending:
+            print(f"Processing {transcript_path}...")
+            
+            # Run evaluation
+            results, all_failed = evaluate_transcript(
+                transcript_path, llm, args.combined, args.level_only, args.min_confidence,
+                args.structured_output, args.overall_policy if args.overall else None,
+                args.chunk_tokens or None
+            )
+            
+            # Only save results if not all evaluations failed
+            store_results(transcript_path, json_output_path, results, all_failed)
+
+    if cache is not None:
+        print(f"LLM cache stats: {cache.stats()}")
+    if llm is not None and llm.coalesced:
+        print(f"Coalesced {llm.coalesced} duplicate in-flight LLM requests")
+    if instrumentation.records:
+        print(instrumentation.format_report())
+    if args.metrics_prom:
+        instrumentation.write_prometheus(args.metrics_prom)
 
 if __name__ == "__main__":
     main()
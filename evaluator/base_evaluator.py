@@ -1,23 +1,108 @@
 from __future__ import annotations  # for pervious python version e.g. 3.9
 from abc import ABC, abstractmethod
-from typing import Any, Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+import re
 
-from datasets import Dataset
-
-from utils.llm import LLMClient, OpenAIClientLLM
-from .prompt_manager import EvaluationType
+from utils.llm import LLMClient, OpenAIClientLLM, get_client
+from utils.instrumentation import evaluator_scope
+from utils.rate_limit import estimate_tokens
+from .prompt_manager import EvaluationType, CEFR_LEVELS, LEVEL_ONLY_FORMATTER, formatter_stop_sequences
+from .chunking import chunk_transcript, weighted_median_level
 import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# LEVEL_ONLY_FORMATTER asks for the level as a digit, 1 = A1 ... 6 = C2
+LEVEL_DIGITS = [str(i) for i in range(1, len(CEFR_LEVELS) + 1)]
+
+
+def parse_level(llm_response: str) -> Optional[str]:
+    """Read a CEFR level from a level-only answer given either as a level name or a digit"""
+    text = (llm_response or "").upper()
+    match = re.search(r"\b([ABC][12])\b", text)
+    if match:
+        return match.group(1)
+    match = re.search(r"[1-6]", text)
+    return CEFR_LEVELS[int(match.group(0)) - 1] if match else None
+
+
+def failed_result(error: Exception) -> Dict[str, Any]:
+    """Placeholder result stored for an evaluation that raised."""
+    return {
+        "error": str(error),
+        "cefr_level": "A1",
+        "reasoning": "Evaluation failed"
+    }
 
 
 class ConversationEvaluator(ABC):
     """Base class for evaluating RAG outputs using LLM-as-a-judge pattern."""
 
+    # Prompt type whose template and response schema the evaluator uses
+    eval_type: EvaluationType = None
+
+    # Names of evaluators whose results `pre_process` takes instead of a transcript (see EvaluatorDAG)
+    inputs: Tuple[str, ...] = ()
+
     def __init__(
         self,
         llm_class: type[LLMClient] = None,
+        llm: LLMClient = None,
+        structured_output: bool = False,
+        chunk_tokens: int = None,
+        chunk_overlap_turns: int = 1,
         **llm_kwargs
     ):
-        self.llm = llm_class(**llm_kwargs) if llm_class else OpenAIClientLLM(**llm_kwargs)
+        """
+        Args:
+            llm_class: LLM client class, defaults to OpenAIClientLLM; the client comes from the
+                process-wide registry (`utils.llm.get_client`)
+            llm: Already constructed client to use instead of building one (e.g. a CachedLLM)
+            structured_output: Constrain responses to `response_schema` on backends that support it
+            chunk_tokens: If set, `evaluate`/`a_evaluate` split longer transcripts into windows of
+                whole speaker turns within this many tokens, evaluate the windows concurrently
+                and combine them with `reduce_chunks`
+            chunk_overlap_turns: Turns repeated at the start of each window from the previous one
+            llm_kwargs: Arguments for the client constructor
+        """
+        if llm is not None:
+            self.llm = llm
+        else:
+            # Evaluators with the same client configuration share one process-wide client
+            self.llm = get_client(llm_class or OpenAIClientLLM, **llm_kwargs)
+
+        self.structured_output = structured_output
+        self.chunk_tokens = chunk_tokens
+        self.chunk_overlap_turns = chunk_overlap_turns
+        if structured_output and not self.llm.supports_response_schema:
+            logger.warning(f"{type(self.llm).__name__} cannot enforce a JSON schema, "
+                           f"{type(self).__name__} falls back to prompt-only JSON formatting")
+
+    @property
+    def response_schema(self) -> Optional[Dict[str, Any]]:
+        """JSON schema of the LLM response expected by `post_process`"""
+        return self.eval_type.schema if self.eval_type is not None else None
+
+    @property
+    def stop_sequences(self) -> List[str]:
+        """Stop sequences matching the formatter of `eval_type` (or the evaluator's own FORMATTER)"""
+        formatter = self.eval_type.formatter if self.eval_type is not None else getattr(self, "FORMATTER", "")
+        return formatter_stop_sequences(formatter)
+
+    @property
+    def generation_kwargs(self) -> Dict[str, Any]:
+        """
+        Per-call arguments for the LLM client: the response schema in structured-output mode,
+        and the formatter's stop sequences for clients built with use_stop_sequences
+        """
+        kwargs = {}
+        if self.structured_output and self.llm.supports_response_schema and self.response_schema is not None:
+            kwargs["response_schema"] = self.response_schema
+        if self.llm.use_stop_sequences and self.stop_sequences:
+            kwargs["stop"] = self.stop_sequences
+        return kwargs
 
 
     @abstractmethod
@@ -60,6 +145,42 @@ class ConversationEvaluator(ABC):
         """
         pass
 
+    def chunk(self, script: Any) -> List[Any]:
+        """Windows `script` is evaluated in: itself unless chunking is on and it is a long transcript"""
+        if not self.chunk_tokens or self.inputs or not isinstance(script, str):
+            return [script]
+        return chunk_transcript(script, self.chunk_tokens, self.chunk_overlap_turns)
+
+    def reduce_chunks(self, results: List[Dict], windows: List[str]) -> Dict:
+        """
+        Combine the results of a transcript's windows into one result.
+
+        The level is the token-weighted median of the window levels (see
+        `chunking.weighted_median_level`); the other fields come from the longest window
+        with that level. Failed or unparsed windows are left out, and "chunks" lists every
+        window's level and size.
+        """
+        chunks = [
+            {"cefr_level": result.get("cefr_level"), "tokens": estimate_tokens(window), "error": result.get("error")}
+            for result, window in zip(results, windows)
+        ]
+        valid = [
+            (result, chunk) for result, chunk in zip(results, chunks)
+            if "error" not in result and result.get("reasoning") != "Error processing response"
+            and result.get("cefr_level") in CEFR_LEVELS
+        ]
+        if not valid:
+            if all("error" in result for result in results):
+                raise RuntimeError(f"All {len(windows)} windows failed: {results[0]['error']}")
+            return dict(results[0], chunks=chunks)
+
+        cefr_level = weighted_median_level([(result["cefr_level"], chunk["tokens"]) for result, chunk in valid])
+        representative, _ = max(
+            ((result, chunk) for result, chunk in valid if result["cefr_level"] == cefr_level),
+            key=lambda item: item[1]["tokens"]
+        )
+        return dict(representative, chunks=chunks)
+
     def evaluate(self, script: str | List[str] = None, **kwargs) -> Dict:
         """
         Main evaluation workflow.
@@ -71,6 +192,216 @@ class ConversationEvaluator(ABC):
         Returns:
             Dictionary of evaluation metrics and scores
         """
+        windows = self.chunk(script)
+        if len(windows) > 1:
+            # Map: each window is evaluated like a short transcript; reduce: combine per dimension
+            return self.reduce_chunks(self.evaluate_many(windows, **kwargs), windows)
+
         processed_data = self.pre_process(script, **kwargs)
-        llm_response = self.call_llm(processed_data)
-        return self.post_process(llm_response)
\ No newline at end of file
+        with evaluator_scope(type(self).__name__):
+            llm_response = self.call_llm(processed_data)
+        return self.post_process(llm_response)
+
+    def evaluate_batch(self, scripts: List[str | List[str]], **kwargs) -> List[Dict]:
+        """
+        Evaluate several scripts with one batched LLM call (see `LLMClient.generate_batch`).
+
+        Args:
+            scripts: User scripts to evaluate
+            kwargs: Additional template parameters shared by every script
+
+        Returns:
+            Evaluation dictionaries in the same order as `scripts`
+        """
+        prompts = [self.pre_process(script, **kwargs) for script in scripts]
+        with evaluator_scope(type(self).__name__):
+            llm_responses = self.llm.generate_batch(prompts, **self.generation_kwargs)
+        return [self.post_process(llm_response) for llm_response in llm_responses]
+
+    def level_result(self, probabilities: Dict[str, float] = None, llm_response: str = None) -> Dict[str, Any]:
+        """
+        Build a level-only result from digit probabilities or, without logprobs, the answer text.
+
+        Args:
+            probabilities: Distribution over LEVEL_DIGITS from `LLMClient.score_choices`
+            llm_response: Raw answer used when probabilities are unavailable
+
+        Returns:
+            Dictionary with cefr_level, confidence_score and level_probabilities
+        """
+        if probabilities is not None:
+            level_probabilities = {level: probabilities[digit] for level, digit in zip(CEFR_LEVELS, LEVEL_DIGITS)}
+            cefr_level = max(level_probabilities, key=level_probabilities.get)
+            confidence_score = level_probabilities[cefr_level]
+        else:
+            level_probabilities = {}
+            cefr_level = parse_level(llm_response)
+            confidence_score = None
+        return {
+            "cefr_level": cefr_level or "A1",
+            "confidence_score": confidence_score,
+            "level_probabilities": level_probabilities,
+            "reasoning": "" if cefr_level else "Error processing response",
+            "mode": "level_only",
+            "parsed": cefr_level is not None,
+        }
+
+    @staticmethod
+    def needs_full_evaluation(result: Dict[str, Any], min_confidence: float = None) -> bool:
+        """Escalate when the level could not be read or its probability is below `min_confidence`"""
+        if min_confidence is None:
+            return False
+        if not result["parsed"]:
+            return True
+        return result["confidence_score"] is not None and result["confidence_score"] < min_confidence
+
+    def evaluate_level(self, script: str | List[str] = None, min_confidence: float = None, **kwargs) -> Dict:
+        """
+        Fast level-only evaluation: asks for a single level token instead of a JSON report.
+
+        Uses the backend's logprobs (`LLMClient.score_choices`) to get a probability for each
+        of A1-C2, and falls back to parsing the generated answer when logprobs are unavailable.
+
+        Args:
+            script: User's script to evaluate
+            min_confidence: If set, run the full `evaluate` when the top level's probability is
+                below this value or the answer cannot be parsed
+            kwargs: Additional template parameters
+
+        Returns:
+            Level-only result, or the full evaluation (with the level-only result under
+            "level_only") when escalated
+        """
+        processed_data = self.pre_process(script, formatter=LEVEL_ONLY_FORMATTER, **kwargs)
+        with evaluator_scope(type(self).__name__):
+            try:
+                result = self.level_result(probabilities=self.llm.score_choices(processed_data, LEVEL_DIGITS))
+            except NotImplementedError:
+                result = self.level_result(llm_response=self.llm.generate(processed_data))
+
+        if self.needs_full_evaluation(result, min_confidence):
+            full_result = self.evaluate(script, **kwargs)
+            full_result["level_only"] = result
+            return full_result
+        return result
+
+    async def a_evaluate_level(self, script: str | List[str] = None, min_confidence: float = None, **kwargs) -> Dict:
+        """Async variant of `evaluate_level`"""
+        processed_data = self.pre_process(script, formatter=LEVEL_ONLY_FORMATTER, **kwargs)
+        with evaluator_scope(type(self).__name__):
+            try:
+                result = self.level_result(probabilities=await self.llm.a_score_choices(processed_data, LEVEL_DIGITS))
+            except NotImplementedError:
+                result = self.level_result(llm_response=await self.llm.a_generate(processed_data))
+
+        if self.needs_full_evaluation(result, min_confidence):
+            full_result = await self.a_evaluate(script, **kwargs)
+            full_result["level_only"] = result
+            return full_result
+        return result
+
+    async def a_call_llm(self, processed_data: Any) -> str:
+        """
+        Async execute the LLM call with the processed evaluation prompt.
+
+        Args:
+            processed_data: Formatted evaluation prompt from pre_process
+
+        Returns:
+            Raw LLM response string
+        """
+        return await self.llm.a_generate(processed_data, **self.generation_kwargs)
+
+    async def a_evaluate(
+        self,
+        script: str | List[str] = None,
+        semaphore: asyncio.Semaphore = None,
+        **kwargs
+    ) -> Dict:
+        """
+        Async evaluation workflow, mirrors `evaluate` but awaits the LLM call.
+
+        Args:
+            script: User's script to evaluate
+            semaphore: Held around each LLM call (not around prompt building and parsing);
+                the windows of a chunked transcript share it, so callers bounding their
+                requests with one semaphore stay within that bound
+            kwargs: Additional template parameters
+
+        Returns:
+            Dictionary of evaluation metrics and scores
+        """
+        windows = self.chunk(script)
+        if len(windows) > 1:
+            results = await self.a_evaluate_many(windows, semaphore=semaphore, **kwargs)
+            return self.reduce_chunks(results, windows)
+
+        processed_data = self.pre_process(script, **kwargs)
+        with evaluator_scope(type(self).__name__):
+            if semaphore is None:
+                llm_response = await self.a_call_llm(processed_data)
+            else:
+                async with semaphore:
+                    llm_response = await self.a_call_llm(processed_data)
+        return self.post_process(llm_response)
+
+    def evaluate_many(self, scripts: List[Any], concurrency: int = 8, **kwargs) -> List[Dict]:
+        """
+        Evaluate many scripts with up to `concurrency` LLM calls in flight on a thread pool.
+        Each worker builds its prompt, calls the LLM and parses the response, so prompt
+        building and parsing overlap with other items' calls. Backends with native batching
+        (e.g. vLLM) are better served by `evaluate_batch`.
+
+        Args:
+            scripts: Inputs for `pre_process`, one per evaluation
+            concurrency: Maximum number of concurrent evaluations
+            kwargs: Additional template parameters shared by every script
+
+        Returns:
+            Results in the same order as `scripts`; an item whose evaluation raised gets a
+            `failed_result` with the error instead of failing the whole call
+        """
+        def run_one(script):
+            try:
+                return self.evaluate(script, **kwargs)
+            except Exception as e:
+                logger.warning(f"{type(self).__name__} failed on one item: {e}")
+                return failed_result(e)
+
+        if not scripts:
+            return []
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(scripts))) as executor:
+            return list(executor.map(run_one, scripts))
+
+    async def a_evaluate_many(
+        self,
+        scripts: List[Any],
+        concurrency: int = 8,
+        semaphore: asyncio.Semaphore = None,
+        **kwargs
+    ) -> List[Dict]:
+        """
+        Async variant of `evaluate_many`: each item goes through `a_evaluate`, with at most
+        `concurrency` LLM calls in flight.
+
+        Args:
+            scripts: Inputs for `pre_process`, one per evaluation
+            concurrency: Maximum number of concurrent LLM calls
+            semaphore: Caller's semaphore to share instead of a new one of size `concurrency`
+            kwargs: Additional template parameters shared by every script
+
+        Returns:
+            Results in the same order as `scripts`, with `failed_result` for items that raised
+        """
+        semaphore = semaphore or asyncio.Semaphore(concurrency)
+
+        async def run_one(script):
+            try:
+                # a_evaluate takes the semaphore per LLM call; holding it here as well would
+                # deadlock chunked items waiting on their windows
+                return await self.a_evaluate(script, semaphore=semaphore, **kwargs)
+            except Exception as e:
+                logger.warning(f"{type(self).__name__} failed on one item: {e}")
+                return failed_result(e)
+
+        return list(await asyncio.gather(*(run_one(script) for script in scripts)))
@@ -0,0 +1,107 @@
+from __future__ import annotations  # for pervious python version e.g. 3.9
+import re
+from typing import Callable, List, Sequence, Tuple
+
+from utils.rate_limit import estimate_tokens
+from .prompt_manager import CEFR_LEVELS
+
+# Speaker label of a transcript line, after an optional "[0.00s -> 1.23s]" timestamp,
+# e.g. "SPEAKER_00:" from speaker_diarization.py or "User:"
+SPEAKER_PATTERN = re.compile(r"^\s*(?:\[[^\]]*\]\s*)?([^:\[\]\n]{1,40}):")
+
+
+def split_turns(transcript: str) -> List[str]:
+    """
+    Split a transcript into speaker turns: runs of consecutive lines by the same speaker.
+    Lines without a speaker label continue the current turn.
+    """
+    turns, lines, speaker = [], [], None
+    for line in transcript.splitlines():
+        if not line.strip():
+            continue
+        match = SPEAKER_PATTERN.match(line)
+        line_speaker = match.group(1).strip() if match else speaker
+        if lines and line_speaker != speaker:
+            turns.append("\n".join(lines))
+            lines = []
+        speaker = line_speaker
+        lines.append(line)
+    if lines:
+        turns.append("\n".join(lines))
+    return turns
+
+
+def _split_long_turn(turn: str, max_tokens: int, count_tokens: Callable[[str], int]) -> List[str]:
+    """Cut a turn longer than the budget at line, then word, boundaries"""
+    pieces, current = [], ""
+    for word in re.split(r"(?<=\s)", turn):
+        if current and count_tokens(current + word) > max_tokens:
+            pieces.append(current.rstrip())
+            current = ""
+        current += word
+    if current.strip():
+        pieces.append(current.rstrip())
+    return pieces
+
+
+def chunk_transcript(
+    transcript: str,
+    max_tokens: int,
+    overlap_turns: int = 1,
+    count_tokens: Callable[[str], int] = estimate_tokens
+) -> List[str]:
+    """
+    Pack whole speaker turns into windows of at most `max_tokens` transcript tokens.
+
+    Args:
+        transcript: Full transcript text
+        max_tokens: Token budget of one window (the rubric and answer come on top)
+        overlap_turns: Turns repeated from the end of the previous window, so a question
+            and its answer are not judged apart; dropped when they do not fit
+        count_tokens: Token counter, 4 characters per token by default
+
+    Returns:
+        Windows in transcript order; just `[transcript]` when it fits the budget
+    """
+    if count_tokens(transcript) <= max_tokens:
+        return [transcript]
+
+    turns = []
+    for turn in split_turns(transcript):
+        if count_tokens(turn) > max_tokens:
+            turns.extend(_split_long_turn(turn, max_tokens, count_tokens))
+        else:
+            turns.append(turn)
+
+    windows, current, fresh = [], [], 0
+    for turn in turns:
+        if fresh and count_tokens("\n".join(current + [turn])) > max_tokens:
+            windows.append("\n".join(current))
+            current = current[-overlap_turns:] if overlap_turns else []
+            fresh = 0
+            while current and count_tokens("\n".join(current + [turn])) > max_tokens:
+                current.pop(0)
+        current.append(turn)
+        fresh += 1
+    if fresh:
+        windows.append("\n".join(current))
+    return windows
+
+
+def weighted_median_level(levels: Sequence[Tuple[str, float]]) -> str:
+    """
+    Combine window levels into one: the median level with each window weighted by its
+    length (the lower level on an exact tie). A short window with an outlier level
+    cannot move the result, and a long session is judged by where most of the speech sits.
+
+    Args:
+        levels: (cefr_level, weight) pairs
+    """
+    ordered = sorted(levels, key=lambda item: CEFR_LEVELS.index(item[0]))
+    half = sum(weight for _, weight in ordered) / 2
+    cumulative = 0.0
+    for level, weight in ordered:
+        cumulative += weight
+        if cumulative >= half:
+            return level
+    return ordered[-1][0]
@@ -0,0 +1,150 @@
+from __future__ import annotations  # for pervious python version e.g. 3.9
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+from .base_evaluator import ConversationEvaluator, failed_result
+
+logger = logging.getLogger(__name__)
+
+
+class EvaluatorDAG:
+    """
+    Runs named evaluators as a dependency graph over one transcript.
+
+    Evaluators with no `inputs` evaluate the transcript itself; an evaluator listing
+    `inputs` (e.g. CEFROverallEvaluator) receives `{name: result}` of those nodes as its
+    `pre_process` argument. In the async path every node starts as soon as its inputs
+    finish, so independent dimensions run concurrently and per-transcript latency is
+    the longest dimension plus the overall call rather than the sum of all of them.
+    """
+
+    def __init__(self, evaluators: Dict[str, ConversationEvaluator]):
+        """
+        Args:
+            evaluators: Node name -> evaluator; names are what other evaluators list in `inputs`
+
+        Raises:
+            ValueError: If a node lists an unknown input or the inputs form a cycle
+        """
+        self.evaluators = dict(evaluators)
+        self.order = self._topological_order()
+
+    def _topological_order(self) -> List[str]:
+        for name, evaluator in self.evaluators.items():
+            missing = [dep for dep in evaluator.inputs if dep not in self.evaluators]
+            if missing:
+                raise ValueError(f"Evaluator '{name}' depends on unknown node(s): {', '.join(missing)}")
+
+        order, state = [], {}
+
+        def visit(name: str, path: Tuple[str, ...]):
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError(f"Evaluator inputs form a cycle: {' -> '.join(path + (name,))}")
+            state[name] = "visiting"
+            for dep in self.evaluators[name].inputs:
+                visit(dep, path + (name,))
+            state[name] = "done"
+            order.append(name)
+
+        for name in self.evaluators:
+            visit(name, ())
+        return order
+
+    def _node_input(self, name: str, script: Any, results: Dict[str, Dict]) -> Any:
+        inputs = self.evaluators[name].inputs
+        if not inputs:
+            return script
+        failed = [dep for dep in inputs if "error" in results[dep]]
+        if failed:
+            # A holistic judgement over placeholder A1 results would be misleading
+            raise RuntimeError(f"Skipped because input(s) failed: {', '.join(failed)}")
+        return {dep: results[dep] for dep in inputs}
+
+    def run(self, script: Any, level_only: bool = False, min_confidence: float = None) -> Dict[str, Dict]:
+        """
+        Evaluate every node one after another in dependency order.
+
+        Args:
+            script: Transcript given to nodes without inputs
+            level_only: Use `evaluate_level` for nodes without inputs
+            min_confidence: Passed to `evaluate_level`
+
+        Returns:
+            Node name -> result, with `failed_result` for nodes that raised or whose inputs failed
+        """
+        results = {}
+        for name in self.order:
+            evaluator = self.evaluators[name]
+            try:
+                data = self._node_input(name, script, results)
+                if level_only and not evaluator.inputs:
+                    results[name] = evaluator.evaluate_level(data, min_confidence=min_confidence)
+                else:
+                    results[name] = evaluator.evaluate(data)
+            except Exception as e:
+                logger.warning(f"{name} evaluation failed: {e}")
+                results[name] = failed_result(e)
+        return {name: results[name] for name in self.evaluators}
+
+    async def a_stream(
+        self,
+        script: Any,
+        semaphore: asyncio.Semaphore = None,
+        level_only: bool = False,
+        min_confidence: float = None
+    ) -> AsyncIterator[Tuple[str, Dict]]:
+        """
+        Evaluate all nodes concurrently and yield `(name, result)` as each one finishes.
+
+        Args:
+            script: Transcript given to nodes without inputs
+            semaphore: Bounds concurrent LLM calls, shared across transcripts by the caller
+            level_only: Use `a_evaluate_level` for nodes without inputs
+            min_confidence: Passed to `a_evaluate_level`
+        """
+        semaphore = semaphore or asyncio.Semaphore(len(self.evaluators))
+        results: Dict[str, Dict] = {}
+        finished: asyncio.Queue = asyncio.Queue()
+        tasks: Dict[str, asyncio.Task] = {}
+
+        async def run_node(name: str) -> None:
+            evaluator = self.evaluators[name]
+            # Inputs were scheduled first (topological order) and never raise
+            await asyncio.gather(*(tasks[dep] for dep in evaluator.inputs))
+            try:
+                data = self._node_input(name, script, results)
+                if level_only and not evaluator.inputs:
+                    async with semaphore:
+                        result = await evaluator.a_evaluate_level(data, min_confidence=min_confidence)
+                else:
+                    # Taken per LLM call, so the windows of a chunked transcript count against it too
+                    result = await evaluator.a_evaluate(data, semaphore=semaphore)
+            except Exception as e:
+                logger.warning(f"{name} evaluation failed: {e}")
+                result = failed_result(e)
+            results[name] = result
+            finished.put_nowait((name, result))
+
+        for name in self.order:
+            tasks[name] = asyncio.create_task(run_node(name))
+        try:
+            for _ in range(len(tasks)):
+                yield await finished.get()
+        finally:
+            # The consumer stopped early, do not leave nodes running
+            for task in tasks.values():
+                task.cancel()
+
+    async def a_run(
+        self,
+        script: Any,
+        semaphore: asyncio.Semaphore = None,
+        level_only: bool = False,
+        min_confidence: float = None
+    ) -> Dict[str, Dict]:
+        """Async counterpart of `run`, collecting everything `a_stream` yields"""
+        results = {name: result async for name, result in self.a_stream(script, semaphore, level_only, min_confidence)}
+        return {name: results[name] for name in self.evaluators}
@@ -2,11 +2,12 @@ from __future__ import annotations  # for pervious python version e.g. 3.9
 
 import asyncio
 import json
-from typing import List, Dict, Union, Any
+from typing import List, Dict, Union, Any, Optional, Tuple
 from evaluator.base_evaluator import ConversationEvaluator
-from evaluator.prompt_manager import EvaluationType, EvalPromptManager
+from evaluator.prompt_manager import EvaluationType, EvalPromptManager, json_object_schema, CEFR_LEVEL_SCHEMA
 
 from utils.llm import LLMClient
+from evaluation.overall_score_weighted import CEFR_TO_SCORE, calculate_weighted_score, get_cefr_level
 
 import os
 import logging
@@ -20,6 +21,8 @@ class GrammarEvaluator(ConversationEvaluator):
     and assigns a CEFR level based on grammatical control and accuracy.
     """
 
+    eval_type = EvaluationType.GRAMMAR_EVALUATION
+
     def __init__(self, llm_class: type[LLMClient] = None, **llm_kwargs):
         super().__init__(llm_class, **llm_kwargs)
 
@@ -30,12 +33,13 @@ class GrammarEvaluator(ConversationEvaluator):
     ) -> str:
         return EvalPromptManager().build_prompt(
             script=script,
-            eval_type=EvaluationType.GRAMMAR_EVALUATION,
+            eval_type=self.eval_type,
             text=script,  # The text to evaluate is the script
+            formatter=kwargs.get("formatter"),
         )
 
     def call_llm(self, processed_data: str) -> str:
-        return self.llm.generate(processed_data)
+        return self.llm.generate(processed_data, **self.generation_kwargs)
 
     def post_process(self, llm_response: str, **kwargs) -> Dict[str, Any]:
         """Parse JSON response into CEFR level assessment dictionary"""
@@ -78,6 +82,35 @@ class GrammarEvaluator(ConversationEvaluator):
                 "raw_output": response_text,
             }
     
+    def reduce_chunks(self, results: List[Dict], windows: List[str]) -> Dict:
+        """
+        Merge the errors found in every window (dropping duplicates from overlapping turns)
+        and level the merged list with the same rule as a whole transcript.
+        """
+        reduced = super().reduce_chunks(results, windows)
+        errors, seen = [], set()
+        for result in results:
+            if "error" in result or result.get("num_errors", -1) < 0:
+                continue
+            for error in result.get("errors", []):
+                key = json.dumps(error, sort_keys=True)
+                if key not in seen:
+                    seen.add(key)
+                    errors.append(error)
+        if not seen and all(result.get("num_errors", -1) < 0 for result in results):
+            # No window parsed, keep the base reduction's failure result
+            return reduced
+
+        cefr_level = self._determine_cefr_level(len(errors), errors)
+        reduced.update(
+            cefr_level=cefr_level,
+            num_errors=len(errors),
+            errors=errors,
+            reasoning=self._generate_reasoning(cefr_level, errors),
+            raw_output=[result.get("raw_output") for result in results],
+        )
+        return reduced
+
     def _determine_cefr_level(self, num_errors: int, errors: List[Dict[str, Any]]) -> str:
         """
         Determine the CEFR level based on the number and types of errors.
@@ -137,6 +170,8 @@ class CoherenceEvaluator(ConversationEvaluator):
     coherent and cohesive discourse using appropriate organisational patterns and connectors.
     """
 
+    eval_type = EvaluationType.COHERENCE_EVALUATION
+
     def __init__(self, llm_class: type[LLMClient] = None, **llm_kwargs):
         super().__init__(llm_class, **llm_kwargs)
 
@@ -147,12 +182,13 @@ class CoherenceEvaluator(ConversationEvaluator):
     ) -> str:
         return EvalPromptManager().build_prompt(
             script=script,
-            eval_type=EvaluationType.COHERENCE_EVALUATION,
+            eval_type=self.eval_type,
             text=script,  # The text to evaluate is the script
+            formatter=kwargs.get("formatter"),
         )
 
     def call_llm(self, processed_data: str) -> str:
-        return self.llm.generate(processed_data)
+        return self.llm.generate(processed_data, **self.generation_kwargs)
 
     def post_process(self, llm_response: str, **kwargs) -> Dict[str, Any]:
         """Parse JSON response into scores dictionary"""
@@ -187,6 +223,8 @@ class RangeEvaluator(ConversationEvaluator):
     ideas in different ways.
     """
 
+    eval_type = EvaluationType.RANGE_EVALUATION
+
     def __init__(self, llm_class: type[LLMClient] = None, **llm_kwargs):
         super().__init__(llm_class, **llm_kwargs)
 
@@ -197,12 +235,13 @@ class RangeEvaluator(ConversationEvaluator):
     ) -> str:
         return EvalPromptManager().build_prompt(
             script=script,
-            eval_type=EvaluationType.RANGE_EVALUATION,
+            eval_type=self.eval_type,
             text=script,  # The text to evaluate is the script
+            formatter=kwargs.get("formatter"),
         )
 
     def call_llm(self, processed_data: str) -> str:
-        return self.llm.generate(processed_data)
+        return self.llm.generate(processed_data, **self.generation_kwargs)
 
     def post_process(self, llm_response: str, **kwargs) -> Dict[str, Any]:
         """Parse JSON response into scores dictionary"""
@@ -236,6 +275,8 @@ class InteractionEvaluator(ConversationEvaluator):
     Provides a single CEFR level assessment with confidence score and supporting evidence.
     """
 
+    eval_type = EvaluationType.INTERACTION_EVALUATION
+
     def __init__(self, llm_class: type[LLMClient] = None, **llm_kwargs):
         super().__init__(llm_class, **llm_kwargs)
 
@@ -246,12 +287,13 @@ class InteractionEvaluator(ConversationEvaluator):
     ) -> str:
         return EvalPromptManager().build_prompt(
             script=script,
-            eval_type=EvaluationType.INTERACTION_EVALUATION,
+            eval_type=self.eval_type,
             text=script,  # The text to evaluate is the script
+            formatter=kwargs.get("formatter"),
         )
 
     def call_llm(self, processed_data: str) -> str:
-        return self.llm.generate(processed_data)
+        return self.llm.generate(processed_data, **self.generation_kwargs)
 
     def post_process(self, llm_response: str, **kwargs) -> Dict[str, Any]:
         """Parse JSON response into scores dictionary"""
@@ -291,6 +333,8 @@ class FluencyEvaluator(ConversationEvaluator):
     oneself with a natural flow, minimal pausing, and appropriate tempo.
     """
 
+    eval_type = EvaluationType.FLUENCY_EVALUATION
+
     def __init__(self, llm_class: type[LLMClient] = None, **llm_kwargs):
         super().__init__(llm_class, **llm_kwargs)
 
@@ -306,15 +350,16 @@ class FluencyEvaluator(ConversationEvaluator):
         
         return EvalPromptManager().build_prompt(
             script=script,
-            eval_type=EvaluationType.FLUENCY_EVALUATION,
+            eval_type=self.eval_type,
             text=script,  # The text to evaluate is the script
+            formatter=kwargs.get("formatter"),
             pause_frequency=pause_frequency,
             avg_pause_duration=avg_pause_duration,
             speaking_rate=speaking_rate,
         )
 
     def call_llm(self, processed_data: str) -> str:
-        return self.llm.generate(processed_data)
+        return self.llm.generate(processed_data, **self.generation_kwargs)
 
     def post_process(self, llm_response: str, **kwargs) -> Dict[str, Any]:
         """Parse JSON response into scores dictionary"""
@@ -352,10 +397,133 @@ class CEFROverallEvaluator(ConversationEvaluator):
     - Fluency
 
     This evaluator takes the results of other evaluators and provides a final holistic assessment.
+
+    The `policy` decides when the LLM is asked at all:
+    - "llm": always ask the LLM
+    - "weighted": never ask; the level is the weighted mean of the dimension levels
+      (CEFR_TO_SCORE / WEIGHTS from evaluation.overall_score_weighted), rounded to the nearest level
+    - "auto": use the weighted level when every dimension has a valid level, the levels span at
+      most `max_spread` steps and, for level-only results, every confidence_score is at least
+      `min_confidence`; escalate to the LLM otherwise
+
+    Every result records the path taken under "decision_path" ("weighted" or "llm") and why
+    under "decision_reason".
     """
 
-    def __init__(self, llm_class: type[LLMClient] = None, **llm_kwargs):
+    inputs = ("grammar", "coherence", "range", "interaction", "fluency")
+
+    POLICIES = ("llm", "weighted", "auto")
+
+    FORMATTER = (
+        "Respond ONLY with a JSON object containing:\n"
+        "- cefr_level (string): The final CEFR level (A1, A2, B1, B2, C1, C2)\n"
+        "- reasoning (string): Detailed explanation of how the individual assessments contribute to the final level\n"
+        "Example:\n"
+        "```json\n"
+        '{"cefr_level": "B1", "reasoning": "While grammar shows B2 capability, the consistent B1 performance across coherence, range, interaction, and fluency indicates an overall B1 level. The speaker can communicate effectively on familiar topics with reasonable accuracy, though with limitations in complexity and sophistication."}\n'
+        "```"
+    )
+
+    response_schema = json_object_schema({
+        "cefr_level": CEFR_LEVEL_SCHEMA,
+        "reasoning": {"type": "string"},
+    })
+
+    def __init__(
+        self,
+        llm_class: type[LLMClient] = None,
+        policy: str = "llm",
+        max_spread: int = 1,
+        min_confidence: float = None,
+        **llm_kwargs
+    ):
+        """
+        Args:
+            llm_class: LLM client class, see ConversationEvaluator
+            policy: One of POLICIES
+            max_spread: Largest gap between the highest and lowest dimension level (in levels)
+                that the "auto" policy settles without the LLM
+            min_confidence: Smallest level-only confidence_score the "auto" policy accepts
+            llm_kwargs: Arguments for ConversationEvaluator
+        """
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown overall policy '{policy}', expected one of {', '.join(self.POLICIES)}")
         super().__init__(llm_class, **llm_kwargs)
+        self.policy = policy
+        self.max_spread = max_spread
+        self.min_confidence = min_confidence
+
+    def short_circuit(self, evaluation_results: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], str]:
+        """
+        Apply the policy without calling the LLM.
+
+        Returns:
+            (weighted result, reason) when the level can be decided deterministically,
+            (None, reason for escalating) otherwise
+        """
+        if self.policy == "llm":
+            return None, "policy is llm"
+
+        levels = {}
+        for name in self.inputs:
+            result = evaluation_results.get(name) or {}
+            level = str(result.get("cefr_level", "")).upper()
+            # Failed evaluations and unparsed answers carry a placeholder A1
+            unparsed = result.get("parsed") is False or result.get("reasoning") == "Error processing response"
+            if "error" not in result and not unparsed and level in CEFR_TO_SCORE:
+                levels[name] = level
+        weighted_score = calculate_weighted_score({name: {"cefr_level": level} for name, level in levels.items()})
+
+        if self.policy == "auto":
+            missing = [name for name in self.inputs if name not in levels]
+            if missing:
+                return None, f"no valid level for {', '.join(missing)}"
+            scores = [CEFR_TO_SCORE[level] for level in levels.values()]
+            if max(scores) - min(scores) > self.max_spread:
+                return None, f"levels span {min(levels.values())}-{max(levels.values())}"
+            if self.min_confidence is not None:
+                unsure = []
+                for name in self.inputs:
+                    # Only full results without a score count as confident; 0.0 is a real score
+                    confidence = evaluation_results[name].get("confidence_score")
+                    confidence = 1.0 if confidence is None else confidence
+                    if confidence < self.min_confidence:
+                        unsure.append(name)
+                if unsure:
+                    return None, f"confidence below {self.min_confidence} for {', '.join(unsure)}"
+        elif not levels:
+            return None, "no valid dimension levels"
+
+        reason = (f"weighted mean {weighted_score:.2f} of "
+                  + ", ".join(f"{name} {level}" for name, level in levels.items()))
+        return {
+            "cefr_level": get_cefr_level(weighted_score),
+            "reasoning": f"Deterministic {self.policy} decision: {reason}",
+            "weighted_score": round(weighted_score, 2),
+            "decision_path": "weighted",
+            "decision_reason": reason,
+        }, reason
+
+    def evaluate(self, evaluation_results: Dict[str, Any] = None, **kwargs) -> Dict:
+        result, reason = self.short_circuit(evaluation_results)
+        if result is not None:
+            return result
+        result = super().evaluate(evaluation_results, **kwargs)
+        result.update(decision_path="llm", decision_reason=reason)
+        return result
+
+    async def a_evaluate(
+        self,
+        evaluation_results: Dict[str, Any] = None,
+        semaphore: asyncio.Semaphore = None,
+        **kwargs
+    ) -> Dict:
+        result, reason = self.short_circuit(evaluation_results)
+        if result is not None:
+            return result
+        result = await super().a_evaluate(evaluation_results, semaphore=semaphore, **kwargs)
+        result.update(decision_path="llm", decision_reason=reason)
+        return result
 
     def pre_process(
         self,
@@ -383,19 +551,13 @@ class CEFROverallEvaluator(ConversationEvaluator):
             f"5. Fluency: {fluency.get('cefr_level', 'N/A')}\n"
             f"   Reasoning: {fluency.get('reasoning', 'N/A')}\n\n"
             "Based on these evaluations, provide a holistic CEFR assessment.\n\n"
-            "Respond ONLY with a JSON object containing:\n"
-            "- cefr_level (string): The final CEFR level (A1, A2, B1, B2, C1, C2)\n"
-            "- reasoning (string): Detailed explanation of how the individual assessments contribute to the final level\n"
-            "Example:\n"
-            "```json\n"
-            '{"cefr_level": "B1", "reasoning": "While grammar shows B2 capability, the consistent B1 performance across coherence, range, interaction, and fluency indicates an overall B1 level. The speaker can communicate effectively on familiar topics with reasonable accuracy, though with limitations in complexity and sophistication."}\n'
-            "```"
+            f"{kwargs.get('formatter') or self.FORMATTER}"
         )
         
         return comprehensive_prompt
 
     def call_llm(self, processed_data: str) -> str:
-        return self.llm.generate(processed_data)
+        return self.llm.generate(processed_data, **self.generation_kwargs)
 
     def post_process(self, llm_response: str, **kwargs) -> Dict[str, Any]:
         """Parse JSON response into scores dictionary"""
@@ -420,3 +582,115 @@ class CEFROverallEvaluator(ConversationEvaluator):
                 "raw_output": response_text,
             }
 
+
+
+class CombinedEvaluator(ConversationEvaluator):
+    """
+    Evaluates grammar, coherence, range, interaction and fluency with a single LLM call.
+
+    The transcript is sent once together with every dimension's rubric, and the structured
+    response is split back into the same per-dimension result dictionaries produced by
+    the individual evaluators, so downstream consumers see an identical layout.
+    """
+
+    eval_type = EvaluationType.COMBINED_EVALUATION
+
+    DIMENSIONS = {
+        "grammar": GrammarEvaluator,
+        "coherence": CoherenceEvaluator,
+        "range": RangeEvaluator,
+        "interaction": InteractionEvaluator,
+        "fluency": FluencyEvaluator,
+    }
+
+    def __init__(self, llm_class: type[LLMClient] = None, **llm_kwargs):
+        if llm_class is None and "llm" not in llm_kwargs:
+            # Five answers in one response need more room than the single-dimension default
+            llm_kwargs.setdefault("max_tokens", 6000)
+        super().__init__(llm_class, **llm_kwargs)
+        # Dimension evaluators only parse responses, so they share this evaluator's client
+        self.dimension_evaluators = {
+            name: evaluator_class(llm=self.llm)
+            for name, evaluator_class in self.DIMENSIONS.items()
+        }
+
+    def pre_process(
+        self,
+        script: str | List[str],
+        **kwargs,
+    ) -> str:
+        return EvalPromptManager().build_prompt(
+            script=script,
+            eval_type=self.eval_type,
+            text=script,  # The text to evaluate is the script
+            formatter=kwargs.get("formatter"),
+            pause_frequency=kwargs.get("pause_frequency", "Not provided"),
+            avg_pause_duration=kwargs.get("avg_pause_duration", "Not provided"),
+            speaking_rate=kwargs.get("speaking_rate", "Not provided"),
+            grammar_criteria=EvaluationType.GRAMMAR_EVALUATION.criteria,
+            coherence_criteria=EvaluationType.COHERENCE_EVALUATION.criteria,
+            range_criteria=EvaluationType.RANGE_EVALUATION.criteria,
+            interaction_criteria=EvaluationType.INTERACTION_EVALUATION.criteria,
+            fluency_criteria=EvaluationType.FLUENCY_EVALUATION.criteria,
+        )
+
+    def call_llm(self, processed_data: str) -> str:
+        return self.llm.generate(processed_data, **self.generation_kwargs)
+
+    def evaluate_level(self, script: str | List[str] = None, min_confidence: float = None, **kwargs) -> Dict:
+        """
+        Level-only evaluation of every dimension, in the same per-dimension layout as `evaluate`.
+
+        A single level token cannot answer for five dimensions, so each dimension evaluator
+        makes its own level-only call (and escalates on its own when below `min_confidence`).
+        """
+        return {
+            name: evaluator.evaluate_level(script, min_confidence=min_confidence, **kwargs)
+            for name, evaluator in self.dimension_evaluators.items()
+        }
+
+    async def a_evaluate_level(self, script: str | List[str] = None, min_confidence: float = None, **kwargs) -> Dict:
+        """Async variant of `evaluate_level`, scoring the dimensions concurrently"""
+        results = await asyncio.gather(*(
+            evaluator.a_evaluate_level(script, min_confidence=min_confidence, **kwargs)
+            for evaluator in self.dimension_evaluators.values()
+        ))
+        return dict(zip(self.dimension_evaluators, results))
+
+    def reduce_chunks(self, results: List[Dict], windows: List[str]) -> Dict:
+        """Reduce each dimension across windows with that dimension's own evaluator"""
+        # A window that raised has one flat failed result instead of per-dimension results
+        return {
+            name: evaluator.reduce_chunks([result.get(name, result) for result in results], windows)
+            for name, evaluator in self.dimension_evaluators.items()
+        }
+
+    def post_process(self, llm_response: str, **kwargs) -> Dict[str, Dict[str, Any]]:
+        """Split the combined JSON response into per-dimension result dictionaries"""
+        try:
+            # Clean response and parse JSON
+            response_text = (
+                llm_response.strip().replace("```json", "").replace("```", "")
+            )
+            result = json.loads(response_text)
+            if not isinstance(result, dict):
+                raise KeyError("combined response is not a JSON object")
+
+        except (json.JSONDecodeError, KeyError) as e:
+            logger.error(f"Error processing combined evaluation response: {e}")
+            # Let every dimension record its own parse failure with the raw output
+            return {
+                name: evaluator.post_process(llm_response)
+                for name, evaluator in self.dimension_evaluators.items()
+            }
+
+        scores = {}
+        for name, evaluator in self.dimension_evaluators.items():
+            dimension_result = result.get(name)
+            if not isinstance(dimension_result, dict):
+                logger.error(f"Combined evaluation response has no {name} object")
+                # An empty response falls through to the evaluator's own error handling
+                scores[name] = evaluator.post_process("")
+                continue
+            scores[name] = evaluator.post_process(json.dumps(dimension_result))
+        return scores
@@ -1,19 +1,123 @@
 from __future__ import annotations
 from enum import Enum, auto
-from typing import Dict, Any
+from typing import Dict, Any, List
 from utils.base import BasePrompt
 import logging
 logger = logging.getLogger(__name__)
 
+CEFR_LEVELS = ["A1", "A2", "B1", "B2", "C1", "C2"]
+
+# Levels are requested as digits because digits are single tokens in common tokenizers,
+# whereas "B1" is often split into "B" + "1", which hides its probability behind two steps
+LEVEL_ONLY_FORMATTER = (
+    "Respond ONLY with a single digit giving the assessed CEFR level: "
+    "1 = A1, 2 = A2, 3 = B1, 4 = B2, 5 = C1, 6 = C2. Do not write anything else."
+)
+
+# Closing fence of a ```json answer. JSON strings cannot hold a raw newline, so this only
+# matches after the object; answers opened with a bare ``` fence would be cut off instead
+JSON_FENCE_STOP = "```\n"
+
+def formatter_stop_sequences(formatter: str) -> List[str]:
+    """Stop sequences ending generation after the answer a formatter asks for"""
+    return [JSON_FENCE_STOP] if "```json" in formatter else []
+
+def json_object_schema(properties: Dict[str, Any]) -> Dict[str, Any]:
+    """Strict JSON schema object: every property required, no extra keys (OpenAI strict mode rules)"""
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False,
+    }
+
+
+CEFR_LEVEL_SCHEMA = {"type": "string", "enum": CEFR_LEVELS}
+STRING_LIST_SCHEMA = {"type": "array", "items": {"type": "string"}}
+
+GRAMMAR_SCHEMA = json_object_schema({
+    "errors": {
+        "type": "array",
+        "items": json_object_schema({
+            "category": {"type": "string"},
+            "location": {"type": "string"},
+            "correction": {"type": "string"},
+            "explanation": {"type": "string"},
+        }),
+    },
+    "cefr_level": CEFR_LEVEL_SCHEMA,
+    "reasoning": {"type": "string"},
+})
+
+COHERENCE_SCHEMA = json_object_schema({
+    "cefr_level": CEFR_LEVEL_SCHEMA,
+    "reasoning": {"type": "string"},
+})
+
+VOCABULARY_SCHEMA = json_object_schema({
+    "overall_score": {"type": "number"},
+    "criterion_scores": json_object_schema({
+        name: {"type": "number"}
+        for name in ["word_variety", "word_level", "word_choice", "collocations", "academic_vocab"]
+    }),
+    "reasoning": json_object_schema({
+        f"{name}_reasoning": {"type": "string"}
+        for name in ["word_variety", "word_level", "word_choice", "collocations", "academic_vocab"]
+    }),
+    "vocabulary_features": json_object_schema({
+        "unique_words": {"type": "integer"},
+        "total_words": {"type": "integer"},
+        "advanced_words": STRING_LIST_SCHEMA,
+        "repeated_words": STRING_LIST_SCHEMA,
+    }),
+    "summary": {"type": "string"},
+})
+
+INTERACTION_SCHEMA = json_object_schema({
+    "cefr_level": CEFR_LEVEL_SCHEMA,
+    "confidence_score": {"type": "number"},
+    "reasoning": {"type": "string"},
+    "key_features": STRING_LIST_SCHEMA,
+    "summary": {"type": "string"},
+})
+
+RANGE_SCHEMA = json_object_schema({
+    "cefr_level": CEFR_LEVEL_SCHEMA,
+    "reasoning": {"type": "string"},
+    "vocabulary_features": STRING_LIST_SCHEMA,
+    "summary": {"type": "string"},
+})
+
+FLUENCY_SCHEMA = json_object_schema({
+    "cefr_level": CEFR_LEVEL_SCHEMA,
+    "reasoning": {"type": "string"},
+    "fluency_features": STRING_LIST_SCHEMA,
+    "summary": {"type": "string"},
+})
+
+COMBINED_SCHEMA = json_object_schema({
+    "grammar": GRAMMAR_SCHEMA,
+    "coherence": COHERENCE_SCHEMA,
+    "range": RANGE_SCHEMA,
+    "interaction": INTERACTION_SCHEMA,
+    "fluency": FLUENCY_SCHEMA,
+})
+
+
 class EvaluationType(BasePrompt):
-    """Enumeration of different evaluation prompt types with JSON formatting"""
+    """Enumeration of different evaluation prompt types with JSON formatting.
+
+    Templates place the static rubric ({criteria}, {formatter}) before any per-transcript
+    field so every prompt of one type shares a long identical prefix, which server-side
+    prefix caching (vLLM automatic prefix caching, OpenAI prompt caching) can reuse.
+    """
     GRAMMAR_EVALUATION = {
         'template': (
             "Evaluate grammatical errors of the User using the following error categories and examples as reference.\n"
-            "Text to evaluate: {text}\n\n"
             "Error Categories and Examples:\n{criteria}\n\n"
             "Please analyze the text and identify any grammatical errors, categorizing them according to the provided categories.\n"
-            "{formatter}"
+            "{formatter}\n\n"
+            "Text to evaluate: {text}"
         ),
         'criteria': (
             "1. Subject-Verb Agreement\n"
@@ -90,16 +194,17 @@ class EvaluationType(BasePrompt):
             "```json\n"
             '{"errors": [{"category": "1. Subject-Verb Agreement", "location": "The team are playing", "correction": "The team is playing", "explanation": "Collective noun requires singular verb"}], "cefr_level": "B2", "reasoning": "Shows a relatively high degree of grammatical control. Does not make errors which cause misunderstanding, and can correct most of his/her mistakes."}\n'
             "```"
-        )
+        ),
+        'schema': GRAMMAR_SCHEMA
     }
     
     COHERENCE_EVALUATION = {
         'template': (
             "Evaluate the coherence of the User and determine its CEFR level based on the following criteria:\n"
-            "Text to evaluate: {text}\n\n"
             "CEFR Coherence Criteria:\n{criteria}\n\n"
             "Please analyze the text and determine which CEFR level best describes the coherence demonstrated.\n"
-            "{formatter}"
+            "{formatter}\n\n"
+            "Text to evaluate: {text}"
         ),
         'criteria': (
             "C2 Level:\n"
@@ -135,16 +240,17 @@ class EvaluationType(BasePrompt):
             "```json\n"
             '{"cefr_level": "B2", "reasoning": "The text demonstrates B2-level coherence with appropriate use of cohesive devices, though there are some minor inconsistencies in longer sections. The overall structure is clear but could benefit from more sophisticated connectors."}\n'
             "```"
-        )
+        ),
+        'schema': COHERENCE_SCHEMA
     }
 
     VOCABULARY_EVALUATION = {
         'template': (
             "Evaluate the vocabulary of the User based on the following criteria:\n"
-            "Text to evaluate: {text}\n\n"
             "Evaluation Criteria:\n{criteria}\n\n"
             "Please analyze the text and provide scores and reasoning for each criterion.\n"
-            "{formatter}"
+            "{formatter}\n\n"
+            "Text to evaluate: {text}"
         ),
         'criteria': (
             "1. Word Variety\n"
@@ -193,16 +299,17 @@ class EvaluationType(BasePrompt):
             "```json\n"
             '{"overall_score": 0.85, "criterion_scores": {"word_variety": 0.9, "word_level": 0.8, "word_choice": 0.85, "collocations": 0.8, "academic_vocab": 0.85}, "reasoning": {"word_variety_reasoning": "Good mix of vocabulary with minimal repetition", "word_level_reasoning": "Appropriate use of advanced vocabulary", "word_choice_reasoning": "Words chosen with precision", "collocations_reasoning": "Natural word combinations", "academic_vocab_reasoning": "Domain-specific terms used appropriately"}, "vocabulary_features": {"unique_words": 150, "total_words": 200, "advanced_words": ["sophisticated", "comprehensive", "analytical"], "repeated_words": ["important"]}, "summary": "The text demonstrates strong vocabulary usage with good variety and appropriate word choices."}\n'
             "```"
-        )
+        ),
+        'schema': VOCABULARY_SCHEMA
     }
 
     INTERACTION_EVALUATION = {
         'template': (
             "Evaluate the interaction skills of the User and determine its CEFR level:\n"
-            "Conversation to evaluate: {text}\n\n"
             "CEFR Interaction Criteria:\n{criteria}\n\n"
             "Please analyze the conversation and determine which CEFR level best describes the interaction skills demonstrated.\n"
-            "{formatter}"
+            "{formatter}\n\n"
+            "Conversation to evaluate: {text}"
         ),
         'criteria': (
             "C2 Level:\n"
@@ -248,16 +355,17 @@ class EvaluationType(BasePrompt):
             "```json\n"
             '{"cefr_level": "B2", "confidence_score": 0.85, "reasoning": "The conversation demonstrates strong B2-level interaction skills, particularly in initiating discourse and managing turn-taking. While there are some sophisticated elements, the interaction lacks the natural flow and nuanced referencing typical of C1 level.", "key_features": ["Appropriate turn-taking", "Good topic management", "Clear conversation structure", "Effective comprehension checks"], "summary": "Strong B2-level interaction with clear structure and good turn management."}\n'
             "```"
-        )
+        ),
+        'schema': INTERACTION_SCHEMA
     }
 
     RANGE_EVALUATION = {
         'template': (
             "Evaluate the language range of the User and determine its CEFR level:\n"
-            "Text to evaluate: {text}\n\n"
             "CEFR Range Criteria:\n{criteria}\n\n"
             "Please analyze the text and determine which CEFR level best describes the language range demonstrated.\n"
-            "{formatter}"
+            "{formatter}\n\n"
+            "Text to evaluate: {text}"
         ),
         'criteria': (
             "C2 Level:\n"
@@ -301,20 +409,21 @@ class EvaluationType(BasePrompt):
             "```json\n"
             '{"cefr_level": "B2", "reasoning": "The text demonstrates B2-level language range with sufficient vocabulary to express ideas with some circumlocutions. While there is good use of idiomatic expressions, the vocabulary lacks the sophistication and nuance typical of C1 level.", "vocabulary_features": ["Good range of vocabulary", "Appropriate use of idiomatic expressions", "Some circumlocutions", "Field-specific terminology"], "summary": "Strong B2-level language range with good vocabulary variety."}\n'
             "```"
-        )
+        ),
+        'schema': RANGE_SCHEMA
     }
 
     FLUENCY_EVALUATION = {
         'template': (
             "Evaluate the fluency of the User and determine its CEFR level:\n"
-            "Text to evaluate: {text}\n\n"
+            "CEFR Fluency Criteria:\n{criteria}\n\n"
+            "Please analyze the text and the additional metrics and determine which CEFR level best describes the fluency demonstrated.\n"
+            "{formatter}\n\n"
             "Additional metrics:\n"
             "- Pause frequency: {pause_frequency}\n"
             "- Average pause duration: {avg_pause_duration}\n"
             "- Speaking rate: {speaking_rate}\n\n"
-            "CEFR Fluency Criteria:\n{criteria}\n\n"
-            "Please analyze the text and determine which CEFR level best describes the fluency demonstrated.\n"
-            "{formatter}"
+            "Text to evaluate: {text}"
         ),
         'criteria': (
             "C2 Level:\n"
@@ -352,7 +461,61 @@ class EvaluationType(BasePrompt):
             "```json\n"
             '{"cefr_level": "B2", "reasoning": "The text demonstrates B2-level fluency with a fairly even tempo and few noticeably long pauses. While there is some hesitation when searching for expressions, the overall flow is maintained.", "fluency_features": ["Even tempo", "Few long pauses", "Occasional hesitation", "Comprehensible flow"], "summary": "Strong B2-level fluency with good flow and minimal disruption."}\n'
             "```"
-        )
+        ),
+        'schema': FLUENCY_SCHEMA
+    }
+
+    COMBINED_EVALUATION = {
+        'template': (
+            "Evaluate the User in the conversation below on five CEFR dimensions: grammar, coherence, range, interaction and fluency.\n"
+            "Grammar Error Categories and Examples:\n{grammar_criteria}\n\n"
+            "CEFR Coherence Criteria:\n{coherence_criteria}\n\n"
+            "CEFR Range Criteria:\n{range_criteria}\n\n"
+            "CEFR Interaction Criteria:\n{interaction_criteria}\n\n"
+            "CEFR Fluency Criteria:\n{fluency_criteria}\n\n"
+            "Please analyze the text once and assess every dimension independently against its own criteria.\n"
+            "{formatter}\n\n"
+            "Additional fluency metrics:\n"
+            "- Pause frequency: {pause_frequency}\n"
+            "- Average pause duration: {avg_pause_duration}\n"
+            "- Speaking rate: {speaking_rate}\n\n"
+            "Text to evaluate: {text}"
+        ),
+        'formatter': (
+            "Respond ONLY with a JSON object containing one object per dimension:\n"
+            "- grammar (object):\n"
+            "  - errors (array of objects with category, location, correction and explanation strings)\n"
+            "  - cefr_level (string): The assessed CEFR level (C2, C1, B2, B1, A2, A1)\n"
+            "  - reasoning (string): Explanation of why this CEFR level was chosen\n"
+            "- coherence (object):\n"
+            "  - cefr_level (string): The assessed CEFR level (A1, A2, B1, B2, C1, C2)\n"
+            "  - reasoning (string): Explanation focusing on coherence features\n"
+            "- range (object):\n"
+            "  - cefr_level (string): The assessed CEFR level (A1, A2, B1, B2, C1, C2)\n"
+            "  - reasoning (string): Explanation of why this CEFR level was chosen\n"
+            "  - vocabulary_features (array): Vocabulary features that support this level\n"
+            "  - summary (string): Brief summary of the language range assessment\n"
+            "- interaction (object):\n"
+            "  - cefr_level (string): The assessed CEFR level (A1, A2, B1, B2, C1, C2)\n"
+            "  - confidence_score (float): Confidence in the assessment (0-1)\n"
+            "  - reasoning (string): Explanation of why this CEFR level was chosen\n"
+            "  - key_features (array): Interaction features that support this level\n"
+            "  - summary (string): Brief summary of the interaction assessment\n"
+            "- fluency (object):\n"
+            "  - cefr_level (string): The assessed CEFR level (A1, A2, B1, B2, C1, C2)\n"
+            "  - reasoning (string): Explanation of why this CEFR level was chosen\n"
+            "  - fluency_features (array): Fluency features that support this level\n"
+            "  - summary (string): Brief summary of the fluency assessment\n"
+            "Example:\n"
+            "```json\n"
+            '{"grammar": {"errors": [{"category": "1. Subject-Verb Agreement", "location": "The team are playing", "correction": "The team is playing", "explanation": "Collective noun requires singular verb"}], "cefr_level": "B2", "reasoning": "Shows a relatively high degree of grammatical control."}, '
+            '"coherence": {"cefr_level": "B2", "reasoning": "Uses a limited number of cohesive devices to link utterances into clear discourse."}, '
+            '"range": {"cefr_level": "B1", "reasoning": "Enough vocabulary to express ideas with some circumlocutions.", "vocabulary_features": ["Some circumlocutions"], "summary": "B1-level language range."}, '
+            '"interaction": {"cefr_level": "B2", "confidence_score": 0.8, "reasoning": "Initiates discourse and takes turns appropriately.", "key_features": ["Appropriate turn-taking"], "summary": "B2-level interaction."}, '
+            '"fluency": {"cefr_level": "B1", "reasoning": "Keeps going comprehensibly with evident pausing for planning.", "fluency_features": ["Regular pausing"], "summary": "B1-level fluency."}}\n'
+            "```"
+        ),
+        'schema': COMBINED_SCHEMA
     }
 
 class EvalPromptManager:
@@ -365,14 +528,17 @@ class EvalPromptManager:
         self,
         script: str = None,
         eval_type: EvaluationType = None,
+        formatter: str = None,
         **kwargs
     ) -> str:
         """
-        Construct an evaluation prompt with JSON formatting instructions
+        Construct an evaluation prompt with JSON formatting instructions.
+        The rubric comes first and the transcript last (see EvaluationType).
 
         Args:
             script: User's script to evaluate
             eval_type: Type of evaluation to perform
+            formatter: Output instructions replacing the eval type's own (e.g. LEVEL_ONLY_FORMATTER)
             kwargs: Additional template parameters
 
         Returns:
@@ -383,7 +549,7 @@ class EvalPromptManager:
         return eval_type.template.format(
             script=script,
             criteria=eval_type.criteria,
-            formatter=eval_type.formatter,
+            formatter=formatter or eval_type.formatter,
             **kwargs
         )
     
@@ -0,0 +1,31 @@
+import os
+import sys
+import asyncio
+sys.path.append("..")
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from evaluator.evaluators import GrammarEvaluator
+from utils.fake_server import FakeLLMServer
+from utils.llm import close_clients
+
+SAMPLE_TEXT = "User: Yesterday I goes to the park with my friends.\nNPC: What did you do there?"
+
+
+def main():
+    os.environ.setdefault("OPENAI_API_KEY", "fake")
+    with FakeLLMServer() as server:
+        # Both evaluators get the same registry client, which must work in every event loop
+        evaluators = [
+            GrammarEvaluator(base_url=server.base_url, model=server.model),
+            GrammarEvaluator(base_url=server.base_url, model=server.model),
+        ]
+        assert evaluators[0].llm is evaluators[1].llm, "evaluators with one configuration should share a client"
+
+        for run in range(2):
+            result = asyncio.run(evaluators[run].a_evaluate(SAMPLE_TEXT))
+            print(f"asyncio.run #{run + 1}: CEFR Level {result['cefr_level']}")
+        close_clients()
+
+
+if __name__ == "__main__":
+    main()
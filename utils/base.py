@@ -18,6 +18,11 @@ class BasePrompt(Enum):
     def formatter(self) -> str | Callable[..., str]:
         return self.value['formatter']
 
+    @property
+    def schema(self) -> dict | None:
+        """JSON schema of the expected response, used for structured-output decoding"""
+        return self.value.get('schema')
+
     @property
     def examples(self) -> str | Callable[..., str]:
         return self.value.get('examples', '')
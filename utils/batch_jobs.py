@@ -0,0 +1,128 @@
+from __future__ import annotations
+import io
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.llm import OpenAIClientLLM
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+class BatchJob:
+    """
+    Bulk chat completions through an OpenAI-style Batch API: requests are uploaded as one
+    JSONL file, processed asynchronously by the provider and downloaded when done.
+    Submission state is kept in a JSON file so an interrupted run resumes polling the
+    same batch instead of paying for it twice.
+    """
+
+    def __init__(self, llm: OpenAIClientLLM, state_path: str, poll_interval: float = 30.0):
+        """
+        Args:
+            llm: Client whose model, system message, params and endpoint the requests use
+            state_path: JSON file recording the submitted batch and its request metadata
+            poll_interval: Seconds between status checks
+        """
+        self.llm = llm
+        self.state_path = state_path
+        self.poll_interval = poll_interval
+
+    def request_line(self, custom_id: str, prompt: str, response_schema: Dict = None, stop: List[str] = None) -> Dict[str, Any]:
+        """One JSONL request, with the same body `OpenAIClientLLM.generate` would send"""
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": self.llm.model,
+                "messages": [
+                    {"role": "system", "content": self.llm.system_message},
+                    {"role": "user", "content": prompt}
+                ],
+                **self.llm._request_params(response_schema, stop)
+            },
+        }
+
+    def load_state(self) -> Optional[Dict[str, Any]]:
+        if not os.path.exists(self.state_path):
+            return None
+        with open(self.state_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def save_state(self, state: Dict[str, Any]) -> None:
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, indent=2)
+        # Atomic rename so a crash never leaves a half-written state file
+        os.replace(tmp_path, self.state_path)
+
+    def clear_state(self) -> None:
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+
+    def submit(self, requests: List[Dict[str, Any]], metadata: Dict[str, Any] = None) -> Dict[str, Any]:
+        """
+        Upload the requests and create a batch
+
+        Args:
+            requests: Lines built with `request_line`
+            metadata: Caller data stored with the state, e.g. where each custom_id's result goes
+
+        Returns:
+            The saved state
+        """
+        payload = "\n".join(json.dumps(request, ensure_ascii=False) for request in requests).encode("utf-8")
+        input_file = self.llm.client.files.create(
+            file=("batch_requests.jsonl", io.BytesIO(payload)),
+            purpose="batch"
+        )
+        batch = self.llm.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        state = {"batch_id": batch.id, "input_file_id": input_file.id, "metadata": metadata or {}}
+        self.save_state(state)
+        logger.info(f"Submitted batch {batch.id} with {len(requests)} requests")
+        return state
+
+    def wait(self, batch_id: str) -> Any:
+        """Poll until the batch reaches a terminal status and return it"""
+        while True:
+            batch = self.llm.client.batches.retrieve(batch_id)
+            counts = batch.request_counts
+            if counts is not None:
+                logger.info(f"Batch {batch_id} {batch.status}: {counts.completed}/{counts.total} done, {counts.failed} failed")
+            if batch.status in TERMINAL_STATUSES:
+                return batch
+            time.sleep(self.poll_interval)
+
+    def results(self, batch: Any) -> Dict[str, Tuple[Optional[str], Optional[str]]]:
+        """
+        Download a finished batch's output
+
+        Returns:
+            Mapping of custom_id to (response content, error message); requests missing from
+            the output are absent
+        """
+        results = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in self.llm.client.files.content(file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                response = record.get("response") or {}
+                if record.get("error") or response.get("status_code") != 200:
+                    error = record.get("error") or response.get("body", {}).get("error")
+                    results[record["custom_id"]] = (None, json.dumps(error))
+                else:
+                    content = response["body"]["choices"][0]["message"]["content"]
+                    results[record["custom_id"]] = (content, None)
+        return results
@@ -0,0 +1,431 @@
+from __future__ import annotations
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from utils.llm import LLMClient
+
+logger = logging.getLogger(__name__)
+
+
+def client_signature(llm: LLMClient) -> Dict[str, Any]:
+    """
+    Describe everything about a client that changes its output for a given prompt
+
+    Args:
+        llm: LLM client to describe
+
+    Returns:
+        Dictionary with backend class, model id, sampling params and system message
+    """
+    return {
+        "backend": type(llm).__name__,
+        "model": getattr(llm, "model", None) or getattr(llm, "model_path", None),
+        "params": getattr(llm, "params", None) or getattr(llm, "sampling_params", None),
+        "system_message": getattr(llm, "system_message", None),
+    }
+
+
+def request_key(llm: LLMClient, prompt: str, **kwargs) -> str:
+    """
+    Content-addressed key for an LLM request
+
+    Args:
+        llm: Client that will serve the request
+        prompt: Input prompt
+        kwargs: Per-call generation parameters
+
+    Returns:
+        Hex digest identifying the request
+    """
+    payload = {
+        **client_signature(llm),
+        "prompt_sha256": hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+        "kwargs": kwargs,
+    }
+    # default=repr covers non-JSON params such as vLLM SamplingParams
+    encoded = json.dumps(payload, sort_keys=True, default=repr)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """Persistent SQLite store of LLM responses with age and size based eviction"""
+
+    def __init__(self,
+                 path: str = ".llm_cache.sqlite",
+                 max_entries: Optional[int] = None,
+                 max_bytes: Optional[int] = None,
+                 max_age: Optional[float] = None):
+        """
+        Open (or create) a response cache
+
+        Args:
+            path: SQLite database file
+            max_entries: Keep at most this many responses, least recently used are evicted first
+            max_bytes: Keep at most this many bytes of response text
+            max_age: Entries older than this many seconds are treated as misses and evicted
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # WAL lets text_evaluation.py and speech_analysis.py share one cache file
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL, size INTEGER NOT NULL)"
+        )
+        # Requests some process is generating right now, so other processes wait instead of repeating them
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS inflight ("
+            "key TEXT PRIMARY KEY, owner TEXT NOT NULL, started REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self.evict()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response for `key`, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (self.max_age is not None and now - row[1] > self.max_age):
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def peek(self, key: str) -> Optional[str]:
+        """Cached response for `key` without touching hit/miss counters or access time"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or (self.max_age is not None and time.time() - row[1] > self.max_age):
+            return None
+        return row[0]
+
+    def claim(self, key: str, lease: float) -> Optional[str]:
+        """
+        Mark `key` as being generated by this caller
+
+        Args:
+            key: Request key
+            lease: Seconds after which another caller's claim counts as abandoned (e.g. it crashed)
+
+        Returns:
+            Owner token to pass to `release`, or None if another caller holds a live claim
+        """
+        owner = f"{os.getpid()}:{uuid.uuid4().hex}"
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO inflight (key, owner, started) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, started = excluded.started "
+                "WHERE inflight.started < ?",
+                (key, owner, now, now - lease)
+            )
+            self._conn.commit()
+        return owner if cursor.rowcount else None
+
+    def release(self, key: str, owner: str) -> None:
+        """Drop a claim taken with `claim`"""
+        with self._lock:
+            self._conn.execute("DELETE FROM inflight WHERE key = ? AND owner = ?", (key, owner))
+            self._conn.commit()
+
+    def set(self, key: str, response: str) -> None:
+        """Store a response and evict anything beyond the configured limits"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created, accessed, size) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, response, now, now, len(response.encode("utf-8")))
+            )
+            self._conn.commit()
+        self.evict()
+
+    def evict(self) -> None:
+        """Drop expired entries, then least recently used ones until within limits"""
+        with self._lock:
+            if self.max_age is not None:
+                self._conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.max_age,))
+            if self.max_entries is not None:
+                self._conn.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    "SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+            if self.max_bytes is not None:
+                total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+                if total > self.max_bytes:
+                    rows = self._conn.execute("SELECT key, size FROM responses ORDER BY accessed ASC").fetchall()
+                    stale = []
+                    for key, size in rows:
+                        if total <= self.max_bytes:
+                            break
+                        stale.append((key,))
+                        total -= size
+                    self._conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+            self._conn.commit()
+
+    def clear(self) -> None:
+        """Remove every cached response"""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.execute("DELETE FROM inflight")
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters for this process plus current store size"""
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class CachedLLM(LLMClient):
+    """
+    Opt-in caching wrapper around any LLMClient, for both sync and async calls.
+
+    A miss is claimed in the cache file before the wrapped client is called, so processes
+    sharing the file (text_evaluation.py and speech_analysis.py running at the same time)
+    wait for one another's in-flight requests instead of sending them twice. Within one
+    process, CoalescingLLM deduplicates without touching the file.
+    """
+
+    def __init__(self, llm: LLMClient, cache: LLMCache, wait_interval: float = 0.2, claim_lease: float = 600.0):
+        """
+        Wrap a client with a response cache
+
+        Args:
+            llm: Client that serves cache misses
+            cache: Response store shared by any number of wrappers
+            wait_interval: Seconds between checks while another process generates the same request
+            claim_lease: Seconds after which another process's claim is ignored, e.g. because it crashed
+        """
+        self.llm = llm
+        self.cache = cache
+        self.wait_interval = wait_interval
+        self.claim_lease = claim_lease
+
+    def __getattr__(self, name: str) -> Any:
+        # Expose model, params, system_message etc. of the wrapped client
+        return getattr(self.llm, name)
+
+    @property
+    def supports_response_schema(self) -> bool:
+        return self.llm.supports_response_schema
+
+    @property
+    def use_stop_sequences(self) -> bool:
+        return self.llm.use_stop_sequences
+
+    def _get_or_call(self, key: str, call: Callable[[], str]) -> str:
+        response = self.cache.get(key)
+        if response is not None:
+            return response
+        while True:
+            owner = self.cache.claim(key, self.claim_lease)
+            # Re-read after claiming: the previous owner may have just stored the response
+            response = self.cache.peek(key)
+            if response is not None or owner is not None:
+                break
+            # SQLite cannot notify other processes, so wait and look again
+            time.sleep(self.wait_interval)
+        if response is not None:
+            if owner is not None:
+                self.cache.release(key, owner)
+            return response
+        try:
+            response = call()
+            if response is not None:
+                self.cache.set(key, response)
+            return response
+        finally:
+            self.cache.release(key, owner)
+
+    async def _a_get_or_call(self, key: str, call: Callable[[], Awaitable[str]]) -> str:
+        response = self.cache.get(key)
+        if response is not None:
+            return response
+        while True:
+            owner = self.cache.claim(key, self.claim_lease)
+            response = self.cache.peek(key)
+            if response is not None or owner is not None:
+                break
+            await asyncio.sleep(self.wait_interval)
+        if response is not None:
+            if owner is not None:
+                self.cache.release(key, owner)
+            return response
+        try:
+            response = await call()
+            if response is not None:
+                self.cache.set(key, response)
+            return response
+        finally:
+            self.cache.release(key, owner)
+
+    def generate(self, prompt: str, **kwargs) -> str:
+        """Return a cached response or call the wrapped client"""
+        key = request_key(self.llm, prompt, **kwargs)
+        return self._get_or_call(key, lambda: self.llm.generate(prompt, **kwargs))
+
+    def generate_batch(self, prompts: List[str], **kwargs) -> List[str]:
+        """
+        Serve cached prompts and send only the misses to the wrapped client as one batch.
+        Batches are not coordinated with other processes.
+        """
+        keys = [request_key(self.llm, prompt, **kwargs) for prompt in prompts]
+        responses = [self.cache.get(key) for key in keys]
+        missing = [i for i, response in enumerate(responses) if response is None]
+        if missing:
+            generated = self.llm.generate_batch([prompts[i] for i in missing], **kwargs)
+            for i, response in zip(missing, generated):
+                responses[i] = response
+                if response is not None:
+                    self.cache.set(keys[i], response)
+        return responses
+
+    def score_choices(self, prompt: str, choices: List[str]) -> Dict[str, float]:
+        """Cached `LLMClient.score_choices`"""
+        key = request_key(self.llm, prompt, score_choices=choices)
+        return json.loads(self._get_or_call(key, lambda: json.dumps(self.llm.score_choices(prompt, choices))))
+
+    async def a_score_choices(self, prompt: str, choices: List[str]) -> Dict[str, float]:
+        """Cached `LLMClient.a_score_choices`"""
+        key = request_key(self.llm, prompt, score_choices=choices)
+
+        async def call():
+            return json.dumps(await self.llm.a_score_choices(prompt, choices))
+
+        return json.loads(await self._a_get_or_call(key, call))
+
+    async def a_generate(self, prompt: str, **kwargs) -> str:
+        """Async variant of `generate`"""
+        key = request_key(self.llm, prompt, **kwargs)
+        return await self._a_get_or_call(key, lambda: self.llm.a_generate(prompt, **kwargs))
+
+
+class CoalescingLLM(LLMClient):
+    """
+    Single-flight wrapper: concurrent identical requests (same client signature, prompt and
+    kwargs) share one upstream call and its result or exception. Wrap it around CachedLLM,
+    not inside it, so cache keys keep the real backend's signature.
+
+    Coalescing here is in-process only (a thread Future or an asyncio task); duplicates
+    from other processes are coalesced by CachedLLM through a shared cache file.
+    """
+
+    def __init__(self, llm: LLMClient):
+        """
+        Args:
+            llm: Client that serves the deduplicated requests
+        """
+        self.llm = llm
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        # asyncio tasks are bound to their event loop, so key them by loop as well
+        self._a_inflight: Dict[tuple, asyncio.Task] = {}
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.llm, name)
+
+    @property
+    def supports_response_schema(self) -> bool:
+        return self.llm.supports_response_schema
+
+    @property
+    def use_stop_sequences(self) -> bool:
+        return self.llm.use_stop_sequences
+
+    def _single_flight(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    async def _a_single_flight(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task_key = (id(asyncio.get_running_loop()), key)
+        task = self._a_inflight.get(task_key)
+        if task is None:
+            task = self._a_inflight[task_key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda _: self._a_inflight.pop(task_key, None))
+        else:
+            self.coalesced += 1
+        # Shielded so one cancelled caller does not cancel the request for the others
+        return await asyncio.shield(task)
+
+    def generate(self, prompt: str, **kwargs) -> str:
+        key = request_key(self.llm, prompt, **kwargs)
+        return self._single_flight(key, lambda: self.llm.generate(prompt, **kwargs))
+
+    async def a_generate(self, prompt: str, **kwargs) -> str:
+        key = request_key(self.llm, prompt, **kwargs)
+        return await self._a_single_flight(key, lambda: self.llm.a_generate(prompt, **kwargs))
+
+    def generate_batch(self, prompts: List[str], **kwargs) -> List[str]:
+        """Send each distinct prompt once and fan the responses back out in input order"""
+        unique = list(dict.fromkeys(prompts))
+        with self._lock:
+            self.coalesced += len(prompts) - len(unique)
+        responses = dict(zip(unique, self.llm.generate_batch(unique, **kwargs)))
+        return [responses[prompt] for prompt in prompts]
+
+    def score_choices(self, prompt: str, choices: List[str]) -> Dict[str, float]:
+        key = request_key(self.llm, prompt, score_choices=choices)
+        return self._single_flight(key, lambda: self.llm.score_choices(prompt, choices))
+
+    async def a_score_choices(self, prompt: str, choices: List[str]) -> Dict[str, float]:
+        key = request_key(self.llm, prompt, score_choices=choices)
+        return await self._a_single_flight(key, lambda: self.llm.a_score_choices(prompt, choices))
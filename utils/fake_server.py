@@ -0,0 +1,576 @@
+"""
+Local OpenAI-compatible stand-in server for offline load and regression testing.
+
+Serves /v1/chat/completions (JSON or SSE streaming, optional logprobs), /v1/models and
+an OpenAI-style Batch API (/v1/files, /v1/batches) with configurable latency, 5xx and 429 injection and a capacity limit. Replies are
+valid JSON for whichever EvaluationType the prompt was built from, so evaluators
+parse them normally; identical prompts always get identical replies.
+
+Point the clients at it with:
+    OpenAIClientLLM(base_url=server.base_url)
+    LocalDeepSeekR1(base_url=server.base_url)
+    HTTPLLM(base_url=server.base_url + "/chat/completions")
+
+Usage:
+    python -m utils.fake_server --port 8000 --latency lognormal:-1.5,0.5 --rate_limit_rate 0.05
+"""
+from __future__ import annotations
+import argparse
+import hashlib
+import json
+import logging
+import math
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from evaluator.prompt_manager import EvaluationType, CEFR_LEVELS, LEVEL_ONLY_FORMATTER
+
+logger = logging.getLogger(__name__)
+
+LEVEL_DIGITS = [str(i) for i in range(1, len(CEFR_LEVELS) + 1)]
+
+FALLBACK_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "cefr_level": {"type": "string", "enum": CEFR_LEVELS},
+        "reasoning": {"type": "string"},
+    },
+}
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """
+    Build a latency sampler from a spec string
+
+    Args:
+        spec: "fixed:S", "uniform:LOW,HIGH", "exponential:MEAN" or "lognormal:MU,SIGMA" (seconds)
+
+    Returns:
+        Function drawing one latency in seconds from the given RNG
+    """
+    kind, _, args = spec.partition(":")
+    values = [float(value) for value in args.split(",") if value]
+    if kind == "fixed":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "exponential":
+        return lambda rng: rng.expovariate(1.0 / values[0])
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(values[0], values[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def sample_from_schema(schema: Dict[str, Any], rng: random.Random) -> Any:
+    """Build a value that validates against a (strict-mode style) JSON schema"""
+    if "enum" in schema:
+        return rng.choice(schema["enum"])
+    kind = schema.get("type")
+    if isinstance(kind, list):
+        kind = next((k for k in kind if k != "null"), "null")
+    if kind == "object":
+        return {name: sample_from_schema(prop, rng) for name, prop in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [sample_from_schema(schema.get("items", {}), rng) for _ in range(rng.randint(1, 2))]
+    if kind == "number":
+        return round(rng.uniform(0, 1), 2)
+    if kind == "integer":
+        return rng.randint(1, 100)
+    if kind == "boolean":
+        return rng.random() < 0.5
+    if kind == "null":
+        return None
+    return f"stub text {rng.randint(0, 9999)}"
+
+
+def detect_eval_type(prompt: str) -> Optional[EvaluationType]:
+    """EvaluationType whose static template prefix the prompt starts with"""
+    for eval_type in EvaluationType:
+        template = eval_type.template
+        prefix = template[:template.index("{")] if "{" in template else template
+        if prefix and prompt.startswith(prefix):
+            return eval_type
+    return None
+
+
+def approx_tokens(text: str) -> int:
+    # Same 4 characters per token rule as utils.rate_limit.estimate_tokens
+    return max(1, len(text) // 4)
+
+
+class FakeLLMServer:
+    """Threaded OpenAI-compatible fake; use as a context manager or call start()/stop()"""
+
+    def __init__(self,
+                 host: str = "127.0.0.1",
+                 port: int = 0,
+                 model: str = "fake-model",
+                 latency: str = "fixed:0",
+                 token_latency: float = 0.0,
+                 error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0,
+                 retry_after: float = 0.1,
+                 max_concurrency: int = 0,
+                 thinking_words: int = 20,
+                 trailing_words: int = 0,
+                 batch_seconds_per_request: float = 0.0,
+                 seed: int = 0):
+        """
+        Args:
+            host: Interface to bind
+            port: Port to bind, 0 picks a free one
+            model: Model id reported by /v1/models and in completions
+            latency: Time-to-first-token distribution, see `parse_latency`
+            token_latency: Extra seconds per completion token (decode time)
+            error_rate: Fraction of requests answered with a 500
+            rate_limit_rate: Fraction of requests answered with a 429 and Retry-After
+            retry_after: Seconds sent in the Retry-After header
+            max_concurrency: Answer 429 when more requests than this are in flight (0 = unlimited)
+            thinking_words: Length of the <think> section sent to DeepSeek-R1 style prompts
+            trailing_words: If > 0, fence JSON answers in ```json and follow them with this many
+                words of commentary, as chatty models do
+            batch_seconds_per_request: Processing time per line of a batch job
+            seed: Seed for latency and fault injection
+        """
+        self.model = model
+        self.sample_latency = parse_latency(latency)
+        self.token_latency = token_latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.max_concurrency = max_concurrency
+        self.thinking_words = thinking_words
+        self.trailing_words = trailing_words
+        self.batch_seconds_per_request = batch_seconds_per_request
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.batches: Dict[str, Dict[str, Any]] = {}
+        self.rng = random.Random(seed)
+        self.counters = Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self.routes: Dict[Tuple[str, str], Callable] = {
+            ("GET", "/v1/models"): self.handle_models,
+            ("GET", "/health"): self.handle_health,
+            ("POST", "/v1/chat/completions"): self.handle_chat_completion,
+            ("POST", "/v1/files"): self.handle_file_upload,
+            ("GET", "/v1/files/"): self.handle_file_get,
+            ("POST", "/v1/batches"): self.handle_batch_create,
+            ("GET", "/v1/batches/"): self.handle_batch_get,
+            ("POST", "/v1/batches/"): self.handle_batch_cancel,
+        }
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> FakeLLMServer:
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> FakeLLMServer:
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+    def stats(self) -> Dict[str, Any]:
+        """Request and status counters plus the peak number of concurrent requests"""
+        with self._lock:
+            return {**self.counters, "max_in_flight": self.max_in_flight}
+
+    def _draw(self) -> Tuple[float, float]:
+        """(latency, fault roll) from the shared seeded RNG"""
+        with self._lock:
+            return self.sample_latency(self.rng), self.rng.random()
+
+    def _handler_class(self) -> type:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # HTTP/1.1 keep-alive so client connection pooling can be measured
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+            def handle(self):
+                try:
+                    super().handle()
+                except ConnectionError:
+                    # Clients drop keep-alive connections after cancelling a stream
+                    pass
+
+            def _dispatch(self, method: str) -> None:
+                path = self.path.split("?")[0].rstrip("/")
+                route = server.routes.get((method, path))
+                if route is None:
+                    # Match prefixes such as /v1/batches/<id> registered as ("GET", "/v1/batches/")
+                    route = next((handler for (m, prefix), handler in server.routes.items()
+                                  if m == method and prefix.endswith("/") and path.startswith(prefix)), None)
+                if route is None:
+                    # Drain the body so the keep-alive connection stays usable
+                    self.read_body()
+                    self.send_json(404, {"error": {"message": f"No route for {method} {path}"}})
+                    return
+                route(self)
+
+            def do_GET(self):
+                self._dispatch("GET")
+
+            def do_POST(self):
+                self._dispatch("POST")
+
+            def read_body(self) -> bytes:
+                return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+            def send_json(self, status: int, payload: Any, headers: Dict[str, str] = None) -> None:
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def write_chunk(self, data: bytes) -> None:
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+        return Handler
+
+    def handle_models(self, handler: BaseHTTPRequestHandler) -> None:
+        handler.send_json(200, {"object": "list", "data": [{"id": self.model, "object": "model", "owned_by": "fake"}]})
+
+    def handle_health(self, handler: BaseHTTPRequestHandler) -> None:
+        handler.send_json(200, {"status": "ok"})
+
+    def handle_chat_completion(self, handler: BaseHTTPRequestHandler) -> None:
+        body = json.loads(handler.read_body() or b"{}")
+        with self._lock:
+            self.counters["requests"] += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            over_capacity = self.max_concurrency and self.in_flight > self.max_concurrency
+        try:
+            latency, roll = self._draw()
+            if over_capacity or roll < self.rate_limit_rate:
+                self._count(429)
+                handler.send_json(
+                    429,
+                    {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+                    headers={"Retry-After": str(self.retry_after)}
+                )
+                return
+            if roll < self.rate_limit_rate + self.error_rate:
+                time.sleep(latency)
+                self._count(500)
+                handler.send_json(500, {"error": {"message": "Injected server error", "type": "server_error"}})
+                return
+
+            completion = self.completion(body)
+            if body.get("stream"):
+                self._stream(handler, body, completion, latency)
+            else:
+                time.sleep(latency + self.token_latency * completion["usage"]["completion_tokens"])
+                self._count(200)
+                handler.send_json(200, completion)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def _store_file(self, content: bytes, filename: str, purpose: str) -> Dict[str, Any]:
+        file_object = {
+            "id": f"file-{uuid.uuid4().hex[:24]}",
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+        }
+        with self._lock:
+            self.files[file_object["id"]] = {**file_object, "content": content}
+        return file_object
+
+    def handle_file_upload(self, handler: BaseHTTPRequestHandler) -> None:
+        """Multipart upload as sent by `client.files.create`"""
+        body = handler.read_body()
+        header = f"Content-Type: {handler.headers['Content-Type']}\r\n\r\n".encode("latin-1")
+        message = BytesParser().parsebytes(header + body)
+        fields = {part.get_param("name", header="content-disposition"): part for part in message.get_payload()}
+        upload = fields["file"]
+        purpose = fields["purpose"].get_payload(decode=True).decode("utf-8") if "purpose" in fields else "batch"
+        handler.send_json(200, self._store_file(upload.get_payload(decode=True), upload.get_filename(), purpose))
+
+    def handle_file_get(self, handler: BaseHTTPRequestHandler) -> None:
+        """GET /v1/files/<id> metadata or /v1/files/<id>/content bytes"""
+        parts = handler.path.split("?")[0].strip("/").split("/")
+        stored = self.files.get(parts[2])
+        if stored is None:
+            handler.send_json(404, {"error": {"message": f"No such file: {parts[2]}"}})
+            return
+        if parts[-1] != "content":
+            handler.send_json(200, {key: value for key, value in stored.items() if key != "content"})
+            return
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/octet-stream")
+        handler.send_header("Content-Length", str(len(stored["content"])))
+        handler.end_headers()
+        handler.wfile.write(stored["content"])
+
+    def handle_batch_create(self, handler: BaseHTTPRequestHandler) -> None:
+        body = json.loads(handler.read_body() or b"{}")
+        input_file = self.files.get(body.get("input_file_id"))
+        if input_file is None:
+            handler.send_json(400, {"error": {"message": "input_file_id not found"}})
+            return
+        lines = [json.loads(line) for line in input_file["content"].decode("utf-8").splitlines() if line.strip()]
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex[:24]}",
+            "object": "batch",
+            "endpoint": body.get("endpoint"),
+            "input_file_id": input_file["id"],
+            "completion_window": body.get("completion_window", "24h"),
+            "status": "validating",
+            "output_file_id": None,
+            "error_file_id": None,
+            "created_at": int(time.time()),
+            "request_counts": {"total": len(lines), "completed": 0, "failed": 0},
+            "errors": None,
+        }
+        with self._lock:
+            self.batches[batch["id"]] = batch
+        threading.Thread(target=self._run_batch, args=(batch, lines), daemon=True).start()
+        handler.send_json(200, batch)
+
+    def handle_batch_get(self, handler: BaseHTTPRequestHandler) -> None:
+        batch_id = handler.path.split("?")[0].strip("/").split("/")[2]
+        batch = self.batches.get(batch_id)
+        if batch is None:
+            handler.send_json(404, {"error": {"message": f"No such batch: {batch_id}"}})
+            return
+        with self._lock:
+            handler.send_json(200, batch)
+
+    def handle_batch_cancel(self, handler: BaseHTTPRequestHandler) -> None:
+        """POST /v1/batches/<id>/cancel"""
+        handler.read_body()
+        batch = self.batches.get(handler.path.split("?")[0].strip("/").split("/")[2])
+        if batch is None:
+            handler.send_json(404, {"error": {"message": "No such batch"}})
+            return
+        with self._lock:
+            if batch["status"] not in ("completed", "failed", "expired", "cancelled"):
+                batch["status"] = "cancelling"
+        handler.send_json(200, batch)
+
+    def _run_batch(self, batch: Dict[str, Any], lines: list) -> None:
+        """Answer every request line, honouring error injection, then publish the output files"""
+        with self._lock:
+            batch["status"] = "in_progress"
+        outputs, errors = [], []
+        for line in lines:
+            if batch["status"] == "cancelling":
+                break
+            time.sleep(self.batch_seconds_per_request)
+            _, roll = self._draw()
+            record = {"id": f"batch_req_{uuid.uuid4().hex[:24]}", "custom_id": line["custom_id"]}
+            if roll < self.error_rate:
+                errors.append({**record, "response": {"status_code": 500, "body": {
+                    "error": {"message": "Injected server error", "type": "server_error"}}}, "error": None})
+                key = "failed"
+            else:
+                outputs.append({**record, "response": {"status_code": 200, "body": self.completion(line["body"])},
+                                "error": None})
+                key = "completed"
+            with self._lock:
+                batch["request_counts"][key] += 1
+
+        def publish(records: list, name: str) -> Optional[str]:
+            if not records:
+                return None
+            content = "\n".join(json.dumps(record) for record in records).encode("utf-8")
+            return self._store_file(content, name, "batch_output")["id"]
+
+        output_file_id = publish(outputs, "batch_output.jsonl")
+        error_file_id = publish(errors, "batch_errors.jsonl")
+        with self._lock:
+            batch["output_file_id"] = output_file_id
+            batch["error_file_id"] = error_file_id
+            batch["status"] = "cancelled" if batch["status"] == "cancelling" else "completed"
+            batch[f"{batch['status']}_at"] = int(time.time())
+
+    def _count(self, status: int) -> None:
+        with self._lock:
+            self.counters[f"status_{status}"] += 1
+
+    def completion(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """Build a deterministic chat.completion for a request body"""
+        messages = body.get("messages") or []
+        prompt = messages[-1]["content"] if messages else ""
+        if isinstance(prompt, list):
+            prompt = " ".join(part.get("text", "") for part in prompt if isinstance(part, dict))
+        rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).hexdigest())
+
+        logprobs = None
+        if body.get("logprobs"):
+            content, logprobs = self._level_logprobs(rng, body.get("top_logprobs") or 0)
+        elif LEVEL_ONLY_FORMATTER in prompt:
+            content = rng.choice(LEVEL_DIGITS)
+        else:
+            content = json.dumps(sample_from_schema(self._schema(body, prompt), rng))
+            if self.trailing_words:
+                commentary = " ".join(f"note{i}" for i in range(self.trailing_words))
+                content = f"```json\n{content}\n```\n\n{commentary}"
+
+        # LocalDeepSeekR1 primes the answer with "<think>" and expects the trace to be closed
+        if prompt.rstrip(" ").endswith("<think>\n"):
+            thinking = " ".join(f"step{i}" for i in range(self.thinking_words))
+            content = f"{thinking}\n</think>\n\n{content}"
+
+        finish_reason = "stop"
+        stop = body.get("stop") or []
+        for sequence in [stop] if isinstance(stop, str) else stop:
+            # Like the OpenAI API, the matched stop sequence is not returned
+            if sequence in content:
+                content = content[:content.index(sequence)]
+        max_tokens = body.get("max_tokens") or body.get("max_completion_tokens")
+        if max_tokens and approx_tokens(content) > max_tokens:
+            content = content[:max_tokens * 4]
+            finish_reason = "length"
+
+        prompt_tokens = sum(approx_tokens(str(message.get("content", ""))) for message in messages)
+        choice = {
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "logprobs": logprobs,
+            "finish_reason": finish_reason,
+        }
+        return {
+            "id": f"chatcmpl-{hashlib.md5(prompt.encode('utf-8')).hexdigest()[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model") or self.model,
+            "choices": [choice],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": approx_tokens(content),
+                "total_tokens": prompt_tokens + approx_tokens(content),
+            },
+        }
+
+    def _schema(self, body: Dict[str, Any], prompt: str) -> Dict[str, Any]:
+        response_format = body.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            return response_format["json_schema"]["schema"]
+        eval_type = detect_eval_type(prompt)
+        if eval_type is not None and eval_type.schema is not None:
+            return eval_type.schema
+        return FALLBACK_SCHEMA
+
+    def _level_logprobs(self, rng: random.Random, top_logprobs: int) -> Tuple[str, Dict[str, Any]]:
+        """One-digit answer with a peaked distribution over LEVEL_DIGITS"""
+        scores = [rng.gauss(0, 2) for _ in LEVEL_DIGITS]
+        norm = math.log(sum(math.exp(score) for score in scores))
+        candidates = sorted(
+            ({"token": digit, "logprob": score - norm, "bytes": list(digit.encode())}
+             for digit, score in zip(LEVEL_DIGITS, scores)),
+            key=lambda candidate: candidate["logprob"],
+            reverse=True
+        )
+        best = candidates[0]
+        return best["token"], {"content": [{**best, "top_logprobs": candidates[:top_logprobs]}]}
+
+    def _stream(self, handler: BaseHTTPRequestHandler, body: Dict[str, Any],
+                completion: Dict[str, Any], latency: float) -> None:
+        """Send the completion as server-sent events, a few characters per chunk"""
+        content = completion["choices"][0]["message"]["content"]
+        base = {"id": completion["id"], "object": "chat.completion.chunk",
+                "created": completion["created"], "model": completion["model"]}
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Transfer-Encoding", "chunked")
+        handler.end_headers()
+        time.sleep(latency)
+        try:
+            pieces = [content[i:i + 16] for i in range(0, len(content), 16)] or [""]
+            for i, piece in enumerate(pieces):
+                delta = {"content": piece}
+                if i == 0:
+                    delta["role"] = "assistant"
+                chunk = {**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+                handler.write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                time.sleep(self.token_latency * approx_tokens(piece))
+            final = {**base, "choices": [{"index": 0, "delta": {},
+                                          "finish_reason": completion["choices"][0]["finish_reason"]}]}
+            handler.write_chunk(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+            if (body.get("stream_options") or {}).get("include_usage"):
+                usage = {**base, "choices": [], "usage": completion["usage"]}
+                handler.write_chunk(f"data: {json.dumps(usage)}\n\n".encode("utf-8"))
+            handler.write_chunk(b"data: [DONE]\n\n")
+            handler.write_chunk(b"")
+            self._count(200)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading, e.g. after an early stop
+            with self._lock:
+                self.counters["streams_cancelled"] += 1
+            handler.close_connection = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local OpenAI-compatible fake LLM server')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Interface to bind')
+    parser.add_argument('--port', type=int, default=8000, help='Port to bind')
+    parser.add_argument('--model', type=str, default='fake-model', help='Model id to report')
+    parser.add_argument('--latency', type=str, default='lognormal:-1.5,0.5', help='fixed:S, uniform:A,B, exponential:MEAN or lognormal:MU,SIGMA')
+    parser.add_argument('--token_latency', type=float, default=0.0, help='Extra seconds per completion token')
+    parser.add_argument('--error_rate', type=float, default=0.0, help='Fraction of requests failing with 500')
+    parser.add_argument('--rate_limit_rate', type=float, default=0.0, help='Fraction of requests failing with 429')
+    parser.add_argument('--max_concurrency', type=int, default=0, help='Reject requests beyond this many in flight with 429 (0 = unlimited)')
+    parser.add_argument('--trailing_words', type=int, default=0, help='Words of commentary after each fenced JSON answer')
+    parser.add_argument('--batch_seconds_per_request', type=float, default=0.0, help='Batch job processing time per request')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for latency and fault injection')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = FakeLLMServer(
+        host=args.host,
+        port=args.port,
+        model=args.model,
+        latency=args.latency,
+        token_latency=args.token_latency,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        max_concurrency=args.max_concurrency,
+        trailing_words=args.trailing_words,
+        batch_seconds_per_request=args.batch_seconds_per_request,
+        seed=args.seed
+    )
+    logger.info(f"Fake LLM server listening on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.info(f"Server stats: {server.stats()}")
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
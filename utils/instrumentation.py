@@ -0,0 +1,254 @@
+from __future__ import annotations
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Name of the evaluator on whose behalf LLM calls are made, set by ConversationEvaluator
+current_evaluator: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_evaluator", default=None)
+
+# Record of the call in progress, so the scheduler can count its retries
+_current_call: contextvars.ContextVar[Optional["CallRecord"]] = contextvars.ContextVar("current_call", default=None)
+
+
+@dataclass
+class CallRecord:
+    """Measurements for one LLMClient call"""
+    backend: str
+    model: Optional[str]
+    method: str
+    evaluator: Optional[str] = None
+    started: float = field(default_factory=time.time)
+    wall_time: Optional[float] = None
+    time_to_first_token: Optional[float] = None
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    requests: int = 1
+    retries: int = 0
+    cost: Optional[float] = None
+    error: Optional[str] = None
+    _start: float = field(default_factory=time.perf_counter, repr=False)
+
+    def first_token(self) -> None:
+        """Mark the arrival of the first streamed token"""
+        if self.time_to_first_token is None:
+            self.time_to_first_token = time.perf_counter() - self._start
+
+    def add_usage(self, prompt_tokens: Optional[int], completion_tokens: Optional[int]) -> None:
+        """Accumulate token counts, e.g. once per prompt of a batch"""
+        if prompt_tokens is not None:
+            self.prompt_tokens = (self.prompt_tokens or 0) + prompt_tokens
+        if completion_tokens is not None:
+            self.completion_tokens = (self.completion_tokens or 0) + completion_tokens
+
+    def to_dict(self) -> Dict[str, Any]:
+        record = asdict(self)
+        record.pop("_start")
+        return record
+
+
+def usage_tokens(usage: Any) -> Tuple[Optional[int], Optional[int]]:
+    """(prompt_tokens, completion_tokens) from an OpenAI `usage` object or its JSON dict"""
+    if usage is None:
+        return None, None
+    if isinstance(usage, dict):
+        return usage.get("prompt_tokens"), usage.get("completion_tokens")
+    return getattr(usage, "prompt_tokens", None), getattr(usage, "completion_tokens", None)
+
+
+class Instrumentation:
+    """Thread-safe collector of CallRecords with JSONL, Prometheus text and summary exports"""
+
+    def __init__(self,
+                 jsonl_path: Optional[str] = None,
+                 prices: Optional[Dict[str, Tuple[float, float]]] = None):
+        """
+        Args:
+            jsonl_path: Append every finished call to this file as one JSON line
+            prices: USD per million (prompt, completion) tokens keyed by model id, used to fill in `cost`
+        """
+        self.jsonl_path = jsonl_path
+        self.prices = prices or {}
+        self.records: List[CallRecord] = []
+        self._lock = threading.Lock()
+
+    def cost(self, record: CallRecord) -> Optional[float]:
+        price = self.prices.get(record.model)
+        if price is None or record.prompt_tokens is None:
+            return None
+        prompt_price, completion_price = price
+        return (record.prompt_tokens * prompt_price + (record.completion_tokens or 0) * completion_price) / 1e6
+
+    def add(self, record: CallRecord) -> None:
+        record.cost = self.cost(record)
+        with self._lock:
+            self.records.append(record)
+            if self.jsonl_path:
+                with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record.to_dict()) + "\n")
+
+    def report(self) -> List[Dict[str, Any]]:
+        """
+        Aggregate recorded calls per (evaluator, backend, model)
+
+        Returns:
+            One row per group with call, error, retry and token counts, total and
+            p50/p95 wall time, mean time-to-first-token, cost and share of total wall time
+        """
+        with self._lock:
+            records = list(self.records)
+        groups: Dict[Tuple, List[CallRecord]] = {}
+        for record in records:
+            groups.setdefault((record.evaluator, record.backend, record.model), []).append(record)
+
+        total_wall = sum(record.wall_time or 0.0 for record in records) or 1.0
+        rows = []
+        for (evaluator, backend, model), group in groups.items():
+            wall_times = sorted(record.wall_time or 0.0 for record in group)
+            ttfts = [record.time_to_first_token for record in group if record.time_to_first_token is not None]
+            costs = [record.cost for record in group if record.cost is not None]
+            rows.append({
+                "evaluator": evaluator,
+                "backend": backend,
+                "model": model,
+                "calls": len(group),
+                "requests": sum(record.requests for record in group),
+                "errors": sum(1 for record in group if record.error),
+                "retries": sum(record.retries for record in group),
+                "wall_time": sum(wall_times),
+                "wall_time_share": sum(wall_times) / total_wall,
+                "p50_wall_time": wall_times[len(wall_times) // 2],
+                "p95_wall_time": wall_times[min(len(wall_times) - 1, int(len(wall_times) * 0.95))],
+                "mean_time_to_first_token": sum(ttfts) / len(ttfts) if ttfts else None,
+                "prompt_tokens": sum(record.prompt_tokens or 0 for record in group),
+                "completion_tokens": sum(record.completion_tokens or 0 for record in group),
+                "cost": sum(costs) if costs else None,
+            })
+        return sorted(rows, key=lambda row: row["wall_time"], reverse=True)
+
+    def format_report(self) -> str:
+        """Human-readable per-run summary, slowest group first"""
+        lines = [f"{'evaluator':<24} {'backend':<16} {'calls':>6} {'errors':>6} {'retries':>7} "
+                 f"{'wall s':>9} {'share':>6} {'p95 s':>7} {'prompt tok':>11} {'compl tok':>10} {'cost $':>8}"]
+        for row in self.report():
+            cost = f"{row['cost']:.4f}" if row["cost"] is not None else "-"
+            lines.append(
+                f"{str(row['evaluator']):<24} {row['backend']:<16} {row['calls']:>6} {row['errors']:>6} "
+                f"{row['retries']:>7} {row['wall_time']:>9.2f} {row['wall_time_share']:>6.1%} "
+                f"{row['p95_wall_time']:>7.2f} {row['prompt_tokens']:>11} {row['completion_tokens']:>10} {cost:>8}"
+            )
+        return "\n".join(lines)
+
+    def write_prometheus(self, path: str) -> None:
+        """Write the aggregated report as Prometheus text exposition format (e.g. for node_exporter's textfile collector)"""
+        metrics = [
+            ("llm_calls_total", "counter", "LLMClient calls", "calls"),
+            ("llm_requests_total", "counter", "Prompts sent, counting every prompt of a batch", "requests"),
+            ("llm_errors_total", "counter", "LLMClient calls that raised", "errors"),
+            ("llm_retries_total", "counter", "Retries performed by the scheduler", "retries"),
+            ("llm_call_seconds_total", "counter", "Wall time spent in LLMClient calls", "wall_time"),
+            ("llm_call_seconds_p95", "gauge", "95th percentile call wall time", "p95_wall_time"),
+            ("llm_prompt_tokens_total", "counter", "Prompt tokens reported by the backend", "prompt_tokens"),
+            ("llm_completion_tokens_total", "counter", "Completion tokens reported by the backend", "completion_tokens"),
+            ("llm_cost_usd_total", "counter", "Estimated spend", "cost"),
+        ]
+        rows = self.report()
+        lines = []
+        for name, kind, help_text, key in metrics:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for row in rows:
+                if row[key] is None:
+                    continue
+                labels = ",".join(
+                    f'{label}="{str(row[label] or "").replace(chr(34), chr(39))}"'
+                    for label in ("evaluator", "backend", "model")
+                )
+                lines.append(f"{name}{{{labels}}} {row[key]}")
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def reset(self) -> None:
+        with self._lock:
+            self.records.clear()
+
+
+_default_instrumentation = None
+_default_lock = threading.Lock()
+
+
+def get_instrumentation() -> Instrumentation:
+    """
+    Process-wide collector used by all LLM clients; LLM_METRICS_JSONL, if set,
+    names a file every call is appended to
+    """
+    global _default_instrumentation
+    with _default_lock:
+        if _default_instrumentation is None:
+            _default_instrumentation = Instrumentation(jsonl_path=os.getenv("LLM_METRICS_JSONL") or None)
+        return _default_instrumentation
+
+
+def set_instrumentation(instrumentation: Instrumentation) -> None:
+    """Replace the process-wide collector, e.g. to configure prices or an output file"""
+    global _default_instrumentation
+    with _default_lock:
+        _default_instrumentation = instrumentation
+
+
+@contextmanager
+def track_call(llm: Any, method: str, requests: int = 1) -> Iterator[CallRecord]:
+    """
+    Measure one LLMClient call and hand the record to the process-wide collector
+
+    Args:
+        llm: Client making the call
+        method: Client method name, e.g. "generate" or "score_choices"
+        requests: Number of prompts served by the call
+
+    Yields:
+        The CallRecord, for the client to add usage and time-to-first-token
+    """
+    record = CallRecord(
+        backend=type(llm).__name__,
+        model=getattr(llm, "model", None) or getattr(llm, "model_path", None),
+        method=method,
+        evaluator=current_evaluator.get(),
+        requests=requests,
+    )
+    token = _current_call.set(record)
+    try:
+        yield record
+    except BaseException as e:
+        record.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_call.reset(token)
+        record.wall_time = time.perf_counter() - record._start
+        get_instrumentation().add(record)
+
+
+def note_retry() -> None:
+    """Count a retry against the call in progress, if it is being tracked"""
+    record = _current_call.get()
+    if record is not None:
+        record.retries += 1
+
+
+@contextmanager
+def evaluator_scope(name: str) -> Iterator[None]:
+    """Attribute LLM calls made inside the block to evaluator `name`"""
+    token = current_evaluator.set(name)
+    try:
+        yield
+    finally:
+        current_evaluator.reset(token)
@@ -1,35 +1,60 @@
 from __future__ import annotations
 from abc import ABC, abstractmethod
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, Dict, List
+import atexit
+import math
 import os
 
-import aiohttp
+import asyncio
 from openai import OpenAI, AsyncOpenAI
-import requests
 import json
-from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline, GenerationConfig
-from huggingface_hub import login
-import torch
-import time
+import threading
 import logging
 import openai
 from openai.types import CreateEmbeddingResponse
 from openai.types.chat import ChatCompletion
-import re
 from dotenv import load_dotenv
 
+from utils.rate_limit import LLMScheduler, get_default_scheduler, estimate_tokens
+from utils.instrumentation import track_call, usage_tokens
+from utils.streaming import ReasoningStream, chunk_deltas, iter_sse_data
+
+if TYPE_CHECKING:
+    import aiohttp
+
 logger = logging.getLogger(__name__)
 load_dotenv()
 
-try:
-    from vllm import LLM, SamplingParams
-except ImportError:
-    logger.info("vllm is not installed, Please install vllm to use fast inference feature.")
-
 client = None
 
+# Asked of a reasoning model whose trace was cut off at its thinking budget
+FORCE_ANSWER_PROMPT = (
+    "Your thinking budget is used up. Stop reasoning and give your final answer now, "
+    "exactly in the format requested above."
+)
+# Thinking allowed while answering FORCE_ANSWER_PROMPT, for models that always open a trace
+FORCED_ANSWER_THINKING_BUDGET = 256
+
+# Local-model clients pull in torch, transformers and vLLM, so they live in
+# utils.local_llm and are only imported when first accessed from here
+_LAZY_CLIENTS = {"HFClientVLLM", "HFClient", "HFClientCPU"}
+
+
+def __getattr__(name: str):
+    if name in _LAZY_CLIENTS:
+        from utils import local_llm
+        return getattr(local_llm, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 class LLMClient(ABC):
     """Base class for LLM clients with standardized invocation interface"""
 
+    # Clients that can enforce a JSON schema accept `response_schema=` in generate/a_generate/generate_batch
+    supports_response_schema = False
+    # Set on clients that accept `stop=` there and should be sent each evaluator's stop sequences
+    use_stop_sequences = False
+
     @abstractmethod
     def generate(self, prompt: str) -> str:
         """
@@ -56,14 +81,109 @@ class LLMClient(ABC):
         """
         pass
 
+    def generate_batch(self, prompts: List[str], **kwargs) -> List[str]:
+        """
+        Execute LLM calls for several prompts, returning responses in input order.
+        Backends with native batching (e.g. vLLM) override this.
+
+        Args:
+            prompts: Input prompts
+            kwargs: Per-call arguments forwarded to `generate` (e.g. response_schema)
+
+        Returns:
+            Generated text responses, one per prompt
+        """
+        return [self.generate(prompt, **kwargs) for prompt in prompts]
+
+    def score_choices(self, prompt: str, choices: List[str]) -> Dict[str, float]:
+        """
+        Probability of each single-token answer in `choices` as the first generated token,
+        read from the backend's logprobs. Backends without logprob access raise
+        NotImplementedError so callers can fall back to parsing generated text.
+
+        Args:
+            prompt: Input prompt asking for one of `choices`
+            choices: Candidate answers, each expected to be a single token
+
+        Returns:
+            Mapping of choice to probability, normalised over `choices`
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not expose token logprobs")
+
+    async def a_score_choices(self, prompt: str, choices: List[str]) -> Dict[str, float]:
+        """Async variant of `score_choices`"""
+        return self.score_choices(prompt, choices)
+
+
+def normalize_choice_logprobs(top_logprobs: List[tuple], choices: List[str]) -> Dict[str, float]:
+    """
+    Turn (token, logprob) candidates for one position into a distribution over `choices`.
+    Tokenizer variants of the same answer (e.g. " 3" and "3") are summed.
+    """
+    mass = {choice: 0.0 for choice in choices}
+    for token, logprob in top_logprobs:
+        token = (token or "").strip()
+        if token in mass:
+            mass[token] += math.exp(logprob)
+    total = sum(mass.values())
+    if total == 0:
+        raise ValueError("none of the choices appear among the top logprobs")
+    return {choice: p / total for choice, p in mass.items()}
+
+
+def json_schema_response_format(response_schema: Dict) -> Dict:
+    """OpenAI-compatible `response_format` enforcing `response_schema`"""
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": "evaluation", "schema": response_schema, "strict": True},
+    }
+
+
+class AsyncOpenAIPerLoop:
+    """
+    Builds an AsyncOpenAI client per event loop. Its connection pool is bound to the loop
+    it first ran on, so a client shared through `get_client` would fail with "Event loop
+    is closed" in a later `asyncio.run`.
+    """
+
+    def __init__(self, **kwargs):
+        """
+        Args:
+            kwargs: AsyncOpenAI constructor arguments
+        """
+        self.kwargs = kwargs
+        self._client = None
+        self._loop = None
+
+    def get(self) -> AsyncOpenAI:
+        """Return the client for the running event loop, creating it on first use in that loop"""
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = AsyncOpenAI(**self.kwargs)
+            self._loop = loop
+        return self._client
+
 
 class OpenAIClientLLM(LLMClient):
-    """Concrete implementation using OpenAI-compatible client"""
+    """Concrete implementation using OpenAI-compatible client
+
+    With `stream_json`, responses are streamed and the stream is closed as soon as the
+    answer's JSON object is complete, so trailing commentary is never generated.
+    """
+
+    supports_response_schema = True
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        return self._async_clients.get()
 
     def __init__(self,
                  model = os.getenv("MODEL_ID", "meta-llama/Llama-3.3-70B-Instruct"),
                  system_message: str = "You are a helpful assistant",
                  base_url = os.getenv("BASE_URL", "https://api.openai.com/v1/"),
+                 scheduler: LLMScheduler = None,
+                 stream_json: bool = False,
+                 use_stop_sequences: bool = False,
                  **kwargs):
         """
         Initialize OpenAI-style client
@@ -72,16 +192,23 @@ class OpenAIClientLLM(LLMClient):
             model: Model identifier string
             system_message: System prompt for conversation context
             base_url: API endpoint URL
+            scheduler: Rate limiter / retry policy, defaults to the process-wide scheduler
+            stream_json: Stream responses and stop reading once the JSON object is complete
+            use_stop_sequences: Let evaluators pass the stop sequences of their formatters
             kwargs: Additional parameters for completions
         """
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             raise ValueError("OPENAI_API_KEY environment variable required")
-        print(f"Debug: Using base_url = {base_url}")
-        self.client = OpenAI(api_key=api_key, base_url=base_url)
-        self.async_client = AsyncOpenAI(api_key=api_key, base_url=base_url)
+        logger.debug(f"Using base_url = {base_url}")
+        # Retries are owned by the scheduler so backoff is coordinated across clients
+        self.client = OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+        self._async_clients = AsyncOpenAIPerLoop(api_key=api_key, base_url=base_url, max_retries=0)
+        self.scheduler = scheduler or get_default_scheduler()
         self.model = model
         self.system_message = system_message
+        self.stream_json = stream_json
+        self.use_stop_sequences = use_stop_sequences
         self.params = {
             "temperature": 0.7,
             "max_tokens": 2000,
@@ -91,53 +218,226 @@ class OpenAIClientLLM(LLMClient):
         }
         self.params.update(kwargs)
 
-    def generate(self, prompt: str) -> str:
-        """Execute synchronous LLM call"""
+    def _request_params(self, response_schema: Dict = None, stop: List[str] = None) -> Dict:
+        params = dict(self.params)
+        if response_schema is not None:
+            params["response_format"] = json_schema_response_format(response_schema)
+        if stop:
+            params["stop"] = stop
+        return params
+
+    def _stream(self, call, messages: List[Dict], params: Dict) -> str:
+        """Stream one completion, closing it once the answer's JSON object is complete"""
+        reasoning = ReasoningStream(stop_on_json=True)
+        usage = None
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+            **params
+        )
+        try:
+            for chunk in stream:
+                usage = getattr(chunk, "usage", None) or usage
+                content, reasoning_delta = chunk_deltas(chunk)
+                if content or reasoning_delta:
+                    call.first_token()
+                if reasoning.feed(content, reasoning_delta):
+                    break
+        finally:
+            # Closing the connection stops generation on the server
+            stream.close()
+        reasoning.finish()
+        self._add_stream_usage(call, messages, reasoning, usage)
+        return reasoning.answer
+
+    async def _a_stream(self, call, messages: List[Dict], params: Dict) -> str:
+        """Async variant of `_stream`"""
+        reasoning = ReasoningStream(stop_on_json=True)
+        usage = None
+        stream = await self.async_client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+            **params
+        )
+        try:
+            async for chunk in stream:
+                usage = getattr(chunk, "usage", None) or usage
+                content, reasoning_delta = chunk_deltas(chunk)
+                if content or reasoning_delta:
+                    call.first_token()
+                if reasoning.feed(content, reasoning_delta):
+                    break
+        finally:
+            await stream.close()
+        reasoning.finish()
+        self._add_stream_usage(call, messages, reasoning, usage)
+        return reasoning.answer
+
+    @staticmethod
+    def _add_stream_usage(call, messages: List[Dict], reasoning: ReasoningStream, usage) -> None:
+        # The usage chunk comes last, so a stream closed early has to be estimated
+        if usage is not None:
+            call.add_usage(*usage_tokens(usage))
+        else:
+            call.add_usage(
+                estimate_tokens("".join(message["content"] for message in messages)),
+                estimate_tokens(reasoning.thinking_text + reasoning.answer_text)
+            )
+
+    def generate(self, prompt: str, response_schema: Dict = None, stop: List[str] = None) -> str:
+        """Execute synchronous LLM call, optionally constrained to `response_schema`"""
         messages = [
             {"role": "system", "content": self.system_message},
             {"role": "user", "content": prompt}
         ]
+        params = self._request_params(response_schema, stop)
 
-        completion = self.client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            **self.params
-        )
+        with track_call(self, "generate") as call:
+            if self.stream_json:
+                return self.scheduler.call(
+                    lambda: self._stream(call, messages, params),
+                    tokens=estimate_tokens(self.system_message + prompt, self.params.get("max_tokens"))
+                )
+            completion = self.scheduler.call(
+                lambda: self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    **params
+                ),
+                tokens=estimate_tokens(self.system_message + prompt, self.params.get("max_tokens"))
+            )
+            call.add_usage(*usage_tokens(completion.usage))
 
         return completion.choices[0].message.content
 
-    async def a_generate(self, prompt: str) -> str:
-        """Execute asynchronous LLM call"""
+    async def a_generate(self, prompt: str, response_schema: Dict = None, stop: List[str] = None) -> str:
+        """Execute asynchronous LLM call, optionally constrained to `response_schema`"""
         messages = [
             {"role": "system", "content": self.system_message},
             {"role": "user", "content": prompt}
         ]
+        params = self._request_params(response_schema, stop)
 
-        completion = await self.async_client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            **self.params
-        )
+        with track_call(self, "a_generate") as call:
+            if self.stream_json:
+                return await self.scheduler.a_call(
+                    lambda: self._a_stream(call, messages, params),
+                    tokens=estimate_tokens(self.system_message + prompt, self.params.get("max_tokens"))
+                )
+            completion = await self.scheduler.a_call(
+                lambda: self.async_client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    **params
+                ),
+                tokens=estimate_tokens(self.system_message + prompt, self.params.get("max_tokens"))
+            )
+            call.add_usage(*usage_tokens(completion.usage))
 
         return completion.choices[0].message.content
 
+    def _choice_params(self) -> Dict:
+        """Sampling params for a one-token answer with the top alternatives' logprobs"""
+        return {**self.params, "max_tokens": 1, "temperature": 0, "logprobs": True, "top_logprobs": 20}
+
+    def score_choices(self, prompt: str, choices: List[str]) -> Dict[str, float]:
+        """Read the distribution over `choices` from the first token's top_logprobs"""
+        messages = [
+            {"role": "system", "content": self.system_message},
+            {"role": "user", "content": prompt}
+        ]
+        params = self._choice_params()
+
+        with track_call(self, "score_choices") as call:
+            completion = self.scheduler.call(
+                lambda: self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    **params
+                ),
+                tokens=estimate_tokens(self.system_message + prompt, 1)
+            )
+            call.add_usage(*usage_tokens(completion.usage))
+
+        first_token = completion.choices[0].logprobs.content[0]
+        return normalize_choice_logprobs(
+            [(candidate.token, candidate.logprob) for candidate in first_token.top_logprobs],
+            choices
+        )
+
+    async def a_score_choices(self, prompt: str, choices: List[str]) -> Dict[str, float]:
+        """Async variant of `score_choices`"""
+        messages = [
+            {"role": "system", "content": self.system_message},
+            {"role": "user", "content": prompt}
+        ]
+        params = self._choice_params()
+
+        with track_call(self, "a_score_choices") as call:
+            completion = await self.scheduler.a_call(
+                lambda: self.async_client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    **params
+                ),
+                tokens=estimate_tokens(self.system_message + prompt, 1)
+            )
+            call.add_usage(*usage_tokens(completion.usage))
+
+        first_token = completion.choices[0].logprobs.content[0]
+        return normalize_choice_logprobs(
+            [(candidate.token, candidate.logprob) for candidate in first_token.top_logprobs],
+            choices
+        )
+
 
 class LocalDeepSeekR1(LLMClient):
     """using local deepSeek distill Qwen with OpenAI-compatible client
        Follows instruction with https://github.com/deepseek-ai/DeepSeek-R1#usage-recommendations
+
+       Responses are streamed so the <think> trace can be capped at `thinking_budget` tokens:
+       when the budget is used up (or the trace never closes) the trace is closed with
+       </think> and the answer is requested with vLLM/SGLang's continue_final_message.
+       Reading stops as soon as the answer's JSON object is complete.
     """
 
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        return self._async_clients.get()
+
     def __init__(self,
                  model: str = "deepseek-ai/DeepSeek-R1-Distill-Qwen-7B",
                  base_url="http://127.0.0.1:30000/v1",
+                 scheduler: LLMScheduler = None,
+                 thinking_budget: int = 4096,
+                 answer_max_tokens: int = 2000,
+                 stop_on_json: bool = True,
                  **kwargs):
+        """
+        Args:
+            model: Model identifier string
+            base_url: API endpoint URL of the vLLM/SGLang server
+            scheduler: Rate limiter / retry policy, defaults to the process-wide scheduler
+            thinking_budget: Approximate tokens of <think> trace to read before forcing the answer (None = unlimited)
+            answer_max_tokens: max_tokens for the forced answer
+            stop_on_json: Stop reading once the answer's JSON object is complete
+            kwargs: Additional parameters for completions
+        """
         api_key = os.getenv("DEEPSEEK_API_KEY")
         if not api_key:
             raise ValueError("DEEPSEEK_API_KEY environment variable required")
 
-        self.client = OpenAI(api_key=api_key, base_url=base_url)
-        self.async_client = AsyncOpenAI(api_key=api_key, base_url=base_url)
+        self.client = OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+        self._async_clients = AsyncOpenAIPerLoop(api_key=api_key, base_url=base_url, max_retries=0)
+        self.scheduler = scheduler or get_default_scheduler()
         self.model = model
+        self.thinking_budget = thinking_budget
+        self.answer_max_tokens = answer_max_tokens
+        self.stop_on_json = stop_on_json
         self.params = {
             "temperature": 0.6,
             "max_tokens": 32000,
@@ -147,42 +447,142 @@ class LocalDeepSeekR1(LLMClient):
         }
         self.params.update(kwargs)
 
-    def generate(self, prompt: str) -> str:
-        """Execute synchronous LLM call"""
-        messages = [
+    def _messages(self, prompt: str) -> List[Dict]:
+        return [
             {"role": "user", "content": f"{prompt} \n\nAssistant: <think>\n"}
         ]
 
-        completion = self.client.chat.completions.create(
+    def _answer_request(self, prompt: str, thinking: str) -> Dict:
+        """Request continuing a closed-off trace straight into the answer"""
+        return {
+            "messages": self._messages(prompt) + [
+                {"role": "assistant", "content": f"{thinking.rstrip()}\n</think>\n\n"}
+            ],
+            "max_tokens": self.answer_max_tokens,
+            "extra_body": {"continue_final_message": True, "add_generation_prompt": False},
+        }
+
+    def _estimated_tokens(self, prompt: str) -> int:
+        if self.thinking_budget is None:
+            return estimate_tokens(prompt, self.params.get("max_tokens"))
+        return estimate_tokens(prompt, self.thinking_budget + self.answer_max_tokens)
+
+    def _stream(self, call, thinking: bool, messages: List[Dict], **overrides) -> ReasoningStream:
+        """Read one streamed completion until it ends, the budget is used up or the JSON is complete"""
+        reasoning = ReasoningStream(
+            thinking_budget=self.thinking_budget if thinking else None,
+            stop_on_json=self.stop_on_json,
+            thinking=thinking
+        )
+        stream = self.client.chat.completions.create(
             model=self.model,
             messages=messages,
-            **self.params
+            stream=True,
+            **{**self.params, **overrides}
         )
-        match = re.search(r'</think>\n\n(.*)', completion.choices[0].message.content, re.DOTALL)
-        return match.group(1)
-
-    async def a_generate(self, prompt: str) -> str:
-        """Execute synchronous LLM call"""
-        messages = [
-            {"role": "user", "content": f"{prompt} \n\nAssistant: <think>\n"}
-        ]
-
-        completion = await self.async_client.chat.completions.create(
+        try:
+            for chunk in stream:
+                content, reasoning_delta = chunk_deltas(chunk)
+                if content or reasoning_delta:
+                    call.first_token()
+                if reasoning.feed(content, reasoning_delta):
+                    break
+        finally:
+            # Closing the connection stops generation on the server
+            stream.close()
+        reasoning.finish()
+        return reasoning
+
+    async def _a_stream(self, call, thinking: bool, messages: List[Dict], **overrides) -> ReasoningStream:
+        """Async variant of `_stream`"""
+        reasoning = ReasoningStream(
+            thinking_budget=self.thinking_budget if thinking else None,
+            stop_on_json=self.stop_on_json,
+            thinking=thinking
+        )
+        stream = await self.async_client.chat.completions.create(
             model=self.model,
             messages=messages,
-            **self.params
+            stream=True,
+            **{**self.params, **overrides}
         )
-        match = re.search(r'</think>\n\n(.*)', completion.choices[0].message.content, re.DOTALL)
-        return match.group(1)
+        try:
+            async for chunk in stream:
+                content, reasoning_delta = chunk_deltas(chunk)
+                if content or reasoning_delta:
+                    call.first_token()
+                if reasoning.feed(content, reasoning_delta):
+                    break
+        finally:
+            await stream.close()
+        reasoning.finish()
+        return reasoning
+
+    def generate(self, prompt: str) -> str:
+        """Execute synchronous LLM call"""
+        with track_call(self, "generate") as call:
+            reasoning = self.scheduler.call(
+                lambda: self._stream(call, True, self._messages(prompt)),
+                tokens=self._estimated_tokens(prompt)
+            )
+            completion_text = reasoning.thinking_text + reasoning.answer_text
+            if not reasoning.thinking_closed:
+                logger.info("Thinking budget used up or trace not closed, forcing the answer")
+                answer = self.scheduler.call(
+                    lambda: self._stream(call, False, **self._answer_request(prompt, reasoning.thinking_text)),
+                    tokens=estimate_tokens(prompt + reasoning.thinking_text, self.answer_max_tokens)
+                )
+                completion_text += answer.answer_text
+                reasoning = answer
+            call.add_usage(estimate_tokens(prompt), estimate_tokens(completion_text))
+        return reasoning.answer
+
+    async def a_generate(self, prompt: str) -> str:
+        """Execute asynchronous LLM call"""
+        with track_call(self, "a_generate") as call:
+            reasoning = await self.scheduler.a_call(
+                lambda: self._a_stream(call, True, self._messages(prompt)),
+                tokens=self._estimated_tokens(prompt)
+            )
+            completion_text = reasoning.thinking_text + reasoning.answer_text
+            if not reasoning.thinking_closed:
+                logger.info("Thinking budget used up or trace not closed, forcing the answer")
+                answer = await self.scheduler.a_call(
+                    lambda: self._a_stream(call, False, **self._answer_request(prompt, reasoning.thinking_text)),
+                    tokens=estimate_tokens(prompt + reasoning.thinking_text, self.answer_max_tokens)
+                )
+                completion_text += answer.answer_text
+                reasoning = answer
+            call.add_usage(estimate_tokens(prompt), estimate_tokens(completion_text))
+        return reasoning.answer
 
 
 class HTTPLLM(LLMClient):
-    """Concrete implementation using generic HTTP API endpoint"""
+    """Concrete implementation using generic HTTP API endpoint with pooled keep-alive sessions.
+    Use as a (async) context manager, or call close()/aclose(), to release connections.
+
+    With `thinking_budget` set, responses are streamed and a reasoning model's trace (inline
+    <think> or reasoning_content) is cut off at the budget, after which the answer is
+    requested in a follow-up turn. `stream_json` streams without a budget, only to stop
+    reading once the answer's JSON object is complete.
+    """
+
+    supports_response_schema = True
 
     def __init__(self,
                  model: str = "deepseek_r1",
                  base_url: str = "https://cloud.luchentech.com/api/maas/chat/completions",
                  system_message: str = "You are a helpful and harmless assistant. You should think step-by-step.",
+                 pool_size: int = 100,
+                 keepalive_timeout: float = 30,
+                 timeout: float = 60,
+                 scheduler: LLMScheduler = None,
+                 thinking_budget: int = None,
+                 answer_max_tokens: int = 2000,
+                 stop_on_json: bool = True,
+                 think_prefilled: bool = False,
+                 stream_json: bool = False,
+                 use_stop_sequences: bool = False,
                  **kwargs):
         """
         Initialize HTTP client
@@ -191,6 +591,17 @@ class HTTPLLM(LLMClient):
             model: Model identifier string
             base_url: API endpoint URL
             system_message: System prompt for conversation context  
+            pool_size: Maximum number of pooled connections to the endpoint
+            keepalive_timeout: Seconds an idle async connection is kept open for reuse
+            timeout: Total request timeout in seconds
+            scheduler: Rate limiter / retry policy, defaults to the process-wide scheduler
+            thinking_budget: If set, stream and read at most this many (approximate) thinking tokens
+            answer_max_tokens: max_tokens for the answer requested after the budget is used up
+            stop_on_json: When streaming, stop reading once the answer's JSON object is complete
+            think_prefilled: The server's chat template already opens <think> (as DeepSeek-R1's does),
+                so the streamed content starts inside the trace
+            stream_json: Stream even without a thinking budget, stopping once the JSON object is complete
+            use_stop_sequences: Let evaluators pass the stop sequences of their formatters
             kwargs: Additional parameters for completions
         """
         api_key = os.getenv("MAAS_API_KEY")
@@ -209,9 +620,51 @@ class HTTPLLM(LLMClient):
             "max_tokens": 32000,
         }
         self.params.update(kwargs)
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+        self.scheduler = scheduler or get_default_scheduler()
+        self.thinking_budget = thinking_budget
+        self.answer_max_tokens = answer_max_tokens
+        self.stop_on_json = stop_on_json
+        self.think_prefilled = think_prefilled
+        self.stream_json = stream_json
+        self.use_stop_sequences = use_stop_sequences
+
+        # Imported here so API-only users of utils.llm do not pay for requests at import time
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        # requests keeps connections alive per Session; size the pool for threaded callers
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(self.headers)
+
+        # aiohttp sessions are bound to an event loop, so it is created lazily on first async use
+        self._async_session = None
+        self._async_loop = None
+
+    def _get_async_session(self) -> "aiohttp.ClientSession":
+        """Return the pooled aiohttp session for the running event loop"""
+        import aiohttp
+
+        loop = asyncio.get_running_loop()
+        if self._async_session is None or self._async_session.closed or self._async_loop is not loop:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                keepalive_timeout=self.keepalive_timeout
+            )
+            self._async_session = aiohttp.ClientSession(
+                connector=connector,
+                headers=self.headers,
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+            self._async_loop = loop
+        return self._async_session
 
-    def generate(self, prompt: str) -> str:
-        """Execute synchronous HTTP request"""
+    def _payload(self, prompt: str, response_schema: Dict = None, stop: List[str] = None) -> Dict:
         payload = {
             "model": self.model,
             "messages": [
@@ -220,215 +673,256 @@ class HTTPLLM(LLMClient):
             ],
             **self.params
         }
-
-        response = requests.post(
-            self.base_url,
-            headers=self.headers,
-            json=payload,
-            timeout=60
+        if response_schema is not None:
+            payload["response_format"] = json_schema_response_format(response_schema)
+        if stop:
+            payload["stop"] = stop
+        return payload
+
+    def _answer_payload(self, prompt: str, thinking: str, response_schema: Dict = None, stop: List[str] = None) -> Dict:
+        """Follow-up turn asking for the answer after the trace was cut off"""
+        payload = self._payload(prompt, response_schema, stop)
+        payload["messages"] += [
+            {"role": "assistant", "content": f"<think>\n{thinking.rstrip()}\n</think>"},
+            {"role": "user", "content": FORCE_ANSWER_PROMPT}
+        ]
+        payload["max_tokens"] = self.answer_max_tokens
+        return payload
+
+    def _stream(self, call, payload: Dict, thinking_budget: int) -> ReasoningStream:
+        """POST with stream=True and read SSE chunks until done, over budget or the JSON is complete"""
+        reasoning = ReasoningStream(
+            thinking_budget=thinking_budget,
+            stop_on_json=self.stop_on_json,
+            thinking=True if self.think_prefilled else None
         )
-
-        response.raise_for_status()
-        return response.json()['choices'][0]['message']['content']
-
-    async def a_generate(self, prompt: str) -> str:
-        """Execute asynchronous HTTP request"""
-        payload = {
-            "model": self.model,
-            "messages": [
-                {"role": "system", "content": self.system_message},
-                {"role": "user", "content": prompt}
-            ],
-            **self.params
-        }
-
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                    self.base_url,
-                    headers=self.headers,
-                    json=payload,
-                    timeout=aiohttp.ClientTimeout(total=60)
-            ) as response:
-                response.raise_for_status()
-                data = await response.json()
-                return data['choices'][0]['message']['content']
-
-
-class HFClientVLLM(LLMClient):
-    """Concrete implementation for local Hugging Face models with vLLM acceleration. Tested with a100 cuda 12.3, torch 2.6.0"""
-
-    def __init__(self,
-                 model_path: str,
-                 system_message: str = "You are a helpful assistant",
-                 **kwargs):
-        """
-        Initialize vLLM-accelerated Hugging Face client
-
-        Args:
-            model_path: Path or name of Hugging Face model
-            system_message: System prompt for conversation context
-            kwargs: Additional parameters for vLLM
-        """
-        # Retrieve Hugging Face token from environment variable
-        hf_token = os.getenv("HF_TOKEN")
-        if not hf_token:
-            raise ValueError("HF_TOKEN environment variable is not set")
-
-        # Authenticate with Hugging Face
-        login(token=hf_token)
-
-        self.model_path = model_path
-        self.system_message = system_message
-
-        # Initialize vLLM engine with optimized settings
-        self.llm = LLM(
-            model=model_path,
-            # token=hf_token,
-            trust_remote_code=True,
-            dtype="float16",  # GPU compatibility issue https://github.com/vllm-project/vllm/issues/1157
-            tensor_parallel_size=torch.cuda.device_count(),
-            enforce_eager=True,  # https://github.com/vllm-project/vllm/issues/2248,
-            gpu_memory_utilization=0.95,
-            max_model_len=4096,
-            **kwargs
+        # Leaving the with block early drops the connection, which stops generation upstream
+        with self.session.post(self.base_url, json={**payload, "stream": True}, timeout=self.timeout, stream=True) as response:
+            response.raise_for_status()
+            for chunk in iter_sse_data(response.iter_lines()):
+                content, reasoning_delta = chunk_deltas(chunk)
+                if content or reasoning_delta:
+                    call.first_token()
+                if reasoning.feed(content, reasoning_delta):
+                    break
+        reasoning.finish()
+        return reasoning
+
+    async def _a_stream(self, call, payload: Dict, thinking_budget: int) -> ReasoningStream:
+        """Async variant of `_stream`"""
+        reasoning = ReasoningStream(
+            thinking_budget=thinking_budget,
+            stop_on_json=self.stop_on_json,
+            thinking=True if self.think_prefilled else None
         )
-
-        # Configure sampling parameters
-        self.sampling_params = SamplingParams(
-            temperature=0.7,
-            top_p=0.95,
-            max_tokens=1000,  # Equivalent to max_new_tokens
-            skip_special_tokens=True
+        session = self._get_async_session()
+        async with session.post(self.base_url, json={**payload, "stream": True}) as response:
+            response.raise_for_status()
+            async for line in response.content:
+                if line.strip() == b"data: [DONE]":
+                    break
+                for chunk in iter_sse_data([line]):
+                    content, reasoning_delta = chunk_deltas(chunk)
+                    if content or reasoning_delta:
+                        call.first_token()
+                    if reasoning.feed(content, reasoning_delta):
+                        break
+                if reasoning.budget_exceeded or (self.stop_on_json and reasoning.json_complete):
+                    break
+        reasoning.finish()
+        return reasoning
+
+    def _completion_budget(self) -> int:
+        if self.thinking_budget is None:
+            return self.params.get("max_tokens")
+        return self.thinking_budget + self.answer_max_tokens
+
+    def _generate_streaming(self, call, prompt: str, response_schema: Dict = None, stop: List[str] = None) -> str:
+        tokens = estimate_tokens(self.system_message + prompt, self._completion_budget())
+        reasoning = self.scheduler.call(
+            lambda: self._stream(call, self._payload(prompt, response_schema, stop), self.thinking_budget),
+            tokens=tokens
         )
-
-    def generate(self, prompt: str, **kwargs) -> str:
-        # Format prompt with vLLM's optimized template handling
-        if hasattr(self.llm.llm_engine.tokenizer, 'chat_template'):
-            messages = [{"role": "user", "content": prompt}]
-            formatted_prompt = self.llm.llm_engine.tokenizer.apply_chat_template(
-                messages,
-                add_generation_prompt=True
+        completion_text = reasoning.thinking_text + reasoning.answer_text
+        answer = reasoning.answer
+        if reasoning.budget_exceeded:
+            logger.info("Thinking budget used up, requesting the answer")
+            payload = self._answer_payload(prompt, reasoning.thinking_text, response_schema, stop)
+            reasoning = self.scheduler.call(
+                lambda: self._stream(call, payload, FORCED_ANSWER_THINKING_BUDGET),
+                tokens=estimate_tokens(completion_text, self.answer_max_tokens)
             )
-        else:
-            formatted_prompt = f"{self.system_message}\n\nUser: {prompt}\n\nAssistant:"
+            completion_text += reasoning.thinking_text + reasoning.answer_text
+            answer = reasoning.answer
+            if not reasoning.thinking_closed:
+                # Answered straight away, without the trace a prefilled template expects
+                answer = reasoning.thinking_text.strip()
+        call.add_usage(estimate_tokens(self.system_message + prompt), estimate_tokens(completion_text))
+        return answer
+
+    async def _a_generate_streaming(self, call, prompt: str, response_schema: Dict = None, stop: List[str] = None) -> str:
+        tokens = estimate_tokens(self.system_message + prompt, self._completion_budget())
+        reasoning = await self.scheduler.a_call(
+            lambda: self._a_stream(call, self._payload(prompt, response_schema, stop), self.thinking_budget),
+            tokens=tokens
+        )
+        completion_text = reasoning.thinking_text + reasoning.answer_text
+        answer = reasoning.answer
+        if reasoning.budget_exceeded:
+            logger.info("Thinking budget used up, requesting the answer")
+            payload = self._answer_payload(prompt, reasoning.thinking_text, response_schema, stop)
+            reasoning = await self.scheduler.a_call(
+                lambda: self._a_stream(call, payload, FORCED_ANSWER_THINKING_BUDGET),
+                tokens=estimate_tokens(completion_text, self.answer_max_tokens)
+            )
+            completion_text += reasoning.thinking_text + reasoning.answer_text
+            answer = reasoning.answer
+            if not reasoning.thinking_closed:
+                # Answered straight away, without the trace a prefilled template expects
+                answer = reasoning.thinking_text.strip()
+        call.add_usage(estimate_tokens(self.system_message + prompt), estimate_tokens(completion_text))
+        return answer
+
+    def generate(self, prompt: str, response_schema: Dict = None, stop: List[str] = None) -> str:
+        """Execute synchronous HTTP request"""
+        if self.thinking_budget is not None or self.stream_json:
+            with track_call(self, "generate") as call:
+                return self._generate_streaming(call, prompt, response_schema, stop)
 
-        # Start timing
-        start_time = time.time()
+        payload = self._payload(prompt, response_schema, stop)
 
-        # Use vLLM's optimized batch processing
-        outputs = self.llm.generate(
-            formatted_prompt,
-            sampling_params=self.sampling_params,
-            **kwargs
-        )
+        def post():
+            response = self.session.post(
+                self.base_url,
+                json=payload,
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+            return response.json()
 
-        # End timing
-        elapsed_time = time.time() - start_time
-        logger.info(f"vLLM optimized inference time: {elapsed_time:.2f} seconds")
+        with track_call(self, "generate") as call:
+            data = self.scheduler.call(post, tokens=estimate_tokens(self.system_message + prompt, self.params.get("max_tokens")))
+            call.add_usage(*usage_tokens(data.get('usage')))
+        return data['choices'][0]['message']['content']
 
-        # Extract and clean response
-        assistant_response = outputs[0].outputs[0].text.strip()
+    async def a_generate(self, prompt: str, response_schema: Dict = None, stop: List[str] = None) -> str:
+        """Execute asynchronous HTTP request"""
+        if self.thinking_budget is not None or self.stream_json:
+            with track_call(self, "a_generate") as call:
+                return await self._a_generate_streaming(call, prompt, response_schema, stop)
 
-        # Additional DeepSeek filtering
-        if "</think>" in assistant_response:
-            idx = assistant_response.find("</think>")
-            assistant_response = assistant_response[idx + len("</think>"):].strip()
+        payload = self._payload(prompt, response_schema, stop)
 
-        return assistant_response
+        async def post():
+            session = self._get_async_session()
+            async with session.post(self.base_url, json=payload) as response:
+                response.raise_for_status()
+                return await response.json()
 
-    async def a_generate(self, prompt):
-        pass
+        with track_call(self, "a_generate") as call:
+            data = await self.scheduler.a_call(post, tokens=estimate_tokens(self.system_message + prompt, self.params.get("max_tokens")))
+            call.add_usage(*usage_tokens(data.get('usage')))
+        return data['choices'][0]['message']['content']
 
+    def close(self) -> None:
+        """Release pooled connections. Prefer aclose() from inside a running event loop."""
+        self.session.close()
+        if self._async_session is not None and not self._async_session.closed:
+            if self._async_loop.is_running():
+                logger.warning("HTTPLLM.close() called inside a running event loop, use aclose() instead")
+                return
+            if not self._async_loop.is_closed():
+                self._async_loop.run_until_complete(self._async_session.close())
+        self._async_session = None
 
-class HFClient(LLMClient):
-    """Concrete implementation for local Hugging Face models (GPU-only)"""
+    async def aclose(self) -> None:
+        """Release pooled connections from async code"""
+        self.session.close()
+        if self._async_session is not None and not self._async_session.closed:
+            await self._async_session.close()
+        self._async_session = None
 
-    def __init__(self,
-                 model_path: str,
-                 system_message: str = "You are a helpful assistant",
-                 **kwargs):
-        """
-        Initialize local Hugging Face client
+    def __enter__(self) -> HTTPLLM:
+        return self
 
-        Args:
-            model_path: Path or name of Hugging Face model
-            system_message: System prompt for conversation context
-            kwargs: Additional parameters
-        """
-        # Retrieve Hugging Face token from environment variable
-        hf_token = os.getenv("HF_TOKEN")
-        if not hf_token:
-            raise ValueError("HF_TOKEN environment variable is not set")
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
 
-        # Authenticate with Hugging Face
-        login(token=hf_token)
+    async def __aenter__(self) -> HTTPLLM:
+        return self
 
-        self.model_path = model_path
-        self.system_message = system_message
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-
-        self.tokenizer = AutoTokenizer.from_pretrained(self.model_path, token=hf_token)
-        self.model = AutoModelForCausalLM.from_pretrained(self.model_path, token=hf_token).to(self.device)
-
-        self.generation_config = GenerationConfig.from_pretrained(self.model_path)
-        # Set pad_token_id based on the tokenizer's eos_token_id.
-        eos_id = self.tokenizer.eos_token_id
-        if isinstance(eos_id, list):
-            eos_id = eos_id[0]
-        self.generation_config.pad_token_id = eos_id
-
-    def generate(self, prompt: str, **kwargs) -> str:
-        # Determine how to format the prompt
-        if hasattr(self.tokenizer, 'chat_template') and self.tokenizer.chat_template:
-            messages = [{"role": "user", "content": prompt}]
-            # Generate input tensor using the chat template
-            input_tensor = self.tokenizer.apply_chat_template(
-                messages,
-                add_generation_prompt=True,
-                return_tensors="pt"
-            ).to(self.device)
-            # Decode the formatted prompt to know its text length
-            formatted_prompt = self.tokenizer.decode(input_tensor[0], skip_special_tokens=True)
-        else:
-            # Fallback: manual formatting of the prompt
-            full_prompt = f"{self.system_message}\n\nUser: {prompt}\n\nAssistant:"
-            input_tensor = self.tokenizer(full_prompt, return_tensors="pt").input_ids.to(self.device)
-            formatted_prompt = full_prompt  # Use the full prompt as formatted prompt
-
-        # Set max_new_tokens if not provided
-        max_new_tokens = kwargs.pop('max_new_tokens', 1000)
-
-        # Start time counting before generation
-        start_time = time.time()
-
-        outputs = self.model.generate(
-            input_tensor,
-            generation_config=self.generation_config,
-            max_new_tokens=max_new_tokens,
-            **kwargs
-        )
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.aclose()
 
-        # End time counting after generation
-        end_time = time.time()
-        elapsed_time = end_time - start_time
-        logger.info(f"Inference time: {elapsed_time:.2f} seconds")
 
-        # Decode the complete generated text
-        generated_text = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-        # Remove the input prompt portion to get only the assistant's response
-        assistant_response = generated_text[len(formatted_prompt):]
+# Key -> Future of the client, so a slow constructor does not hold the lock
+_clients: Dict[str, Future] = {}
+_clients_lock = threading.Lock()
 
-        # Additional filtering for DeepSeek: remove everything before and including '</think>'
-        if "</think>" in assistant_response:
-            idx = assistant_response.find("</think>")
-            assistant_response = assistant_response[idx + len("</think>"):].strip()
 
-        return assistant_response.strip()
+def client_key(llm_class: type, **kwargs) -> str:
+    """Registry key of a client configuration: its class and constructor arguments"""
+    # Objects without a JSON form (e.g. a scheduler) are keyed by identity through repr
+    return json.dumps(
+        {"class": f"{llm_class.__module__}.{llm_class.__qualname__}", "kwargs": kwargs},
+        sort_keys=True,
+        default=repr
+    )
 
-    async def a_generate(self, prompt):
-        pass
 
+def get_client(llm_class: type = None, **kwargs) -> LLMClient:
+    """
+    Process-wide client for a configuration, built on first use. Evaluators share it,
+    so connection pools are reused and local model weights are loaded once.
+
+    Args:
+        llm_class: LLM client class, defaults to OpenAIClientLLM
+        kwargs: Constructor arguments
 
+    Returns:
+        The shared client for (llm_class, kwargs)
+    """
+    llm_class = llm_class or OpenAIClientLLM
+    key = client_key(llm_class, **kwargs)
+    with _clients_lock:
+        future = _clients.get(key)
+        building = future is None
+        if building:
+            future = _clients[key] = Future()
+    if building:
+        # Built outside the lock: loading one local model must not block lookups of other clients;
+        # callers asking for the same configuration meanwhile wait on the future
+        try:
+            future.set_result(llm_class(**kwargs))
+        except BaseException as e:
+            with _clients_lock:
+                _clients.pop(key, None)
+            future.set_exception(e)
+            raise
+    return future.result()
+
+
+def close_clients() -> None:
+    """
+    Close and forget every registered client, e.g. between tests; also runs at interpreter
+    exit so sessions and worker threads of shared clients are released
+    """
+    with _clients_lock:
+        futures = list(_clients.values())
+        _clients.clear()
+    for future in futures:
+        if not future.done() or future.exception() is not None:
+            continue
+        close = getattr(future.result(), "close", None)
+        if close is None:
+            continue
+        try:
+            close()
+        except Exception as e:
+            logger.warning(f"Failed to close {type(future.result()).__name__}: {e}")
+
+
+atexit.register(close_clients)
 
 
 def chat_openai(messages, model, json_mode=False, **kwargs) -> ChatCompletion:
@@ -0,0 +1,284 @@
+from __future__ import annotations
+import logging
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from utils.llm import LLMClient, OpenAIClientLLM
+from utils.rate_limit import LLMScheduler, is_retryable
+
+logger = logging.getLogger(__name__)
+
+
+class Endpoint:
+    """One backend of a LoadBalancedLLM with its in-flight count and health state"""
+
+    def __init__(self, client: LLMClient, name: str = None, health_url: str = None):
+        """
+        Args:
+            client: Client bound to this endpoint
+            name: Label used in logs, defaults to the health URL or client class
+            health_url: URL probed by `check_health`; endpoints without one are only marked
+                down and up by the outcome of real requests
+        """
+        self.client = client
+        self.name = name or health_url or type(client).__name__
+        self.health_url = health_url
+        self.outstanding = 0
+        self.failures = 0
+        self.down_until = 0.0
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.down_until
+
+    def __repr__(self) -> str:
+        return f"Endpoint({self.name!r}, outstanding={self.outstanding}, healthy={self.healthy})"
+
+
+class LoadBalancedLLM(LLMClient):
+    """
+    Spreads requests over several equivalent endpoints (e.g. vLLM or SGLang servers
+    serving the same model), routing each call to the healthy endpoint with the fewest
+    outstanding requests and failing over to the next one on connection errors,
+    timeouts, 429s and 5xx responses.
+    """
+
+    def __init__(self,
+                 clients: List[LLMClient],
+                 health_urls: List[str] = None,
+                 names: List[str] = None,
+                 failure_cooldown: float = 5.0,
+                 max_cooldown: float = 60.0,
+                 health_check_interval: float = 0,
+                 health_check_timeout: float = 2.0):
+        """
+        Args:
+            clients: One client per endpoint, all serving the same model
+            health_urls: Optional probe URL per client, e.g. "<base_url>/models"
+            names: Optional label per client for logs, e.g. its base URL
+            failure_cooldown: Seconds an endpoint is skipped after a failure, doubled on each consecutive failure
+            max_cooldown: Upper bound for the cooldown
+            health_check_interval: If > 0, probe every endpoint in a background thread this often
+            health_check_timeout: Seconds to wait for a health probe
+        """
+        if not clients:
+            raise ValueError("LoadBalancedLLM needs at least one client")
+        health_urls = health_urls or [None] * len(clients)
+        names = names or [None] * len(clients)
+        self.endpoints = [
+            Endpoint(client, name=name, health_url=url)
+            for client, name, url in zip(clients, names, health_urls)
+        ]
+        self.failure_cooldown = failure_cooldown
+        self.max_cooldown = max_cooldown
+        self.health_check_timeout = health_check_timeout
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._health_thread = None
+        if health_check_interval > 0:
+            self._health_thread = threading.Thread(
+                target=self._health_loop, args=(health_check_interval,), daemon=True
+            )
+            self._health_thread.start()
+
+    @classmethod
+    def from_endpoints(cls,
+                       base_urls: List[str],
+                       client_class: type = OpenAIClientLLM,
+                       max_retries: int = 1,
+                       health_check_interval: float = 0,
+                       **kwargs) -> LoadBalancedLLM:
+        """
+        Build one OpenAI-compatible client per base URL
+
+        Args:
+            base_urls: Server URLs such as "http://10.0.0.1:30000/v1"
+            client_class: Client taking `base_url` and `scheduler` keywords
+            max_retries: Retries each endpoint makes before the balancer fails over
+            health_check_interval: See `__init__`
+            kwargs: Passed to every client, e.g. model or max_tokens
+
+        Returns:
+            LoadBalancedLLM over the endpoints
+        """
+        # Per-endpoint schedulers, so one server's concurrency limit does not cap the others
+        clients = [
+            client_class(base_url=base_url, scheduler=LLMScheduler(max_retries=max_retries), **kwargs)
+            for base_url in base_urls
+        ]
+        health_urls = [base_url.rstrip("/") + "/models" for base_url in base_urls]
+        return cls(clients, health_urls=health_urls, names=base_urls, health_check_interval=health_check_interval)
+
+    # Identity of the first endpoint, so cache keys do not depend on routing
+    @property
+    def model(self) -> Any:
+        client = self.endpoints[0].client
+        return getattr(client, "model", None) or getattr(client, "model_path", None)
+
+    @property
+    def params(self) -> Any:
+        return getattr(self.endpoints[0].client, "params", None)
+
+    @property
+    def system_message(self) -> Optional[str]:
+        return getattr(self.endpoints[0].client, "system_message", None)
+
+    @property
+    def supports_response_schema(self) -> bool:
+        return all(endpoint.client.supports_response_schema for endpoint in self.endpoints)
+
+    @property
+    def use_stop_sequences(self) -> bool:
+        return all(endpoint.client.use_stop_sequences for endpoint in self.endpoints)
+
+    def _acquire(self, tried: List[Endpoint]) -> Optional[Endpoint]:
+        """Reserve the least loaded healthy endpoint not yet tried for this request"""
+        with self._lock:
+            candidates = [endpoint for endpoint in self.endpoints if endpoint not in tried]
+            if not candidates:
+                return None
+            healthy = [endpoint for endpoint in candidates if endpoint.healthy]
+            if healthy:
+                least = min(endpoint.outstanding for endpoint in healthy)
+                endpoint = random.choice([e for e in healthy if e.outstanding == least])
+            else:
+                # Everything is cooling down: probe the one that is due back first
+                endpoint = min(candidates, key=lambda e: e.down_until)
+            endpoint.outstanding += 1
+            return endpoint
+
+    def _release(self, endpoint: Endpoint) -> None:
+        with self._lock:
+            endpoint.outstanding -= 1
+
+    def _record(self, endpoint: Endpoint, error: BaseException = None) -> None:
+        """Update the endpoint's health after a request that finished or failed"""
+        with self._lock:
+            if error is None:
+                endpoint.failures = 0
+                endpoint.down_until = 0.0
+                return
+            endpoint.failures += 1
+            cooldown = min(self.max_cooldown, self.failure_cooldown * 2 ** (endpoint.failures - 1))
+            endpoint.down_until = time.monotonic() + cooldown
+        logger.warning(f"Endpoint {endpoint.name} failed ({type(error).__name__}: {error}), "
+                       f"skipping it for {cooldown:.0f}s")
+
+    def _call(self, fn: Callable[[LLMClient], Any]) -> Any:
+        tried = []
+        while True:
+            endpoint = self._acquire(tried)
+            if endpoint is None:
+                raise last_error
+            tried.append(endpoint)
+            try:
+                result = fn(endpoint.client)
+            except Exception as e:
+                if not is_retryable(e):
+                    # A bad request fails on every endpoint, so it is not the server's fault
+                    self._record(endpoint)
+                    raise
+                self._record(endpoint, e)
+                last_error = e
+                continue
+            finally:
+                # Also reached on cancellation or KeyboardInterrupt, which must not leak the slot
+                self._release(endpoint)
+            self._record(endpoint)
+            return result
+
+    async def _a_call(self, fn: Callable[[LLMClient], Awaitable[Any]]) -> Any:
+        tried = []
+        while True:
+            endpoint = self._acquire(tried)
+            if endpoint is None:
+                raise last_error
+            tried.append(endpoint)
+            try:
+                result = await fn(endpoint.client)
+            except Exception as e:
+                if not is_retryable(e):
+                    self._record(endpoint)
+                    raise
+                self._record(endpoint, e)
+                last_error = e
+                continue
+            finally:
+                self._release(endpoint)
+            self._record(endpoint)
+            return result
+
+    def generate(self, prompt: str, **kwargs) -> str:
+        return self._call(lambda client: client.generate(prompt, **kwargs))
+
+    async def a_generate(self, prompt: str, **kwargs) -> str:
+        return await self._a_call(lambda client: client.a_generate(prompt, **kwargs))
+
+    def generate_batch(self, prompts: List[str], **kwargs) -> List[str]:
+        """Send the prompts concurrently so every endpoint is kept busy"""
+        if not prompts:
+            return []
+        workers = min(len(prompts), 8 * len(self.endpoints))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(lambda prompt: self.generate(prompt, **kwargs), prompts))
+
+    def score_choices(self, prompt: str, choices: List[str]) -> Dict[str, float]:
+        return self._call(lambda client: client.score_choices(prompt, choices))
+
+    async def a_score_choices(self, prompt: str, choices: List[str]) -> Dict[str, float]:
+        return await self._a_call(lambda client: client.a_score_choices(prompt, choices))
+
+    def check_health(self) -> Dict[str, bool]:
+        """
+        Probe every endpoint with a health URL. Any HTTP answer below 500 (including 401)
+        counts as alive; failed probes put the endpoint into cooldown.
+
+        Returns:
+            Mapping of endpoint name to whether its probe succeeded
+        """
+        status = {}
+        for endpoint in self.endpoints:
+            if endpoint.health_url is None:
+                continue
+            try:
+                with urllib.request.urlopen(endpoint.health_url, timeout=self.health_check_timeout):
+                    alive = True
+            except urllib.error.HTTPError as e:
+                alive = e.code < 500
+            except Exception:
+                alive = False
+            with self._lock:
+                if alive:
+                    endpoint.failures = 0
+                    endpoint.down_until = 0.0
+                else:
+                    endpoint.failures += 1
+                    endpoint.down_until = time.monotonic() + min(
+                        self.max_cooldown, self.failure_cooldown * 2 ** (endpoint.failures - 1)
+                    )
+            status[endpoint.name] = alive
+        return status
+
+    def _health_loop(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            self.check_health()
+
+    def close(self) -> None:
+        """Stop health checks and close endpoint clients that hold connections"""
+        self._stop.set()
+        for endpoint in self.endpoints:
+            close = getattr(endpoint.client, "close", None)
+            if close is not None:
+                close()
+
+    async def aclose(self) -> None:
+        self._stop.set()
+        for endpoint in self.endpoints:
+            aclose = getattr(endpoint.client, "aclose", None)
+            if aclose is not None:
+                await aclose()
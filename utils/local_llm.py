@@ -0,0 +1,662 @@
+"""
+Local Hugging Face model clients. Kept out of utils.llm so that importing the
+API clients does not load torch, transformers or vLLM; utils.llm re-exports
+these classes lazily on first access.
+"""
+from __future__ import annotations
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List
+import asyncio
+import contextvars
+import copy
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+import logging
+
+import torch
+from transformers import AutoTokenizer, AutoModelForCausalLM, GenerationConfig, DynamicCache
+from huggingface_hub import login
+
+from utils.llm import LLMClient, normalize_choice_logprobs
+from utils.instrumentation import track_call
+
+logger = logging.getLogger(__name__)
+
+try:
+    from vllm import LLM, SamplingParams, AsyncLLMEngine, AsyncEngineArgs
+except ImportError:
+    logger.info("vllm is not installed, Please install vllm to use fast inference feature.")
+
+try:
+    from vllm.sampling_params import GuidedDecodingParams
+except ImportError:
+    GuidedDecodingParams = None
+
+try:
+    from optimum.quanto import quantize as quanto_quantize, freeze as quanto_freeze, qint4
+except ImportError:
+    quanto_quantize = None
+
+try:
+    from lmformatenforcer import JsonSchemaParser
+    from lmformatenforcer.integrations.transformers import build_transformers_prefix_allowed_tokens_fn
+except ImportError:
+    JsonSchemaParser = None
+
+
+def strip_thinking(response: str) -> str:
+    """Drop a DeepSeek-style reasoning trace, keeping what follows '</think>'"""
+    if "</think>" in response:
+        idx = response.find("</think>")
+        response = response[idx + len("</think>"):]
+    return response.strip()
+
+
+class BatchingWorker:
+    """
+    Background thread serving async callers of a blocking batch function. Requests queued
+    while a batch runs (or within `max_wait` of the first one) are grouped into the next
+    call, so concurrent a_generate calls share one forward pass instead of queueing.
+    """
+
+    def __init__(self,
+                 generate_batch: Callable[..., List[str]],
+                 max_batch_size: int = 8,
+                 max_wait: float = 0.01,
+                 name: str = "batching-worker"):
+        """
+        Args:
+            generate_batch: Blocking function mapping a list of prompts (plus kwargs) to responses
+            max_batch_size: Most prompts handed to one call
+            max_wait: Seconds to wait for more requests after the first one arrives
+            name: Thread name
+        """
+        self.generate_batch = generate_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.name = name
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, prompt: str, **kwargs) -> Future:
+        """Queue one prompt; the future resolves to its response"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+        future = Future()
+        self._queue.put((prompt, kwargs, future, contextvars.copy_context()))
+        return future
+
+    async def a_submit(self, prompt: str, **kwargs) -> str:
+        return await asyncio.wrap_future(self.submit(prompt, **kwargs))
+
+    def _collect(self) -> List[tuple]:
+        """Block for the next request, then gather what else arrives in time; None means stop"""
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item is None:
+                # Finish this batch, then stop
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            # One call per distinct set of generation arguments, e.g. per response schema
+            groups = {}
+            for item in batch:
+                groups.setdefault(json.dumps(item[1], sort_keys=True, default=str), []).append(item)
+            for items in groups.values():
+                # Skip requests whose caller was cancelled while queued
+                live = [item for item in items if item[2].set_running_or_notify_cancel()]
+                if not live:
+                    continue
+                prompts = [prompt for prompt, _, _, _ in live]
+                kwargs, context = live[0][1], live[0][3]
+                try:
+                    # Run in the first caller's context so metrics keep its evaluator
+                    responses = context.run(self.generate_batch, prompts, **kwargs)
+                except Exception as e:
+                    for _, _, future, _ in live:
+                        future.set_exception(e)
+                    continue
+                for (_, _, future, _), response in zip(live, responses):
+                    future.set_result(response)
+
+    def close(self) -> None:
+        """Stop the thread after the requests already queued"""
+        with self._lock:
+            if self._thread is not None:
+                self._queue.put(None)
+                self._thread.join()
+                self._thread = None
+
+
+class HFClientVLLM(LLMClient):
+    """Concrete implementation for local Hugging Face models with vLLM acceleration. Tested with a100 cuda 12.3, torch 2.6.0
+
+    a_generate is served either by vLLM's AsyncLLMEngine (`async_engine=True`), whose
+    scheduler batches concurrent requests continuously, or by a worker thread that groups
+    concurrent requests into `generate_batch` calls on the offline engine.
+    """
+
+    supports_response_schema = GuidedDecodingParams is not None
+
+    def __init__(self,
+                 model_path: str,
+                 system_message: str = "You are a helpful assistant",
+                 async_engine: bool = False,
+                 batch_size: int = 256,
+                 batch_wait: float = 0.01,
+                 **kwargs):
+        """
+        Initialize vLLM-accelerated Hugging Face client
+
+        Args:
+            model_path: Path or name of Hugging Face model
+            system_message: System prompt for conversation context
+            async_engine: Run vLLM's AsyncLLMEngine on a background event loop instead of `LLM`
+            batch_size: Most queued async requests grouped into one offline `generate_batch` call
+            batch_wait: Seconds the worker waits for more async requests before starting a batch
+            kwargs: Additional parameters for vLLM
+        """
+        # Retrieve Hugging Face token from environment variable
+        hf_token = os.getenv("HF_TOKEN")
+        if not hf_token:
+            raise ValueError("HF_TOKEN environment variable is not set")
+
+        # Authenticate with Hugging Face
+        login(token=hf_token)
+
+        self.model_path = model_path
+        self.system_message = system_message
+
+        # Rubric prompts share long identical prefixes, so reuse their KV cache across requests
+        kwargs.setdefault("enable_prefix_caching", True)
+
+        # vLLM engine settings shared by the offline and async engines
+        engine_kwargs = dict(
+            model=model_path,
+            # token=hf_token,
+            trust_remote_code=True,
+            dtype="float16",  # GPU compatibility issue https://github.com/vllm-project/vllm/issues/1157
+            tensor_parallel_size=torch.cuda.device_count(),
+            enforce_eager=True,  # https://github.com/vllm-project/vllm/issues/2248,
+            gpu_memory_utilization=0.95,
+            max_model_len=4096,
+            **kwargs
+        )
+
+        self.llm = None
+        self.engine = None
+        self._engine_loop = None
+        if async_engine:
+            # The engine's background loop is bound to the event loop it first runs on, so it
+            # gets a dedicated one; sync and async callers submit coroutines to it
+            self._engine_loop = asyncio.new_event_loop()
+            threading.Thread(target=self._engine_loop.run_forever, name="vllm-engine-loop", daemon=True).start()
+            self.engine = AsyncLLMEngine.from_engine_args(AsyncEngineArgs(**engine_kwargs))
+            self.tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
+        else:
+            # Initialize vLLM engine with optimized settings
+            self.llm = LLM(**engine_kwargs)
+            self.tokenizer = self.llm.get_tokenizer()
+        # The offline engine is not thread-safe; the async worker and to_thread callers share it
+        self._engine_lock = threading.Lock()
+        self._worker = BatchingWorker(
+            self.generate_batch, max_batch_size=batch_size, max_wait=batch_wait, name="vllm-batching"
+        )
+
+        # Configure sampling parameters
+        self.sampling_params = SamplingParams(
+            temperature=0.7,
+            top_p=0.95,
+            max_tokens=1000,  # Equivalent to max_new_tokens
+            skip_special_tokens=True
+        )
+
+    def _format_prompt(self, prompt: str) -> str:
+        """Apply the model's chat template, falling back to a plain transcript layout"""
+        tokenizer = self.tokenizer
+        if getattr(tokenizer, 'chat_template', None):
+            messages = [{"role": "user", "content": prompt}]
+            return tokenizer.apply_chat_template(
+                messages,
+                tokenize=False,
+                add_generation_prompt=True
+            )
+        return f"{self.system_message}\n\nUser: {prompt}\n\nAssistant:"
+
+    def _sampling_params(self, response_schema: Dict = None) -> SamplingParams:
+        """Default sampling params, with JSON-schema guided decoding when a schema is given"""
+        if response_schema is None:
+            return self.sampling_params
+        sampling_params = self.sampling_params.clone()
+        sampling_params.guided_decoding = GuidedDecodingParams(json=response_schema)
+        return sampling_params
+
+    def generate(self, prompt: str, response_schema: Dict = None, **kwargs) -> str:
+        return self.generate_batch([prompt], response_schema=response_schema, **kwargs)[0]
+
+    def generate_batch(self, prompts: List[str], response_schema: Dict = None, **kwargs) -> List[str]:
+        """
+        Generate responses for many prompts with a single vLLM call so the engine
+        can schedule them together with continuous batching
+
+        Args:
+            prompts: Input prompts
+            response_schema: JSON schema enforced with guided decoding
+            kwargs: Additional arguments for `LLM.generate`
+
+        Returns:
+            Generated responses in the same order as `prompts`
+        """
+        formatted_prompts = [self._format_prompt(prompt) for prompt in prompts]
+
+        # Start timing
+        start_time = time.time()
+
+        with track_call(self, "generate_batch", requests=len(prompts)) as call:
+            outputs = self._run(formatted_prompts, self._sampling_params(response_schema), **kwargs)
+            responses = self._responses(call, outputs)
+
+        # End timing
+        elapsed_time = time.time() - start_time
+        logger.info(f"vLLM optimized inference time: {elapsed_time:.2f} seconds for {len(prompts)} prompts")
+
+        return responses
+
+    def _run(self, formatted_prompts: List[str], sampling_params: SamplingParams, **kwargs) -> List[Any]:
+        """RequestOutputs for already formatted prompts from whichever engine is loaded"""
+        if self.engine is not None:
+            return self._on_engine_loop(self._a_engine_outputs(formatted_prompts, sampling_params)).result()
+        with self._engine_lock:
+            return self.llm.generate(formatted_prompts, sampling_params=sampling_params, **kwargs)
+
+    def _on_engine_loop(self, coroutine) -> Future:
+        return asyncio.run_coroutine_threadsafe(coroutine, self._engine_loop)
+
+    async def _a_engine_outputs(self, formatted_prompts: List[str], sampling_params: SamplingParams) -> List[Any]:
+        """Submit every prompt to the async engine at once and wait for the final outputs"""
+        async def final_output(prompt: str) -> Any:
+            output = None
+            async for output in self.engine.generate(prompt, sampling_params, request_id=uuid.uuid4().hex):
+                pass
+            return output
+
+        return await asyncio.gather(*(final_output(prompt) for prompt in formatted_prompts))
+
+    def _responses(self, call, outputs: List[Any]) -> List[str]:
+        """Record usage and time to first token, and extract the cleaned response texts"""
+        first_token_latencies = []
+        for output in outputs:
+            call.add_usage(len(output.prompt_token_ids or []), len(output.outputs[0].token_ids))
+            metrics = getattr(output, "metrics", None)
+            if metrics is not None and getattr(metrics, "first_token_time", None):
+                first_token_latencies.append(metrics.first_token_time - metrics.arrival_time)
+        if first_token_latencies:
+            call.time_to_first_token = sum(first_token_latencies) / len(first_token_latencies)
+        # Additional DeepSeek filtering
+        return [strip_thinking(output.outputs[0].text) for output in outputs]
+
+    def score_choices(self, prompt: str, choices: List[str]) -> Dict[str, float]:
+        """Read the distribution over `choices` from the first sampled position's logprobs"""
+        with track_call(self, "score_choices") as call:
+            outputs = self._run([self._format_prompt(prompt)], self._choice_params())
+            call.add_usage(len(outputs[0].prompt_token_ids or []), 1)
+        return self._choice_distribution(outputs[0], choices)
+
+    @staticmethod
+    def _choice_params() -> SamplingParams:
+        return SamplingParams(temperature=0, max_tokens=1, logprobs=20)
+
+    @staticmethod
+    def _choice_distribution(output: Any, choices: List[str]) -> Dict[str, float]:
+        position_logprobs = output.outputs[0].logprobs[0]
+        return normalize_choice_logprobs(
+            [(logprob.decoded_token, logprob.logprob) for logprob in position_logprobs.values()],
+            choices
+        )
+
+    async def a_generate(self, prompt: str, response_schema: Dict = None, **kwargs) -> str:
+        """Async generation; concurrent calls are batched by the engine or the worker thread"""
+        if self.engine is None:
+            return await self._worker.a_submit(prompt, response_schema=response_schema, **kwargs)
+        with track_call(self, "a_generate") as call:
+            outputs = await asyncio.wrap_future(self._on_engine_loop(
+                self._a_engine_outputs([self._format_prompt(prompt)], self._sampling_params(response_schema))
+            ))
+            return self._responses(call, outputs)[0]
+
+    async def a_score_choices(self, prompt: str, choices: List[str]) -> Dict[str, float]:
+        """Async variant of `score_choices`"""
+        if self.engine is None:
+            return await asyncio.to_thread(self.score_choices, prompt, choices)
+        with track_call(self, "a_score_choices") as call:
+            outputs = await asyncio.wrap_future(self._on_engine_loop(
+                self._a_engine_outputs([self._format_prompt(prompt)], self._choice_params())
+            ))
+            call.add_usage(len(outputs[0].prompt_token_ids or []), 1)
+        return self._choice_distribution(outputs[0], choices)
+
+    def close(self) -> None:
+        """Stop the async worker thread and the engine's event loop"""
+        self._worker.close()
+        if self._engine_loop is not None:
+            self._engine_loop.call_soon_threadsafe(self._engine_loop.stop)
+
+
+class HFClient(LLMClient):
+    """Concrete implementation for local Hugging Face models (GPU, or CPU for small models)
+
+    Prompts are generated in left-padded `model.generate` batches of up to `batch_size`,
+    bucketed by length so short prompts are not padded to the longest one. Concurrent
+    a_generate calls are queued to a worker thread that batches them the same way.
+    """
+
+    # Schema-constrained decoding needs the optional lm-format-enforcer package
+    supports_response_schema = JsonSchemaParser is not None
+
+    def __init__(self,
+                 model_path: str,
+                 system_message: str = "You are a helpful assistant",
+                 batch_size: int = 8,
+                 batch_wait: float = 0.01,
+                 **kwargs):
+        """
+        Initialize local Hugging Face client
+
+        Args:
+            model_path: Path or name of Hugging Face model
+            system_message: System prompt for conversation context
+            batch_size: Most prompts generated together in one `model.generate` call
+            batch_wait: Seconds the worker waits for more async requests before starting a batch
+            kwargs: Additional parameters
+        """
+        # Retrieve Hugging Face token from environment variable
+        hf_token = os.getenv("HF_TOKEN")
+        if not hf_token:
+            raise ValueError("HF_TOKEN environment variable is not set")
+
+        # Authenticate with Hugging Face
+        login(token=hf_token)
+
+        self.model_path = model_path
+        self.system_message = system_message
+        self.batch_size = batch_size
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_path, token=hf_token)
+        self.model = self._load_model(hf_token)
+
+        self.generation_config = GenerationConfig.from_pretrained(self.model_path)
+        # Set pad_token_id based on the tokenizer's eos_token_id.
+        eos_id = self.tokenizer.eos_token_id
+        if isinstance(eos_id, list):
+            eos_id = eos_id[0]
+        self.generation_config.pad_token_id = eos_id
+
+        # Batched prompts are padded on the left so every row ends where generation starts
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+
+        # Sync callers and the async worker share one model
+        self._model_lock = threading.Lock()
+        self._worker = BatchingWorker(
+            self.generate_batch, max_batch_size=batch_size, max_wait=batch_wait, name="hf-batching"
+        )
+
+    def _load_model(self, hf_token: str):
+        return AutoModelForCausalLM.from_pretrained(self.model_path, token=hf_token).to(self.device)
+
+    def _chat_text(self, prompt: str) -> str:
+        """Prompt text with the chat template applied, ready for batch tokenization"""
+        if getattr(self.tokenizer, 'chat_template', None):
+            messages = [{"role": "user", "content": prompt}]
+            return self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        return f"{self.system_message}\n\nUser: {prompt}\n\nAssistant:"
+
+    def _tokenize(self, texts: List[str], **kwargs):
+        # Chat templates already contain the BOS token
+        return self.tokenizer(texts, add_special_tokens=not getattr(self.tokenizer, 'chat_template', None), **kwargs)
+
+    def _generate_padded(self, texts: List[str], response_schema: Dict = None, **kwargs) -> List[str]:
+        """
+        Generate for several chat-formatted prompts with one left-padded `model.generate` call
+
+        Args:
+            texts: Prompts with the chat template applied
+            response_schema: JSON schema enforced with lm-format-enforcer
+            kwargs: Additional arguments for `model.generate`
+
+        Returns:
+            Responses in the same order as `texts`
+        """
+        max_new_tokens = kwargs.pop('max_new_tokens', 1000)
+        if response_schema is not None:
+            kwargs["prefix_allowed_tokens_fn"] = build_transformers_prefix_allowed_tokens_fn(
+                self.tokenizer, JsonSchemaParser(response_schema)
+            )
+
+        inputs = self._tokenize(texts, return_tensors="pt", padding=True).to(self.device)
+
+        with track_call(self, "generate_batch", requests=len(texts)) as call, self._model_lock:
+            outputs = self.model.generate(
+                **inputs,
+                generation_config=self.generation_config,
+                max_new_tokens=max_new_tokens,
+                **kwargs
+            )
+            # Everything after the padded prompt width is generated; finished rows are padded
+            generated = outputs[:, inputs["input_ids"].shape[-1]:]
+            pad_id = self.generation_config.pad_token_id
+            call.add_usage(int(inputs["attention_mask"].sum()), int((generated != pad_id).sum()))
+
+        # Additional filtering for DeepSeek: remove everything before and including '</think>'
+        return [strip_thinking(text) for text in self.tokenizer.batch_decode(generated, skip_special_tokens=True)]
+
+    def generate_batch(self, prompts: List[str], response_schema: Dict = None, **kwargs) -> List[str]:
+        """
+        Generate responses for many prompts in padded batches of `batch_size`. Prompts are
+        sorted by token length first, so each batch pads to similar lengths.
+
+        Args:
+            prompts: Input prompts
+            response_schema: JSON schema enforced with lm-format-enforcer
+            kwargs: Additional arguments for `model.generate` (e.g. max_new_tokens)
+
+        Returns:
+            Generated responses in the same order as `prompts`
+        """
+        texts = [self._chat_text(prompt) for prompt in prompts]
+        lengths = [len(ids) for ids in self._tokenize(texts)["input_ids"]]
+        order = sorted(range(len(texts)), key=lengths.__getitem__)
+
+        # Start time counting before generation
+        start_time = time.time()
+
+        responses = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            bucket = order[start:start + self.batch_size]
+            for index, response in zip(bucket, self._generate_padded([texts[i] for i in bucket], response_schema, **kwargs)):
+                responses[index] = response
+
+        elapsed_time = time.time() - start_time
+        logger.info(f"Inference time: {elapsed_time:.2f} seconds for {len(prompts)} prompts")
+        return responses
+
+    def generate(self, prompt: str, response_schema: Dict = None, **kwargs) -> str:
+        return self.generate_batch([prompt], response_schema=response_schema, **kwargs)[0]
+
+    def score_choices(self, prompt: str, choices: List[str]) -> Dict[str, float]:
+        """Softmax of the next-token logits restricted to the first token of each choice"""
+        input_tensor = self._tokenize([self._chat_text(prompt)], return_tensors="pt")["input_ids"].to(self.device)
+        with track_call(self, "score_choices") as call, self._model_lock, torch.no_grad():
+            logits = self.model(input_tensor).logits[0, -1]
+            call.add_usage(input_tensor.shape[-1], 1)
+        choice_ids = [self.tokenizer.encode(choice, add_special_tokens=False)[0] for choice in choices]
+        probabilities = torch.softmax(logits[choice_ids].float(), dim=-1).tolist()
+        return dict(zip(choices, probabilities))
+
+    async def a_generate(self, prompt: str, response_schema: Dict = None, **kwargs) -> str:
+        """Queue the prompt for the batching worker, which groups concurrent calls into `generate_batch`"""
+        return await self._worker.a_submit(prompt, response_schema=response_schema, **kwargs)
+
+    async def a_score_choices(self, prompt: str, choices: List[str]) -> Dict[str, float]:
+        """Async variant of `score_choices`, run off the event loop"""
+        return await asyncio.to_thread(self.score_choices, prompt, choices)
+
+    def close(self) -> None:
+        """Stop the batching worker thread"""
+        self._worker.close()
+
+
+class HFClientCPU(HFClient):
+    """
+    HFClient for machines without a GPU: weights are quantized after loading (int8 with
+    PyTorch dynamic quantization, or int4 with optional optimum-quanto), torch's thread
+    count can be pinned, and the KV cache of the long rubric prefix that prompts of one
+    evaluation type share is computed once and reused for every later prompt. Prefixes are
+    matched against the last few prompts, so they are found when dimensions interleave
+    (text_evaluation.py runs every dimension of a transcript before the next transcript).
+    """
+
+    def __init__(self,
+                 model_path: str,
+                 system_message: str = "You are a helpful assistant",
+                 quantization: str = "int8",
+                 num_threads: int = None,
+                 reuse_prefix: bool = True,
+                 min_prefix_tokens: int = 64,
+                 max_cached_prefixes: int = 8,
+                 recent_prompts: int = 16,
+                 batch_size: int = 1,
+                 **kwargs):
+        """
+        Initialize CPU Hugging Face client
+
+        Args:
+            model_path: Path or name of Hugging Face model
+            system_message: System prompt for conversation context
+            quantization: "int8", "int4" (needs optimum-quanto) or None for float32 weights
+            num_threads: Intra-op threads for torch, defaults to torch's choice
+            reuse_prefix: Cache the KV state of shared prompt prefixes; applies to batches of one prompt
+            min_prefix_tokens: Shortest shared prefix worth caching
+            max_cached_prefixes: Prefix caches kept, least recently used dropped first
+            recent_prompts: Previous prompts searched for a shared prefix when none is cached
+            batch_size: Prompts per `model.generate` call; above 1, prefix reuse is skipped
+            kwargs: Additional parameters for HFClient
+        """
+        if quantization not in (None, "int8", "int4"):
+            raise ValueError(f"Unknown quantization {quantization!r}, expected 'int8', 'int4' or None")
+        if quantization == "int4" and quanto_quantize is None:
+            raise ImportError("int4 quantization needs optimum-quanto: pip install optimum-quanto")
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.quantization = quantization
+        self.reuse_prefix = reuse_prefix
+        self.min_prefix_tokens = min_prefix_tokens
+        self.max_cached_prefixes = max_cached_prefixes
+        # Prefix token ids -> KV cache, most recently used last
+        self._prefix_caches: Dict[tuple, Any] = {}
+        # Token ids of recent prompts, searched for new shared prefixes
+        self._recent_ids: deque = deque(maxlen=recent_prompts)
+        super().__init__(model_path, system_message, batch_size=batch_size, **kwargs)
+        self.device = "cpu"
+
+    def _load_model(self, hf_token: str):
+        # Dynamic quantization works on float32 Linear layers
+        model = AutoModelForCausalLM.from_pretrained(
+            self.model_path, token=hf_token, torch_dtype=torch.float32, low_cpu_mem_usage=True
+        ).eval()
+        if self.quantization == "int8":
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        elif self.quantization == "int4":
+            quanto_quantize(model, weights=qint4)
+            quanto_freeze(model)
+        return model
+
+    def _prefix_cache(self, ids: List[int]) -> tuple:
+        """
+        Return (prefix length, KV cache) for the longest cached prefix of `ids`, caching the
+        longest prefix shared with a recent prompt when none is cached yet; (0, None) if nothing fits
+        """
+        # At least one token has to be left for generate to run the model on
+        best = max((prefix for prefix in self._prefix_caches if len(prefix) < len(ids)
+                    and tuple(ids[:len(prefix)]) == prefix), key=len, default=None)
+        if best is None:
+            shared = 0
+            for recent in self._recent_ids:
+                length = 0
+                for a, b in zip(ids[:-1], recent):
+                    if a != b:
+                        break
+                    length += 1
+                shared = max(shared, length)
+            if shared < self.min_prefix_tokens:
+                self._recent_ids.append(ids)
+                return 0, None
+            best = tuple(ids[:shared])
+            cache = DynamicCache()
+            with torch.no_grad():
+                self.model(input_ids=torch.tensor([best]), past_key_values=cache, use_cache=True)
+            self._prefix_caches[best] = cache
+            logger.info(f"Cached KV state of a {shared}-token prompt prefix")
+            while len(self._prefix_caches) > self.max_cached_prefixes:
+                self._prefix_caches.pop(next(iter(self._prefix_caches)))
+        self._recent_ids.append(ids)
+        # Re-insert to mark as most recently used
+        cache = self._prefix_caches.pop(best)
+        self._prefix_caches[best] = cache
+        return len(best), cache
+
+    def _generate_padded(self, texts: List[str], response_schema: Dict = None, **kwargs) -> List[str]:
+        if not self.reuse_prefix or len(texts) != 1:
+            return super()._generate_padded(texts, response_schema, **kwargs)
+
+        max_new_tokens = kwargs.pop('max_new_tokens', 1000)
+        if response_schema is not None:
+            kwargs["prefix_allowed_tokens_fn"] = build_transformers_prefix_allowed_tokens_fn(
+                self.tokenizer, JsonSchemaParser(response_schema)
+            )
+        ids = self._tokenize(texts)["input_ids"][0]
+
+        with track_call(self, "generate_batch") as call, self._model_lock:
+            prefix_length, cache = self._prefix_cache(ids)
+            if cache is not None:
+                # generate extends the cache in place, so each call gets its own copy
+                kwargs["past_key_values"] = copy.deepcopy(cache)
+            input_ids = torch.tensor([ids])
+            outputs = self.model.generate(
+                input_ids=input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                generation_config=self.generation_config,
+                max_new_tokens=max_new_tokens,
+                **kwargs
+            )
+            generated = outputs[0, len(ids):]
+            call.add_usage(len(ids), generated.shape[-1])
+
+        if prefix_length:
+            logger.debug(f"Reused {prefix_length} of {len(ids)} prompt tokens from the prefix cache")
+        return [strip_thinking(self.tokenizer.decode(generated, skip_special_tokens=True))]
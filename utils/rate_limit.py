@@ -0,0 +1,322 @@
+from __future__ import annotations
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Optional, Tuple
+
+from utils.instrumentation import note_retry
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+def error_status(exc: BaseException) -> Optional[int]:
+    """HTTP status carried by an openai, requests or aiohttp error, if any"""
+    status = getattr(exc, "status_code", None) or getattr(exc, "status", None)
+    if status is None:
+        response = getattr(exc, "response", None)
+        status = getattr(response, "status_code", None) or getattr(response, "status", None)
+    return status if isinstance(status, int) else None
+
+
+def is_rate_limited(exc: BaseException) -> bool:
+    return error_status(exc) == 429
+
+
+def is_timeout(exc: BaseException) -> bool:
+    # Matched by name so this module does not import openai, requests or aiohttp
+    return isinstance(exc, (TimeoutError, asyncio.TimeoutError)) or "Timeout" in type(exc).__name__
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Rate limits, timeouts, dropped connections and transient server errors"""
+    if error_status(exc) in RETRYABLE_STATUS or is_timeout(exc):
+        return True
+    return "Connection" in type(exc).__name__
+
+
+def retry_after(exc: BaseException) -> Optional[float]:
+    """Seconds requested by a Retry-After header on the error's response"""
+    headers = getattr(getattr(exc, "response", None), "headers", None) or getattr(exc, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after") or headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_tokens(prompt: str, max_tokens: int = 0) -> int:
+    """
+    Token cost of a request as counted by OpenAI-style TPM limits: the prompt
+    (roughly 4 characters per token) plus the requested completion budget
+    """
+    return len(prompt) // 4 + (max_tokens or 0)
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at `rate_per_minute`"""
+
+    def __init__(self, rate_per_minute: float, capacity: float = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float = 1) -> float:
+        """
+        Take `amount` tokens, going into debt if necessary
+
+        Returns:
+            Seconds the caller must wait before its reservation is covered
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Requests larger than the bucket would otherwise never be served
+            self.tokens -= min(amount, self.capacity)
+            return max(0.0, -self.tokens / self.rate)
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD concurrency limit: grows by about one slot per window of successful calls
+    and is multiplied by `decrease_factor` on a 429, a timeout or a slow call
+    """
+
+    def __init__(self,
+                 initial: int = 8,
+                 min_limit: int = 1,
+                 max_limit: int = 64,
+                 decrease_factor: float = 0.5,
+                 latency_threshold: float = None):
+        """
+        Args:
+            initial: Starting number of concurrent requests
+            min_limit: Lower bound for the limit
+            max_limit: Upper bound for the limit
+            decrease_factor: Multiplier applied to the limit on congestion
+            latency_threshold: Seconds above which a successful call also counts as congestion
+        """
+        self.limit = float(min(max(initial, min_limit), max_limit))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.latency_threshold = latency_threshold
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+        # Async waiters, possibly on several event loops; woken by `_wake` instead of polling
+        self._waiters: Deque[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = deque()
+
+    def _wake(self) -> None:
+        """Wake as many waiters as there are free slots; call with `_condition` held"""
+        free = int(self.limit) - self.in_flight
+        self._condition.notify(max(free, 0))
+        while free > 0 and self._waiters:
+            loop, future = self._waiters.popleft()
+            try:
+                loop.call_soon_threadsafe(lambda f=future: f.done() or f.set_result(None))
+            except RuntimeError:
+                # The waiter's loop is closed, nobody is left to take the slot
+                continue
+            free -= 1
+
+    def acquire(self) -> None:
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    async def a_acquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._condition:
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                waiter = (loop, loop.create_future())
+                self._waiters.append(waiter)
+            try:
+                await waiter[1]
+            except asyncio.CancelledError:
+                with self._condition:
+                    if waiter in self._waiters:
+                        self._waiters.remove(waiter)
+                    else:
+                        # Already woken for a slot it will not take, pass the wakeup on
+                        self._wake()
+                raise
+            # A thread may have taken the slot first, so check again
+
+    def ensure_limit(self, limit: int) -> None:
+        """Raise the current limit to at least `limit` (within `max_limit`), e.g. to a caller's concurrency"""
+        with self._condition:
+            self.limit = max(self.limit, float(min(limit, self.max_limit)))
+            self._wake()
+
+    def release(self, latency: float = None, congested: bool = False) -> None:
+        """
+        Free a slot and adjust the limit
+
+        Args:
+            latency: Wall time of the finished call
+            congested: Whether the call was rejected with a 429 or timed out
+        """
+        with self._condition:
+            self.in_flight -= 1
+            slow = self.latency_threshold is not None and latency is not None and latency > self.latency_threshold
+            now = time.monotonic()
+            if congested or slow:
+                # Cut at most once per second so a burst of 429s does not collapse the limit to the floor
+                if now - self._last_decrease > 1.0:
+                    self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                    self._last_decrease = now
+                    logger.info(f"Reduced LLM concurrency limit to {int(self.limit)}")
+            else:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._wake()
+
+
+class LLMScheduler:
+    """
+    Shared admission control for LLM requests: requests/minute and tokens/minute
+    buckets, an adaptive concurrency limit and jittered exponential-backoff retries
+    """
+
+    def __init__(self,
+                 requests_per_minute: float = None,
+                 tokens_per_minute: float = None,
+                 concurrency: AdaptiveConcurrencyLimiter = None,
+                 max_retries: int = 5,
+                 base_delay: float = 1.0,
+                 max_delay: float = 60.0):
+        """
+        Args:
+            requests_per_minute: Request rate limit, unlimited if None
+            tokens_per_minute: Token rate limit, unlimited if None
+            concurrency: Concurrency limiter, defaults to AdaptiveConcurrencyLimiter()
+            max_retries: Retries for rate-limited, timed out or transient failures
+            base_delay: Backoff base in seconds
+            max_delay: Backoff cap in seconds
+        """
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.concurrency = concurrency or AdaptiveConcurrencyLimiter()
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def _admission_delay(self, tokens: int) -> float:
+        delay = 0.0
+        if self.request_bucket is not None:
+            delay = max(delay, self.request_bucket.reserve(1))
+        if self.token_bucket is not None:
+            delay = max(delay, self.token_bucket.reserve(tokens))
+        return delay
+
+    def _backoff(self, attempt: int, exc: BaseException) -> float:
+        requested = retry_after(exc)
+        if requested is not None:
+            return min(self.max_delay, requested)
+        # Full jitter keeps concurrent retries from re-synchronising
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _should_retry(self, attempt: int, exc: BaseException) -> bool:
+        if attempt >= self.max_retries or not is_retryable(exc):
+            return False
+        logger.warning(f"LLM call failed ({type(exc).__name__}: {exc}), retry {attempt + 1}/{self.max_retries}")
+        note_retry()
+        return True
+
+    def call(self, fn: Callable[[], Any], tokens: int = 0) -> Any:
+        """
+        Run a blocking LLM call under the rate limits, retrying transient failures
+
+        Args:
+            fn: Zero-argument callable performing one request
+            tokens: Estimated token cost, see `estimate_tokens`
+
+        Returns:
+            Whatever `fn` returns
+        """
+        attempt = 0
+        while True:
+            time.sleep(self._admission_delay(tokens))
+            self.concurrency.acquire()
+            start = time.monotonic()
+            congested = False
+            try:
+                return fn()
+            except Exception as e:
+                congested = is_rate_limited(e) or is_timeout(e)
+                if not self._should_retry(attempt, e):
+                    raise
+                delay = self._backoff(attempt, e)
+            finally:
+                # Also reached on cancellation or KeyboardInterrupt, which must not leak the slot
+                self.concurrency.release(time.monotonic() - start, congested=congested)
+            time.sleep(delay)
+            attempt += 1
+
+    async def a_call(self, fn: Callable[[], Awaitable[Any]], tokens: int = 0) -> Any:
+        """Async variant of `call`; `fn` returns a fresh awaitable per attempt"""
+        attempt = 0
+        while True:
+            await asyncio.sleep(self._admission_delay(tokens))
+            await self.concurrency.a_acquire()
+            start = time.monotonic()
+            congested = False
+            try:
+                return await fn()
+            except Exception as e:
+                congested = is_rate_limited(e) or is_timeout(e)
+                if not self._should_retry(attempt, e):
+                    raise
+                delay = self._backoff(attempt, e)
+            finally:
+                # Also reached on cancellation or KeyboardInterrupt, which must not leak the slot
+                self.concurrency.release(time.monotonic() - start, congested=congested)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+_default_scheduler = None
+_default_lock = threading.Lock()
+
+
+def get_default_scheduler(initial_concurrency: int = None) -> LLMScheduler:
+    """
+    Process-wide scheduler shared by all LLM clients, configured from
+    LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE, LLM_MAX_CONCURRENCY and LLM_MAX_RETRIES
+
+    Args:
+        initial_concurrency: Concurrency the caller intends to use (e.g. `--concurrency`);
+            the limit starts at, or is raised to, this value instead of 8. It stays
+            capped by LLM_MAX_CONCURRENCY and still shrinks on 429s and timeouts.
+    """
+    global _default_scheduler
+    with _default_lock:
+        if _default_scheduler is None:
+            rpm = os.getenv("LLM_REQUESTS_PER_MINUTE")
+            tpm = os.getenv("LLM_TOKENS_PER_MINUTE")
+            max_concurrency = int(os.getenv("LLM_MAX_CONCURRENCY", "64"))
+            _default_scheduler = LLMScheduler(
+                requests_per_minute=float(rpm) if rpm else None,
+                tokens_per_minute=float(tpm) if tpm else None,
+                concurrency=AdaptiveConcurrencyLimiter(
+                    initial=min(initial_concurrency or 8, max_concurrency),
+                    max_limit=max_concurrency
+                ),
+                max_retries=int(os.getenv("LLM_MAX_RETRIES", "5")),
+            )
+        elif initial_concurrency:
+            _default_scheduler.concurrency.ensure_limit(initial_concurrency)
+        return _default_scheduler
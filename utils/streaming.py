@@ -0,0 +1,197 @@
+from __future__ import annotations
+import json
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+
+def approx_tokens(text: str) -> int:
+    # Same 4 characters per token rule as utils.rate_limit.estimate_tokens
+    return len(text) // 4
+
+
+class JSONCompletionDetector:
+    """
+    Incremental scanner that notices when the first top-level JSON object in a
+    stream of text is complete. Braces inside strings and escaped quotes are
+    ignored, and text before the opening brace (e.g. a ```json fence) is skipped.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.started = False
+        self.complete = False
+        self.position = 0
+        # Offset just past the closing brace, relative to everything fed so far
+        self.end: Optional[int] = None
+
+    def feed(self, text: str) -> bool:
+        """Scan more text; returns True once the object has been closed"""
+        if self.complete:
+            return True
+        for i, char in enumerate(text):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"' and self.started:
+                self.in_string = True
+            elif char == "{":
+                self.started = True
+                self.depth += 1
+            elif char == "}" and self.started:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.complete = True
+                    self.end = self.position + i + 1
+                    break
+        self.position += len(text)
+        return self.complete
+
+
+class ReasoningStream:
+    """
+    Accumulates a streamed completion from a reasoning model, separating the <think>
+    trace (inline in the content, or in a separate reasoning_content field) from the
+    answer. `feed` reports when reading can stop: the thinking budget is used up, or
+    the answer's JSON object is complete.
+    """
+
+    def __init__(self, thinking_budget: int = None, stop_on_json: bool = True, thinking: Optional[bool] = None):
+        """
+        Args:
+            thinking_budget: Maximum thinking tokens (approximate) before stopping, unlimited if None
+            stop_on_json: Stop as soon as the answer contains a complete JSON object
+            thinking: True if the stream starts inside a <think> trace (prompt already opened it),
+                False if it starts with the answer, None to detect a leading <think> tag
+        """
+        self.thinking_budget = thinking_budget
+        self.stop_on_json = stop_on_json
+        self.in_thinking = thinking
+        self.thinking_text = ""
+        self.answer_text = ""
+        self.budget_exceeded = False
+        self.detector = JSONCompletionDetector()
+        self._pending = ""
+        self._saw_reasoning_field = False
+
+    @property
+    def thinking_closed(self) -> bool:
+        return self.in_thinking is False
+
+    @property
+    def json_complete(self) -> bool:
+        return self.detector.complete
+
+    @property
+    def answer(self) -> str:
+        """Answer text, cut after the JSON object when one was completed"""
+        answer = self.answer_text
+        if self.detector.end is not None:
+            answer = answer[:self.detector.end]
+        return answer.strip()
+
+    def _add_answer(self, text: str) -> None:
+        if not self.answer_text:
+            text = text.lstrip()
+        if text:
+            self.answer_text += text
+            self.detector.feed(text)
+
+    def _add_content(self, text: str) -> None:
+        buffer = self._pending + text
+        self._pending = ""
+        if self.in_thinking is None:
+            stripped = buffer.lstrip()
+            if len(stripped) < len(THINK_OPEN) and THINK_OPEN.startswith(stripped):
+                # Could still become "<think>", wait for more text
+                self._pending = buffer
+                return
+            self.in_thinking = stripped.startswith(THINK_OPEN) and not self._saw_reasoning_field
+            if self.in_thinking:
+                buffer = stripped[len(THINK_OPEN):]
+        elif self.in_thinking and not self.thinking_text and buffer.lstrip().startswith(THINK_OPEN):
+            # The model repeated the tag the prompt already opened
+            buffer = buffer.lstrip()[len(THINK_OPEN):]
+
+        if not self.in_thinking:
+            self._add_answer(buffer)
+            return
+        index = buffer.find(THINK_CLOSE)
+        if index >= 0:
+            self.thinking_text += buffer[:index]
+            self.in_thinking = False
+            self._add_answer(buffer[index + len(THINK_CLOSE):])
+            return
+        # Hold back a possible partial "</think>" split across chunks
+        keep = next((n for n in range(len(THINK_CLOSE) - 1, 0, -1) if buffer.endswith(THINK_CLOSE[:n])), 0)
+        self.thinking_text += buffer[:len(buffer) - keep]
+        self._pending = buffer[len(buffer) - keep:]
+
+    def feed(self, content: str = None, reasoning: str = None) -> bool:
+        """
+        Add one streamed delta
+
+        Args:
+            content: Delta of the message content
+            reasoning: Delta of a separate reasoning field (reasoning_content), if the server uses one
+
+        Returns:
+            True when the caller should stop reading the stream
+        """
+        if reasoning:
+            self._saw_reasoning_field = True
+            self.thinking_text += reasoning
+        if content:
+            if self._saw_reasoning_field and self.in_thinking is None:
+                self.in_thinking = False
+            self._add_content(content)
+        if self.thinking_budget is not None and not self.thinking_closed \
+                and approx_tokens(self.thinking_text) > self.thinking_budget:
+            self.budget_exceeded = True
+            return True
+        return self.stop_on_json and self.json_complete
+
+    def finish(self) -> None:
+        """Flush text held back while waiting for a tag that never arrived"""
+        pending, self._pending = self._pending, ""
+        if not pending:
+            return
+        if self.in_thinking:
+            self.thinking_text += pending
+        else:
+            self._add_answer(pending)
+
+
+def iter_sse_data(lines: Iterable[Any]) -> Iterator[Dict[str, Any]]:
+    """Decode `data:` lines of an OpenAI-style server-sent event stream into chunk dicts"""
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        line = line.strip()
+        if not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return
+        yield json.loads(data)
+
+
+def chunk_deltas(chunk: Any) -> tuple:
+    """(content, reasoning_content) of the first choice of a stream chunk, as object or dict"""
+    choices = chunk.get("choices") if isinstance(chunk, dict) else chunk.choices
+    if not choices:
+        return None, None
+    if isinstance(choices[0], dict):
+        delta = choices[0].get("delta") or {}
+        return delta.get("content"), delta.get("reasoning_content")
+    delta = choices[0].delta
+    if isinstance(delta, dict):
+        return delta.get("content"), delta.get("reasoning_content")
+    return getattr(delta, "content", None), getattr(delta, "reasoning_content", None)